@@ -11,7 +11,7 @@ Nolan Schlacht
 De Xie
 
 Last Updated:
-23/11/2024
+19/10/2026
 
 TO-DO:
     - 
@@ -30,31 +30,51 @@ def get_client_username():
     current_dir = os.path.basename(os.getcwd())
     return current_dir
 
-def generate_client_keys(username):
-    """
-    Generate public/private key pair for a client
-
-    Input: username - String containing username of client to generate keys
-                      for
+def save_client_keys(username, key, directory="."):
     """
+    Write a client's key pair to PEM files
 
-    print(f"Generating keys for client: {username}")
+    Input: username - String containing username of client the keys belong to
+           key - RSA private key object
+           directory - Directory to write the key files into, defaults to
+                       the current directory
 
-    # Generate 2048-bit RSA key pair
-    key = RSA.generate(2048)
+    Output: public_key - Bytes of the exported public key (PEM)
+    """
 
     # Export private key to PEM file
     private_key = key.export_key()
-    private_key_file = f"{username}_private.pem"
+    private_key_file = os.path.join(directory, f"{username}_private.pem")
     with open(private_key_file, "wb") as f:
         f.write(private_key)
 
     # Export public key to PEM file
     public_key = key.publickey().export_key()
-    public_key_file = f"{username}_public.pem"
+    public_key_file = os.path.join(directory, f"{username}_public.pem")
     with open(public_key_file, "wb") as f:
         f.write(public_key)
 
+    return public_key
+
+def generate_client_keys(username, directory="."):
+    """
+    Generate public/private key pair for a client
+
+    Input: username - String containing username of client to generate keys
+                      for
+           directory - Directory to write the key files into, defaults to
+                       the current directory
+
+    Output: public_key - Bytes of the exported public key (PEM)
+    """
+
+    print(f"Generating keys for client: {username}")
+
+    # Generate 2048-bit RSA key pair
+    key = RSA.generate(2048)
+
+    return save_client_keys(username, key, directory)
+
 def initialize_client():
     """
     Initialize client directory with necessary files and structure.
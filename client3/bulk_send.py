@@ -0,0 +1,272 @@
+"""
+Program:
+bulk_send.py
+
+Purpose:
+Send many emails from a script, eg. for mail campaigns or load tests,
+without driving client.py's prompts. The emails are listed in a JSON
+manifest and sent over a pool of connections to the server, each logged
+in as the same client and all held by one process with asyncio (see
+async_client.py), in batches of emails written without waiting for
+replies. The throughput and the latency of each email, from the start
+of its batch to the server confirming it, are reported once every
+email is sent.
+
+The manifest is a list of emails, each of the form:
+
+    {"recipients": "client2;client3", "title": "Report",
+     "body": "report.txt", "attachments": ["chart.png"]}
+
+where body is the path of the file holding the email's contents,
+relative to the manifest, and attachments (optional) are files in the
+client's files directory. Run from within the client's directory; the
+password is read from password.txt (see provision.py) unless given.
+
+Usage:
+python3 bulk_send.py [--server HOST] [--username NAME] [--password PASS]
+                     [--concurrency N] [--batch N] [--repeat N] <manifest>
+
+Authors:
+Jack Derksen
+Nolan Schlacht
+De Xie
+
+Last Updated:
+19/10/2026
+
+TO-DO:
+    -
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import sys
+import time
+
+from async_client import AsyncEmailClient, BATCH_LIMIT
+
+
+def load_manifest(path, repeat=1):
+    """
+    Read the emails listed in a manifest, along with their contents.
+
+    Parameters:
+        path (str): Path of the manifest
+        repeat (int): Number of times to send every email
+
+    Returns:
+        list: Each email's recipients, title, contents and attachment
+              file names, as queued in the outbox
+
+    Raises:
+        ValueError: If an email's title or contents are too long, or a
+                    file it attaches is not in the files directory
+    """
+    with open(path, "r") as f:
+        entries = json.load(f)
+
+    base = os.path.dirname(os.path.abspath(path))
+    messages = []
+    for entry in entries:
+        with open(os.path.join(base, entry["body"]), "r") as f:
+            content = f.read()
+        if len(entry["title"]) > 100:
+            raise ValueError(f"Title {entry['title']} exceeds maximum "
+                             f"length of 100 characters")
+        if len(content) > 1000000:
+            raise ValueError(f"Contents of {entry['title']} exceed maximum "
+                             f"length of 1,000,000 characters")
+        for filename in entry.get("attachments", []):
+            if not os.path.isfile(os.path.join("files", filename)):
+                raise ValueError(f"File {filename} not found in files "
+                                 f"directory")
+        messages.append({"recipients": entry["recipients"],
+                         "title": entry["title"], "content": content,
+                         "attachments": entry.get("attachments", [])})
+    return messages * repeat
+
+
+class BulkSender:
+    def __init__(self, server_host, username, password, concurrency,
+                 batch_size):
+        """
+        Initialize BulkSender object.
+
+        Parameters:
+            server_host (str): Hostname/IP of server to connect to
+            username (str): Client's username
+            password (str): Client's password
+            concurrency (int): Number of connections to send over
+            batch_size (int): Number of emails sent in each batch
+
+        Properties:
+            self.server_host: Hostname/IP of server to connect to
+            self.username: Client's username
+            self.password: Client's password
+            self.concurrency: Number of connections to send over
+            self.batch_size: Number of emails sent in each batch, at most
+                             BATCH_LIMIT
+            self.batches: Batches not yet taken by a connection
+            self.latencies: Latency of each email sent, in seconds
+            self.errors: Error that ended each connection that failed
+        """
+        self.server_host = server_host
+        self.username = username
+        self.password = password
+        self.concurrency = concurrency
+        self.batch_size = max(1, min(batch_size, BATCH_LIMIT))
+        self.batches = collections.deque()
+        self.latencies = []
+        self.errors = []
+
+    def send(self, messages):
+        """
+        Send every email, sharing the batches out between the
+        connections as they become free. The connections are all held
+        by this process, as asyncio sessions (see AsyncEmailClient).
+
+        Parameters:
+            messages (list): Emails to send, see load_manifest
+
+        Returns:
+            float: Seconds taken
+        """
+        for start in range(0, len(messages), self.batch_size):
+            self.batches.append(messages[start:start + self.batch_size])
+
+        async def send_all():
+            await asyncio.gather(*(
+                self.worker()
+                for _ in range(min(self.concurrency, len(self.batches)))))
+
+        start = time.perf_counter()
+        asyncio.run(send_all())
+        return time.perf_counter() - start
+
+    async def worker(self):
+        """
+        Log in over a connection of its own and send batches until none
+        are left. The batch a connection was sending when it failed is
+        not sent again, the other connections send the rest.
+        """
+        # Each file is uploaded once per connection, however many emails
+        # attach it
+        uploaded = {}
+        try:
+            async with AsyncEmailClient(self.server_host, self.username,
+                                        self.password) as client:
+                while self.batches:
+                    await self.send_batch(client, self.batches.popleft(),
+                                          uploaded)
+        except (OSError, EOFError, ValueError) as e:
+            self.errors.append(str(e) or type(e).__name__)
+
+    async def send_batch(self, client, batch, uploaded):
+        """
+        Upload the attachments of a batch of emails, then send them.
+
+        Parameters:
+            client (AsyncEmailClient): Logged in client to send with
+            batch (list): Emails to send, see load_manifest
+            uploaded (dict): Attachment uploaded for each file over this
+                             connection
+        """
+        start = time.perf_counter()
+        results = await client.send_emails(
+            [{**message, "attachments": [os.path.join("files", filename)
+                                         for filename in
+                                         message["attachments"]]}
+             for message in batch], uploaded)
+        latency = time.perf_counter() - start
+        self.latencies += [latency] * results.count(True)
+
+
+def report(sender, total, elapsed):
+    """
+    Print the throughput and latency of a bulk send.
+
+    Parameters:
+        sender (BulkSender): Sender, once every email is sent
+        total (int): Number of emails in the send
+        elapsed (float): Seconds taken
+    """
+    failed = total - len(sender.latencies)
+    print(f"Sent {len(sender.latencies)} of {total} emails in "
+          f"{elapsed:.2f}s over {sender.concurrency} connections "
+          f"({len(sender.latencies) / elapsed:.1f} emails/s)")
+    if failed:
+        print(f"{failed} emails were not sent")
+    for error in sorted(set(sender.errors)):
+        print(f"Connection error: {error}")
+
+    if sender.latencies:
+        latencies = sorted(sender.latencies)
+        p50, p95, p99 = (
+            latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+            for p in (0.5, 0.95, 0.99))
+        print(f"Latency (ms): min {latencies[0] * 1000:.1f}  "
+              f"p50 {p50 * 1000:.1f}  p95 {p95 * 1000:.1f}  "
+              f"p99 {p99 * 1000:.1f}  max {latencies[-1] * 1000:.1f}")
+
+
+def main():
+    """
+    Parse command line arguments and send the emails in the manifest.
+    """
+    parser = argparse.ArgumentParser(
+        description="Send the emails listed in a manifest")
+    parser.add_argument("manifest", help="JSON list of emails to send")
+    parser.add_argument("--server", default="localhost",
+                        help="server IP or name")
+    parser.add_argument("--username",
+                        help="client's username (default: the client "
+                             "whose keys are in this directory)")
+    parser.add_argument("--password",
+                        help="client's password (default: password.txt)")
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="number of connections to send over")
+    parser.add_argument("--batch", type=int, default=20,
+                        help=f"emails sent in each batch, at most "
+                             f"{BATCH_LIMIT}")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="number of times to send every email")
+    args = parser.parse_args()
+
+    username = args.username
+    if username is None:
+        keys = [name[:-len("_private.pem")] for name in os.listdir(".")
+                if name.endswith("_private.pem")]
+        if len(keys) != 1:
+            parser.error("give --username, this directory does not hold "
+                         "exactly one client's keys")
+        username = keys[0]
+    elif not os.path.exists(f"{username}_private.pem"):
+        parser.error(f"{username}_private.pem not found in this directory")
+
+    password = args.password
+    if password is None:
+        try:
+            with open("password.txt", "r") as f:
+                password = f.read().strip()
+        except FileNotFoundError:
+            parser.error("give --password, password.txt not found")
+
+    try:
+        messages = load_manifest(args.manifest, args.repeat)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Error: Could not read manifest: {e}")
+        sys.exit(1)
+
+    sender = BulkSender(args.server, username, password,
+                        max(1, args.concurrency), args.batch)
+    elapsed = sender.send(messages)
+    report(sender, len(messages), elapsed)
+    if len(sender.latencies) < len(messages):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
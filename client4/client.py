@@ -3,7 +3,14 @@ Program:
 client.py
 
 Purpose:
-Perform all client-side operations for email server
+Interactive client for the email server. Prompts the user for each
+operation and displays its results; the operations themselves are run
+on an AsyncEmailClient session (see async_client.py). Emails viewed are
+kept in an encrypted local cache, so they can be read again without
+fetching them, even while the server cannot be reached. Emails can be
+queued in a local outbox, also while the server cannot be reached, and
+sent together later. Files of any type can be attached to emails, and
+are only downloaded by recipients who choose to save them.
 
 Authors:
 Jack Derksen
@@ -11,151 +18,503 @@ Nolan Schlacht
 De Xie
 
 Last Updated:
-1/12/2024
+19/10/2026
 
 TO-DO:
     - Maybe create a property for socket number like in server
 """
 
-import socket
+import asyncio
 import sys
+import codecs
 import os
-from Crypto.PublicKey import RSA
-from Crypto.Cipher import PKCS1_OAEP, AES
+import hashlib
+import json
+import time
+from Crypto.Cipher import AES
+from Crypto.Random import get_random_bytes
+
+from async_client import AsyncEmailClient, INBOX_PAGE_SIZE
+
+# Maximum total size in bytes of the emails kept in the local cache
+CACHE_SIZE = 10 * 1024 * 1024
+
+# Bytes of an email's body shown at a time when previewing it
+PREVIEW_SIZE = 1024
+
+# Maximum number of emails viewed at once, the server sends no more
+VIEW_LIMIT = 100
+
+
+def parse_indexes(text):
+    """
+    Parse a list of email indexes and ranges of indexes, eg. "1-5,8".
+
+    Parameters:
+        text (str): Indexes and inclusive ranges, separated by commas
+                    or spaces
+
+    Returns:
+        list: Indexes in the order given, without repeats, at most
+              VIEW_LIMIT of them, or None if the list is not valid
+    """
+    indexes = {}
+    for item in text.replace(",", " ").split():
+        first, _, last = item.partition("-")
+        if not first.isdigit() or not (last or first).isdigit():
+            return None
+        for index in range(int(first), int(last or first) + 1):
+            if len(indexes) < VIEW_LIMIT:
+                indexes[index] = None
+    return list(indexes)
+
+
+class MailCache:
+    def __init__(self, key, directory="cache", max_size=CACHE_SIZE):
+        """
+        Initialize MailCache object, an encrypted local copy of the emails
+        viewed, stored by email ID. Once the emails outgrow max_size, the
+        least recently viewed ones are evicted.
+
+        Parameters:
+            key (bytes): 32 byte AES key the cache is encrypted with
+            directory (str): Directory holding the cache
+            max_size (int): Maximum total size of the cached emails
+
+        Properties:
+            self.key: AES key the cache is encrypted with
+            self.directory: Directory holding the cache
+            self.max_size: Maximum total size of the cached emails
+            self.index_path: Path of the encrypted cache index
+            self.entries: Dictionary of email ID to the email's headers
+                          and size, least recently used first
+            self.last_message_id: ID of the newest email seen on sync
+            self.epoch: Epoch of the mailbox the email IDs belong to
+        """
+        self.key = key
+        self.directory = directory
+        self.max_size = max_size
+        self.index_path = os.path.join(directory, "index")
+        self.entries = {}
+        self.last_message_id = 0
+        self.epoch = None
+
+        os.makedirs(directory, exist_ok=True)
+        data = self.read_file(self.index_path)
+        if data is not None:
+            index = json.loads(data)
+            self.entries = {int(email_id): entry
+                            for email_id, entry in index["entries"]}
+            self.last_message_id = index["last_message_id"]
+            self.epoch = index.get("epoch")
+
+    def encrypt(self, data):
+        """
+        Encrypt data for storage in the cache.
+
+        Parameters:
+            data (bytes): Data to encrypt
+
+        Returns:
+            bytes: Nonce, authentication tag and ciphertext
+        """
+        nonce = get_random_bytes(16)
+        cipher = AES.new(self.key, AES.MODE_GCM, nonce=nonce)
+        ciphertext, tag = cipher.encrypt_and_digest(data)
+        return nonce + tag + ciphertext
+
+    def decrypt(self, data):
+        """
+        Decrypt data stored in the cache.
+
+        Parameters:
+            data (bytes): Nonce, authentication tag and ciphertext
+
+        Returns:
+            bytes: Decrypted data
+
+        Raises:
+            ValueError: If the data was not encrypted with this cache's key
+                        or has been altered
+        """
+        cipher = AES.new(self.key, AES.MODE_GCM, nonce=data[:16])
+        return cipher.decrypt_and_verify(data[32:], data[16:32])
+
+    def read_file(self, path):
+        """
+        Read and decrypt a cache file.
+
+        Parameters:
+            path (str): Path of the file
+
+        Returns:
+            bytes: Decrypted contents, or None if the file is missing or
+                   cannot be decrypted (eg. the client's keys changed)
+        """
+        try:
+            with open(path, "rb") as f:
+                return self.decrypt(f.read())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def write_file(self, path, data):
+        """
+        Encrypt and atomically write a cache file.
+
+        Parameters:
+            path (str): Path of the file
+            data (bytes): Contents to write
+        """
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(self.encrypt(data))
+        os.replace(tmp_path, path)
+
+    def email_path(self, email_id):
+        """
+        Get the path of a cached email.
+
+        Parameters:
+            email_id (int): Email ID
+
+        Returns:
+            str: Path of the email's cache file
+        """
+        return os.path.join(self.directory, f"{email_id}.email")
+
+    def save(self):
+        """
+        Write the cache index, in least recently used order.
+        """
+        index = {"entries": list(self.entries.items()),
+                 "last_message_id": self.last_message_id,
+                 "epoch": self.epoch}
+        self.write_file(self.index_path, json.dumps(index).encode())
+
+    def get(self, email_id):
+        """
+        Get a cached email, marking it as the most recently used.
+
+        Parameters:
+            email_id (int): Email ID
+
+        Returns:
+            str: Email text, or None if it is not cached
+        """
+        if email_id not in self.entries:
+            return None
+        data = self.read_file(self.email_path(email_id))
+        if data is None:
+            del self.entries[email_id]
+            self.save()
+            return None
+
+        self.entries[email_id] = self.entries.pop(email_id)
+        self.save()
+        return data.decode()
+
+    def put(self, email_id, content):
+        """
+        Cache an email, evicting the least recently used emails if the
+        cache grows past its maximum size.
+
+        Parameters:
+            email_id (int): Email ID
+            content (str): Email text
+        """
+        data = content.encode()
+        if len(data) > self.max_size:
+            return
+
+        lines = content.split('\n')
+        self.write_file(self.email_path(email_id), data)
+        self.entries.pop(email_id, None)
+        self.entries[email_id] = {
+            "from": lines[0].split(': ', 1)[1],
+            "date": lines[2].split(': ', 1)[1],
+            "title": lines[3].split(': ', 1)[1],
+            "size": len(data),
+        }
+
+        size = sum(entry["size"] for entry in self.entries.values())
+        while size > self.max_size:
+            oldest_id = next(iter(self.entries))
+            size -= self.entries.pop(oldest_id)["size"]
+            try:
+                os.remove(self.email_path(oldest_id))
+            except FileNotFoundError:
+                pass
+        self.save()
+
+    def check_epoch(self, epoch):
+        """
+        Empty the cache and forget the newest email seen on sync if the
+        mailbox's epoch changed, since its email IDs were given out
+        afresh and no longer match the cached emails.
+
+        Parameters:
+            epoch (str): Mailbox's current epoch
+        """
+        if epoch == self.epoch:
+            return
+        for email_id in self.entries:
+            try:
+                os.remove(self.email_path(email_id))
+            except FileNotFoundError:
+                pass
+        self.entries = {}
+        self.last_message_id = 0
+        self.epoch = epoch
+        self.save()
+
+    def set_last_message_id(self, email_id):
+        """
+        Remember the ID of the newest email seen on sync.
+
+        Parameters:
+            email_id (int): Email ID
+        """
+        if email_id != self.last_message_id:
+            self.last_message_id = email_id
+            self.save()
+
+
+class Outbox:
+    def __init__(self, directory="outbox"):
+        """
+        Initialize Outbox object, a local queue of emails waiting to be
+        sent. Each email is kept as a JSON file holding its recipients,
+        title, contents and the names of the files to attach, so emails
+        can be queued while the server cannot be reached, or written by
+        other programs, and sent together later.
+
+        Parameters:
+            directory (str): Directory holding the queued emails
+
+        Properties:
+            self.directory: Directory holding the queued emails
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def add(self, message):
+        """
+        Atomically queue an email.
+
+        Parameters:
+            message (dict): Email's recipients, title, contents and
+                            attachment file names
+
+        Returns:
+            str: Name the email is queued under
+        """
+        name = f"{time.time_ns()}.json"
+        tmp_path = os.path.join(self.directory, name + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(message, f)
+        os.replace(tmp_path, os.path.join(self.directory, name))
+        return name
+
+    def messages(self):
+        """
+        List the queued emails.
+
+        Returns:
+            list: (name, message) tuples, oldest first
+        """
+        messages = []
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith(".json"):
+                with open(os.path.join(self.directory, name), "r") as f:
+                    messages.append((name, json.load(f)))
+        return messages
+
+    def remove(self, name):
+        """
+        Remove an email from the queue once it is sent.
+
+        Parameters:
+            name (str): Name the email is queued under
+        """
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+
 
 class EmailClient:
-    def __init__(self):
+    def __init__(self, server_host=None, username=None, password=None):
         """
-        Initialize EmailClient object.
+        Initialize EmailClient object. Details not given are asked for.
+
+        Parameters:
+            server_host (str): Hostname/IP of server to connect to
+            username (str): Client's username
+            password (str): Client's password
 
         Properties:
-            self.server_host (str): Hostname/IP of server to connect to
-            self.username (str): Client's username for authentication
-            self.password (str): Client's password for authentication
-            self.private_cipher: PKCS1_OAEP cipher using client's private key
-            self.public_key_data (bytes): Client's public key data
-            self.server_cipher: PKCS1_OAEP cipher using server's public key
+            self.session: Session with the server, see AsyncEmailClient,
+                          whose operations this client runs one at a
+                          time and adds the prompts to
+            self.loop: Event loop the session's operations are run on
+            self.cache: Encrypted local cache of the emails viewed, which
+                        also remembers the newest email ID seen, only
+                        newer emails are fetched on sync
+            self.listed_ids (dict): Email ID of each index in the last
+                                    inbox list
+            self.outbox: Local queue of emails waiting to be sent
 
         Raises:
             SystemExit: Key file(s) not found in client directory
         """
 
-        self.server_host = input("Enter the server IP or name: ")
-        self.username = input("Enter your username: ")
-        self.password = input("Enter your password: ")
+        server_host = server_host or input("Enter the server IP or name: ")
+        username = username or input("Enter your username: ")
+        password = password or input("Enter your password: ")
+        self.loop = asyncio.new_event_loop()
+        self.listed_ids = {}
+        self.outbox = Outbox()
 
         try:
-            # Load client's private key
-            with open(f"{self.username}_private.pem", "rb") as f:
-                private_key = RSA.import_key(f.read())
-                self.private_cipher = PKCS1_OAEP.new(private_key)
-
-            # Load client's public key
-            with open(f"{self.username}_public.pem", "rb") as f:
-                self.public_key_data = f.read()
+            self.session = AsyncEmailClient(server_host, username, password)
 
-            # Load server's public key
-            with open("server_public.pem", "rb") as f:
-                server_key = RSA.import_key(f.read())
-                self.server_cipher = PKCS1_OAEP.new(server_key)
+            # The cache key is derived from the private key, so only this
+            # client can read its cache
+            self.cache = MailCache(hashlib.sha256(
+                b"mail cache" +
+                self.session.private_key.export_key("DER")).digest())
 
         except FileNotFoundError:
             print("Could not load needed resource/file.")
             print("Terminating.")
             sys.exit(1)
 
+    def call(self, operation):
+        """
+        Run one of the session's operations to completion.
+
+        Parameters:
+            operation: Coroutine of an AsyncEmailClient operation
+
+        Returns:
+            The operation's result
+        """
+        return self.loop.run_until_complete(operation)
+
     def connect(self):
         """
         Establish connection to email server.
 
-        Creates a TCP socket connection to the server using the stored
-        server hostname and port 13000.
+        If the server cannot be reached, emails in the local cache can
+        still be viewed, and emails can be queued in the outbox to be
+        sent later.
 
         Raises:
             SystemExit: If connection fails
         """
         try:
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.connect((self.server_host, 13000))
-        except Exception:
+            self.call(self.session.open())
+        except OSError:
             print("Could not connect to server")
+            if self.cache.entries:
+                self.view_offline()
+            self.queue_offline()
             print("Terminating.")
             sys.exit(1)
 
-    def authenticate(self):
+    def view_offline(self):
         """
-        Perform authentication with the server.
+        List the emails in the local cache and display them on request,
+        without a connection to the server.
+        """
+        emails = list(reversed(self.cache.entries.items()))
+        h = ["Index", "From", "DateTime", "Title"]
+        print("\nCached emails, most recently viewed first:")
+        print(f"{h[0]:<8} {h[1]:<9} {h[2]:<30} {h[3]:<20}")
+        for index, (_, email) in enumerate(emails, start=1):
+            print(f"{index:<8} {email['from']:<9} {email['date']:<30} "
+                  f"{email['title']:<20}")
+
+        while True:
+            index = input("Enter the email index you wish to view "
+                          "(blank to quit): ").strip()
+            if not index.isdigit():
+                return
+            if not 1 <= int(index) <= len(emails):
+                print("\nError: Invalid email index")
+                continue
+            print(self.cache.get(emails[int(index) - 1][0]))
+
+    def queue_offline(self):
+        """
+        Queue emails in the outbox while the server cannot be reached,
+        to be sent with option 10 once it can.
+        """
+        while True:
+            more = input("Write an email to send once the server can be "
+                         "reached? (Y/N) ")
+            if more.upper() != 'Y':
+                return
+            message = self.compose_email()
+            if message is not None:
+                self.outbox.add(message)
+                print("The email is queued in the outbox.")
 
-        Sends encrypted credentials to server and handles the authentication
-        protocol including key exchange for first-time connections.
+    def authenticate(self):
+        """
+        Log in to the server, see AsyncEmailClient.authenticate. The
+        local cache is emptied if the mailbox's emails were numbered
+        afresh since it was filled (see MailCache.check_epoch).
 
         Returns:
             bool: True if authentication successful, False otherwise
-
-        Sets:
-            self.sym_key: Symmetric key for session encryption
-            self.cipher: AES cipher using symmetric key
         """
         try:
-            # Encrypt credentials with server's public key and send
-            credentials = f"{self.username}:{self.password}"
-            encrypted_credentials = self.server_cipher.encrypt(
-                credentials.encode())
-            self.socket.send(encrypted_credentials)
-
-            # Get server response
-            response = self.socket.recv(1024)
-
-            # Handle server response
-            if response == b"NEW_CLIENT":
-                self.socket.send(self.public_key_data)
-                # Receive symmetric key
-                response = self.socket.recv(1024)
-            elif response == b"Invalid username or password":
-                print("Invalid username or password.")
-                print("Terminating.")
-                return False
-
-            try:
-                # Decrypt symmetric key and create cipher
-                self.sym_key = self.private_cipher.decrypt(response)
-                self.cipher = AES.new(self.sym_key, AES.MODE_ECB)
-
-                # Send acknowledgment
-                encrypted_ack = self.cipher.encrypt(b"OK".ljust(16))
-                self.socket.send(encrypted_ack)
-                return True
-
-            except Exception as _:
-                print("Decryption of symmetric key failed.")
-                print("Terminating.")
-                return False
-
-        except Exception as _:
+            self.call(self.session.login())
+            self.cache.check_epoch(self.call(self.session.mailbox_epoch()))
+            return True
+        except ConnectionError as e:
+            print(f"{e}.")
+        except (OSError, EOFError):
             print("Error validating credentials.")
-            print("Terminating.")
-            return False
+        print("Terminating.")
+        return False
 
     def create_email(self):
         """
         Create and send an email message.
 
-        Prompts user for email details including recipients, title, and content.
-        Content can be loaded from a file or entered directly.
-        Validates message lengths and sends encrypted email to server.
+        Prompts user for email details (see compose_email), then sends
+        it along with the files attached, see
+        AsyncEmailClient.send_emails. If the connection is lost, the
+        client reconnects and resumes the upload or sends the email
+        again, the attachments already uploaded are kept.
+        """
+        message = self.compose_email()
+        if message is None:
+            return
+
+        results = self.call(self.session.send_emails([{
+            **message, "attachments": [os.path.join("files", filename)
+                                       for filename in
+                                       message["attachments"]]}]))
+        if results[0]:
+            print("The message is sent to the server.")
+        else:
+            print("Error: The message could not be sent")
 
-        Message format:
-            From: [username]
-            To: [recipients]
-            Title: [title]
-            Content Length: [length]
-            Content:
-            [content]
+    def compose_email(self):
         """
-        # Wait for server prompt
-        encrypted_prompt = self.socket.recv(1024)
-        self.cipher.decrypt(encrypted_prompt)
+        Prompt user for the details of an email.
+
+        Prompts for recipients, title, and content. Content can be
+        loaded from a file or entered directly, and files from the
+        files directory can be attached. Validates message lengths.
 
+        Returns:
+            dict: Email's recipients, title, contents and attachment file
+                  names, or None if an entry was invalid
+        """
         # Get email details
         recipients = input("Enter destinations (separated by ;): ")
         title = input("Enter title: ")
@@ -163,8 +522,7 @@ class EmailClient:
         # Validate title length
         if len(title) > 100:
             print("Error: Title exceeds maximum length of 100 characters")
-            self.socket.send(self.cipher.encrypt(b"NOK".ljust(16)))
-            return
+            return None
 
         # Get content choice
         content_choice = input(
@@ -188,70 +546,428 @@ class EmailClient:
                     content = f.read()
             except FileNotFoundError:
                 print(f"Error: File {filename} not found in files directory")
-                #self.socket.send(self.cipher.encrypt(b"NOK".ljust(16)))
-                return
+                return None
         else:
             content = input("Enter message contents: ")
 
         # Validate content length
         if len(content) > 1000000:
             print("Error: Content exceeds maximum length of 1,000,000 characters")
-            self.socket.send(self.cipher.encrypt(b"NOK".ljust(16)))
-            return
+            return None
 
-        # Construct email
-        email = (
-            f"From: {self.username}\n"
-            f"To: {recipients}\n"
-            f"Title: {title}\n"
-            f"Content Length: {len(content)}\n"
-            f"Content:\n"
-            f"{content}"
-        )
+        # Get attachments, read as binary files of any size when sent
+        filenames = input("Enter files to attach (separated by ;, "
+                          "blank for none): ")
+        attachments = list(filter(None, map(str.strip, filenames.split(';'))))
+        for filename in attachments:
+            if not os.path.isfile(os.path.join("files", filename)):
+                print(f"Error: File {filename} not found in files directory")
+                return None
 
-        # Encrypt and send
-        encrypted_email = self.cipher.encrypt(
-            email.encode().ljust((len(email) // 16 + 1) * 16))
-        self.socket.send(encrypted_email)
-        print("The message is sent to the server.")
+        return {"recipients": recipients, "title": title,
+                "content": content, "attachments": attachments}
 
-    def view_inbox(self):
+    def flush_outbox(self):
         """
-        Display list of emails in inbox.
+        Send every email queued in the outbox over this connection.
 
-        Receives encrypted inbox listing from server, decrypts and displays it.
-        Sends acknowledgment back to server after displaying.
+        The files attached to the queued emails are uploaded first, then
+        the emails are sent in batches of up to BATCH_LIMIT, each one
+        written to the server without waiting for a reply, and the
+        server confirms the whole batch at once. Sent emails leave the
+        outbox, emails that could not be sent stay in it.
         """
-        encrypted_list = self.socket.recv(4096)
-        inbox_list = self.cipher.decrypt(encrypted_list).strip().decode()
-        print(inbox_list)
+        queued = self.outbox.messages()
 
-        # Send acknowledgment
-        self.socket.send(self.cipher.encrypt(b"OK".ljust(16)))
+        ready = []
+        for name, message in queued:
+            paths = [os.path.join("files", filename)
+                     for filename in message["attachments"]]
+            missing = [filename for filename, path in
+                       zip(message["attachments"], paths)
+                       if not os.path.isfile(path)]
+            if missing:
+                print(f"Error: File {missing[0]} not found in files "
+                      f"directory, {message['title']} stays queued")
+                continue
+            ready.append((name, {**message, "attachments": paths}))
+
+        results = self.call(self.session.send_emails(
+            [message for _, message in ready]))
+        sent = 0
+        for (name, message), result in zip(ready, results):
+            if result:
+                self.outbox.remove(name)
+                sent += 1
+            else:
+                print(f"Error: {message['title']} could not be sent, it "
+                      f"stays queued")
+
+        print(f"{sent} of {len(queued)} queued emails sent.")
+
+    def view_inbox(self, filters=None):
+        """
+        Display list of emails in inbox, one page at a time.
+
+        Displays a page of the inbox listing, then offers to show the
+        next page, if there is one. Remembers the ID of each email
+        listed, so emails already in the local cache are not fetched
+        again.
+
+        Parameters:
+            filters (dict): Filters and order to list the inbox with,
+                            None for the whole inbox newest first
+        """
+        self.listed_ids = {}
+        offset = 0
+        while True:
+            if filters is None:
+                total, ids, inbox_list = self.call(
+                    self.session.list_inbox(offset))
+            else:
+                total, ids, inbox_list = self.call(
+                    self.session.query_inbox(offset, **filters))
+            self.listed_ids.update(ids)
+            print(inbox_list)
+
+            shown = min(offset + INBOX_PAGE_SIZE, total)
+            if shown >= total:
+                return
+
+            more = input(f"Showing {offset + 1}-{shown} of {total} emails. "
+                         f"Show more? (Y/N) ")
+            if more.upper() != 'Y':
+                return
+            offset = shown
+
+    def ask_filters(self):
+        """
+        Prompt user for filters and an order for the inbox list.
+        Blank answers leave a filter out.
+
+        Returns:
+            dict: Filters and order, as sent to the server
+        """
+        filters = {
+            "sender": input("From (blank for anyone): ").strip(),
+            "title_prefix": input("Title starts with (blank for any): "
+                                  ).strip(),
+            "after": input("Sent on or after (eg. 2026-10-19, "
+                           "blank for any): ").strip(),
+            "before": input("Sent before (eg. 2026-10-20, blank for any): "
+                            ).strip(),
+        }
+        filters = {key: value for key, value in filters.items() if value}
+
+        sort = input("Sort by date, from or title (blank for date): "
+                     ).strip().lower()
+        while sort not in ("", "date", "from", "title"):
+            sort = input("Sort by date, from or title: ").strip().lower()
+        filters["sort"] = sort or "date"
+
+        order = input("Order ascending or descending (A/D, blank for D): ")
+        filters["descending"] = order.strip().upper() != 'A'
+        return filters
 
     def view_email(self):
         """
         Display contents of a specific email.
 
-        Prompts user for email index, sends request to server,
-        receives and displays the decrypted email contents.
+        Prompts user for email index, fetches and displays the email.
+        Emails already in the local cache are displayed from it, the
+        server is only told the email was viewed. The email's
+        attachments can then be saved. Several indexes can be given at
+        once, see view_emails.
         """
-        # Receive server request
-        encrypted_request = self.socket.recv(1024)
-        self.cipher.decrypt(encrypted_request)
-
-        # Send email index
-        index = input("Enter the email index you wish to view: ")
-        encrypted_index = self.cipher.encrypt(index.encode().ljust(16))
-        self.socket.send(encrypted_index)
+        index = input("Enter the email index you wish to view "
+                      "(or several, eg. 1-5,8): ").strip()
+        if any(separator in index for separator in ", -"):
+            self.view_emails(index)
+            return
 
-        # Receive and display email
-        encrypted_email = self.socket.recv(4096)
-        email = self.cipher.decrypt(encrypted_email).strip().decode()
-        if not email.startswith("Invalid"):
+        email_id = self.listed_ids.get(index)
+        email = self.cache.get(email_id) if email_id else None
+        if email is not None:
+            self.call(self.session.mark_seen(email_id))
             print(email)
-        else:
-            print(f"\nError: {email}")
+            self.save_attachments(email_id, email)
+            return
+
+        # Emails listed are fetched by ID, so emails arriving since do
+        # not shift them, other indexes are counted by the server
+        emails = {}
+        if email_id:
+            emails = self.call(self.session.get_emails([email_id]))
+        elif index.isdigit():
+            emails = self.call(self.session.get_emails([], [int(index)]))
+        if not emails:
+            print("\nError: Invalid email index")
+            return
+
+        email_id, email = next(iter(emails.items()))
+        print(email)
+        self.cache.put(email_id, email)
+        self.save_attachments(email_id, email)
+
+    def view_emails(self, indexes):
+        """
+        Display several emails, fetched in one request.
+
+        Emails in the local cache are displayed from it, and the rest
+        are requested from the server together, which sends them all
+        back in one reply rather than one round trip each. Emails in
+        the last inbox list are requested by their IDs, so emails
+        arriving since then do not shift them; only indexes that were
+        never listed are left for the server to count.
+
+        Parameters:
+            indexes (str): Email indexes and ranges of indexes
+        """
+        indexes = parse_indexes(indexes)
+        if not indexes:
+            print("\nError: Invalid email index")
+            return
+
+        missing_ids = []
+        unlisted = []
+        for index in indexes:
+            email_id = self.listed_ids.get(str(index))
+            email = self.cache.get(email_id) if email_id else None
+            if email is not None:
+                print(f"\n--- Email {index} ---\n{email}")
+            elif email_id:
+                missing_ids.append(email_id)
+            else:
+                unlisted.append(index)
+        if not missing_ids and not unlisted:
+            return
+
+        emails = self.call(self.session.get_emails(missing_ids, unlisted))
+        listed_indexes = {email_id: index
+                          for index, email_id in self.listed_ids.items()}
+        for email_id, email in emails.items():
+            label = listed_indexes.get(email_id, f"ID {email_id}")
+            print(f"\n--- Email {label} ---\n{email}")
+            self.cache.put(email_id, email)
+
+        requested = len(missing_ids) + len(unlisted)
+        if len(emails) < requested:
+            print(f"\n{requested - len(emails)} of the indexes "
+                  f"given were invalid")
+
+    def save_attachments(self, email_id, email):
+        """
+        Offer to save the attachments of an email that was just viewed.
+
+        Each attachment chosen is downloaded a chunk at a time and
+        written to the files directory, so attachments are only
+        downloaded when wanted.
+
+        Parameters:
+            email_id (int): Email ID
+            email (str): Email text
+        """
+        lines = email.split('\n')
+        attachments = []
+        for line in lines[:lines.index("Content:")]:
+            if line.startswith("Attachments: "):
+                attachments = json.loads(line.split(': ', 1)[1])
+        if not attachments:
+            return
+
+        print("\nAttachments:")
+        for number, attachment in enumerate(attachments, start=1):
+            print(f"\t{number}) {attachment['name']} "
+                  f"({attachment['size']} bytes)")
+
+        while True:
+            number = input("Enter the attachment number to save "
+                           "(blank for none): ").strip()
+            if not number.isdigit():
+                return
+            if not 1 <= int(number) <= len(attachments):
+                print("\nError: Invalid attachment number")
+                continue
+
+            self.download_attachment(email_id, int(number),
+                                     attachments[int(number) - 1]["name"])
+
+    def download_attachment(self, email_id, number, filename):
+        """
+        Download one of an email's attachments and save it in the files
+        directory, see AsyncEmailClient.fetch_attachment.
+
+        Chunks are written to a .part file as they arrive, which is
+        renamed once the attachment is complete and every chunk matched
+        its hash, or removed if one did not.
+
+        Parameters:
+            email_id (int): Email ID
+            number (int): Attachment's position in the email's list,
+                          counting from 1
+            filename (str): Attachment's name, as listed in the email
+
+        Raises:
+            ConnectionError: If the connection is lost and cannot be
+                             made again
+        """
+        # Never overwrite an existing file
+        os.makedirs("files", exist_ok=True)
+        name, extension = os.path.splitext(os.path.basename(filename))
+        filepath = os.path.join("files", name + extension)
+        copy = 1
+        while os.path.exists(filepath):
+            filepath = os.path.join("files", f"{name} ({copy}){extension}")
+            copy += 1
+
+        # Only a file whose every chunk was verified is saved
+        try:
+            with open(filepath + ".part", "wb") as f:
+                download = self.call(
+                    self.session.fetch_attachment(email_id, number, f))
+        except ValueError as e:
+            os.remove(filepath + ".part")
+            print(f"\nError: {e}, it was not saved")
+            return
+        except BaseException:
+            os.remove(filepath + ".part")
+            raise
+
+        if download is None:
+            os.remove(filepath + ".part")
+            print("\nError: Attachment is no longer available")
+            return
+        os.replace(filepath + ".part", filepath)
+        print(f"Saved {filepath}")
+
+    def preview_email(self, email_id):
+        """
+        Display an email's header lines and the start of its body,
+        showing more of the body on request.
+
+        Only the header lines and the part of the body shown are
+        downloaded, PREVIEW_SIZE bytes at a time, and the email is not
+        marked as seen. Its attachments can be saved as when viewing it.
+
+        Parameters:
+            email_id (int): Email ID, 0 if the index was not listed
+        """
+        headers = self.call(self.session.fetch_headers(email_id)) \
+            if email_id else None
+        if headers is None:
+            print("\nError: Invalid email index")
+            return
+        print(headers["headers"], end='')
+
+        # Body ranges are counted in bytes, so a character split between
+        # two ranges is decoded once the rest of it arrives
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        body_length = headers["body_length"]
+        start = 0
+        while start < body_length:
+            if start:
+                more = input(f"\n[Shown {start} of {body_length} bytes. "
+                             f"Show more? (Y/N)] ")
+                if more.upper() != 'Y':
+                    break
+
+            part = self.call(
+                self.session.fetch_body(email_id, start, PREVIEW_SIZE))
+            if not part:
+                break
+            print(decoder.decode(part), end='')
+            start += len(part)
+        print()
+
+        self.save_attachments(email_id, headers["headers"])
+
+    def sync_inbox(self):
+        """
+        Display emails delivered since the inbox was last checked.
+
+        Fetches the emails newer than the last email ID seen, displays
+        them, and keeps the newest ID in the local cache for the next
+        check.
+
+        Returns:
+            list: New emails' headers, oldest first
+        """
+        newest_id, emails = self.call(
+            self.session.sync(self.cache.last_message_id))
+        self.show_new_emails(newest_id, emails)
+        if not emails:
+            print("No new emails.")
+        return emails
+
+    def wait_for_emails(self):
+        """
+        Display new emails as the server pushes them, until the user
+        presses Enter.
+
+        Each push lists the emails delivered since the last one, and
+        the newest ID is kept in the local cache.
+        """
+        print("Waiting for new emails, press Enter to stop.")
+        stop = self.loop.create_future()
+
+        def stop_waiting():
+            sys.stdin.readline()
+            self.loop.remove_reader(sys.stdin)
+            stop.set_result(None)
+
+        self.loop.add_reader(sys.stdin, stop_waiting)
+        try:
+            while not stop.done():
+                newest_id, emails = self.call(self.session.idle(
+                    self.cache.last_message_id, stop=stop))
+                self.show_new_emails(newest_id, emails)
+        finally:
+            if not stop.done():
+                self.loop.remove_reader(sys.stdin)
+
+    def show_new_emails(self, newest_id, emails):
+        """
+        Display a list of new emails, and keep the newest ID in the
+        local cache.
+
+        Parameters:
+            newest_id (int): ID of the newest email
+            emails (list): New emails' headers, oldest first
+        """
+        self.cache.set_last_message_id(newest_id)
+        if not emails:
+            return
+
+        h = ["ID", "From", "DateTime", "Title"]
+        print(f"{h[0]:<8} {h[1]:<9} {h[2]:<30} {h[3]:<20}")
+        for email in emails:
+            print(f"{email['id']:<8} {email['from']:<9} {email['date']:<30} "
+                  f"{email['title']:<20}")
+
+    def search(self, query):
+        """
+        Display the emails matching a search, and remember the ID of
+        each email listed, like the inbox list.
+
+        Parameters:
+            query (str): Words to search for, eg. "from:client1 report"
+
+        Returns:
+            list: Matching emails' headers, newest first
+        """
+        emails = self.call(self.session.search(query))
+        if not emails:
+            print("No matching emails.")
+            return emails
+
+        self.listed_ids = {}
+        h = ["Index", "From", "DateTime", "Title"]
+        print(f"{h[0]:<8} {h[1]:<9} {h[2]:<30} {h[3]:<20}")
+        for email in emails:
+            self.listed_ids[str(email["index"])] = email["id"]
+            print(f"{email['index']:<8} {email['from']:<9} "
+                  f"{email['date']:<30} {email['title']:<20}")
+        return emails
 
     def run(self):
         """
@@ -263,6 +979,12 @@ class EmailClient:
             2. Viewing inbox
             3. Viewing specific emails
             4. Terminating connection
+            5. Checking for new emails
+            6. Waiting for new emails
+            7. Searching emails
+            8. Filtering and sorting inbox
+            9. Previewing emails
+            10. Sending the emails queued in the outbox
 
         Ensures proper cleanup of resources on exit.
         """
@@ -271,26 +993,25 @@ class EmailClient:
             if not self.authenticate():
                 return
 
+            queued = len(self.outbox.messages())
+            if queued:
+                print(f"{queued} emails are queued in the outbox, "
+                      f"choose option 10 to send them.")
+
             while True:
-                # Receive and decrypt menu
-                encrypted_menu = self.socket.recv(4096)
-                menu = self.cipher.decrypt(encrypted_menu).decode()
-                print(menu, end='')
+                # Display the menu the server sent after the last command
+                print(self.session.menu, end='')
 
                 # Get user choice
                 choice = input().strip()
                 # Ensure user choice is a valid option
                 is_num = choice.isnumeric()
-                while is_num == False or int(choice) < 0 or int(choice) > 4:
+                while is_num == False or int(choice) < 1 or int(choice) > 10:
                     choice = input("choice:").strip()
                     is_num = choice.isnumeric()
 
-                # Encrypt and send choice
-                encrypted_choice = self.cipher.encrypt(
-                    choice.encode().ljust(16))
-                self.socket.send(encrypted_choice)
-
-                # Handle user choice
+                # Handle user choice, each operation sends its own
+                # commands
                 if choice == '1':
                     self.create_email()
                 elif choice == '2':
@@ -298,15 +1019,33 @@ class EmailClient:
                 elif choice == '3':
                     self.view_email()
                 elif choice == '4':
+                    self.call(self.session.close())
                     print("The connection is terminated with the server.")
                     break
+                elif choice == '5':
+                    self.sync_inbox()
+                elif choice == '6':
+                    self.wait_for_emails()
+                elif choice == '7':
+                    query = input("Enter words to search for "
+                                  "(eg. from:client1 title:report): ")
+                    self.search(query)
+                elif choice == '8':
+                    self.view_inbox(filters=self.ask_filters())
+                elif choice == '9':
+                    index = input("Enter the email index you wish to "
+                                  "preview: ").strip()
+                    self.preview_email(self.listed_ids.get(index, 0))
+                elif choice == '10':
+                    self.flush_outbox()
 
         except KeyboardInterrupt:
             print("\nClient terminated by user.")
         except Exception as e:
             print(f"An error occurred: {e}")
         finally:
-            self.socket.close()
+            self.call(self.session.close())
+            self.loop.close()
 
 
 def main():
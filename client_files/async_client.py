@@ -0,0 +1,908 @@
+"""
+Program:
+async_client.py
+
+Purpose:
+Speak the email server's protocol with asyncio. AsyncEmailClient logs
+in, sends and fetches emails and transfers attachments, each operation
+a coroutine that returns its result rather than printing it, so
+programs that hold many sessions at once in one process (eg. gateways,
+bots or load generators) can keep thousands of them waiting on the
+server side by side without a thread each. The interactive client in
+client.py runs its operations on it too, and only adds the prompts.
+
+    async with AsyncEmailClient("localhost", "client1", "pass") as c:
+        await c.send_email("client2", "Hello", "Hi there")
+        newest_id, emails = await c.sync(0)
+
+Authors:
+Jack Derksen
+Nolan Schlacht
+De Xie
+
+Last Updated:
+19/10/2026
+
+TO-DO:
+    -
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import struct
+from Crypto.PublicKey import RSA
+from Crypto.Cipher import PKCS1_OAEP, AES
+
+# Number of emails listed per page of the inbox list
+INBOX_PAGE_SIZE = 20
+
+# Size in bytes of the chunks attachments are uploaded in
+ATTACHMENT_CHUNK_SIZE = 256 * 1024
+
+# Maximum number of emails sent in one batch, the server takes no more
+BATCH_LIMIT = 100
+
+# Times a lost connection is retried, and seconds between tries, before
+# a transfer is given up on
+RECONNECT_ATTEMPTS = 5
+RECONNECT_DELAY = 2
+
+
+def load_keys(username, directory="."):
+    """
+    Load a client's key pair and the server's public key from the
+    client's directory.
+
+    Parameters:
+        username (str): Client's username
+        directory (str): Client's directory
+
+    Returns:
+        tuple: (client's private key, client's public key data,
+                fingerprint of the client's public key, server's
+                public key, ID of the server's public key)
+
+    Raises:
+        FileNotFoundError: Key file(s) not found in client directory
+    """
+    with open(os.path.join(directory, f"{username}_private.pem"),
+              "rb") as f:
+        private_key = RSA.import_key(f.read())
+
+    with open(os.path.join(directory, f"{username}_public.pem"),
+              "rb") as f:
+        public_key_data = f.read()
+    key_fingerprint = hashlib.sha256(
+        RSA.import_key(public_key_data).export_key("DER")).hexdigest()
+
+    with open(os.path.join(directory, "server_public.pem"), "rb") as f:
+        server_key = RSA.import_key(f.read())
+    server_key_id = hashlib.sha256(
+        server_key.export_key("DER")).hexdigest()[:16]
+
+    return (private_key, public_key_data, key_fingerprint, server_key,
+            server_key_id)
+
+
+def format_email(username, message, attachments):
+    """
+    Build the text of an email to send.
+
+    Parameters:
+        username (str): Sending client's username
+        message (dict): Email's recipients, title and contents
+        attachments (list): Uploaded attachments' names, sizes and IDs
+
+    Returns:
+        str: Email text
+
+    Message format:
+        From: [username]
+        To: [recipients]
+        Title: [title]
+        Content Length: [length]
+        Attachments: [JSON list, only if files are attached]
+        Content:
+        [content]
+    """
+    email = (
+        f"From: {username}\n"
+        f"To: {message['recipients']}\n"
+        f"Title: {message['title']}\n"
+        f"Content Length: {len(message['content'])}\n"
+    )
+    if attachments:
+        email += f"Attachments: {json.dumps(attachments)}\n"
+    email += (
+        f"Content:\n"
+        f"{message['content']}"
+    )
+    return email
+
+
+class AsyncEmailClient:
+    def __init__(self, server_host, username, password, directory=".",
+                 port=13000):
+        """
+        Initialize AsyncEmailClient object.
+
+        Parameters:
+            server_host (str): Hostname/IP of server to connect to
+            username (str): Client's username
+            password (str): Client's password
+            directory (str): Client's directory, holding its keys and
+                             server_public.pem, so one process can hold
+                             sessions for clients set up in different
+                             directories
+            port (int): Server's port
+
+        Properties:
+            self.server_host (str): Hostname/IP of server to connect to
+            self.port (int): Server's port
+            self.username (str): Client's username for authentication
+            self.password (str): Client's password for authentication
+            self.private_key: Client's private key
+            self.private_cipher: PKCS1_OAEP cipher using client's private key
+            self.public_key_data (bytes): Client's public key data
+            self.key_fingerprint (str): Fingerprint of client's public key
+            self.server_cipher: PKCS1_OAEP cipher using server's public key
+            self.server_key_id (str): ID of the server's public key
+            self.session_ticket (str): Ticket from the last login, sent in
+                                       place of the password on reconnect
+            self.reader: Stream the server's replies are read from
+            self.writer: Stream commands are written to
+            self.menu (str): Menu the server sent after the last command
+
+        Raises:
+            FileNotFoundError: Key file(s) not found in client directory
+        """
+        self.server_host = server_host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.session_ticket = None
+        self.reader = None
+        self.writer = None
+        self.menu = ""
+
+        (self.private_key, self.public_key_data, self.key_fingerprint,
+         server_key, self.server_key_id) = load_keys(username, directory)
+        self.private_cipher = PKCS1_OAEP.new(self.private_key)
+        self.server_cipher = PKCS1_OAEP.new(server_key)
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def connect(self):
+        """
+        Connect and log in to the server, using the session ticket from
+        an earlier login if there is one.
+
+        Raises:
+            OSError: If the server cannot be reached
+            ConnectionError: If the client cannot log in
+        """
+        await self.open()
+        await self.login()
+
+    async def open(self):
+        """
+        Open a connection to the server, without logging in.
+
+        Raises:
+            OSError: If the server cannot be reached
+        """
+        self.reader, self.writer = await asyncio.open_connection(
+            self.server_host, self.port)
+
+    async def login(self):
+        """
+        Log in over the open connection and receive the first menu.
+        The connection is closed if the client cannot log in. If the
+        session ticket is refused (eg. the server restarted since it
+        was issued), the client logs in again with its password over a
+        new connection.
+
+        Raises:
+            OSError: If the server cannot be reached again after the
+                     ticket is refused
+            ConnectionError: If the client cannot log in
+        """
+        ticket = self.session_ticket
+        try:
+            await self.authenticate()
+            await self.recv_menu()
+            return
+        except ConnectionError:
+            self.writer.close()
+            self.writer = None
+            # authenticate only drops the ticket when the server refused it
+            if ticket is None or self.session_ticket is not None:
+                raise
+        except BaseException:
+            self.writer.close()
+            self.writer = None
+            raise
+
+        await self.open()
+        await self.login()
+
+    async def reconnect(self):
+        """
+        Connect and log in to the server again after the connection was
+        lost, eg. to resume an attachment transfer.
+
+        Raises:
+            ConnectionError: If the server cannot be reached or the
+                             client cannot log in
+        """
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        for attempt in range(RECONNECT_ATTEMPTS):
+            await asyncio.sleep(RECONNECT_DELAY)
+            try:
+                await self.open()
+            except OSError:
+                continue
+            await self.login()
+            return
+        raise ConnectionError("Could not reconnect to server")
+
+    async def authenticate(self):
+        """
+        Perform authentication with the server.
+
+        Sends encrypted credentials, along with the fingerprint of the
+        client's public key and tagged with the ID of the server key used
+        to encrypt them, to server and handles the authentication
+        protocol including key exchange for first-time connections.
+
+        Sets:
+            self.cipher: AES cipher using the session's symmetric key
+            self.session_ticket: Ticket to log in with next time
+
+        Raises:
+            ConnectionError: If the credentials or server key are
+                             rejected
+        """
+        secret = self.session_ticket or self.password
+        credentials = f"{self.username}:{secret}:{self.key_fingerprint}"
+        self.writer.write(self.server_key_id.encode() +
+                          self.server_cipher.encrypt(credentials.encode()))
+        await self.writer.drain()
+
+        # The server's replies before the session key are not framed,
+        # each is read as the one message it is sent as
+        response = await self.reader.read(1024)
+        if response == b"NEW_CLIENT":
+            self.writer.write(self.public_key_data)
+            await self.writer.drain()
+            response = await self.reader.read(1024)
+        elif response == b"Invalid username or password":
+            # An expired ticket is not retried, login uses the password
+            # on a new connection
+            self.session_ticket = None
+            raise ConnectionError("Invalid username or password")
+        elif response == b"Unknown server key":
+            raise ConnectionError("The server no longer accepts this "
+                                  "server_public.pem")
+
+        try:
+            sym_key = self.private_cipher.decrypt(response)
+        except ValueError:
+            raise ConnectionError("Decryption of symmetric key failed")
+        self.cipher = AES.new(sym_key, AES.MODE_ECB)
+
+        self.writer.write(self.cipher.encrypt(b"OK".ljust(16)))
+        await self.writer.drain()
+        self.session_ticket = self.cipher.decrypt(
+            await self.reader.readexactly(80)).strip().decode()
+
+    async def close(self):
+        """
+        End the session and close the connection.
+        """
+        if self.writer is None:
+            return
+        try:
+            await self.send_command("4")
+            self.writer.close()
+            await self.writer.wait_closed()
+        except OSError:
+            self.writer.close()
+        self.writer = None
+
+    async def recv_menu(self):
+        """
+        Receive the menu the server sends once it is ready for the next
+        command.
+
+        The menu is not framed, so it is read a block at a time until
+        its last line, rather than with a read that could stop short of
+        its end or run into a later reply.
+
+        Returns:
+            str: Decrypted menu, also kept as self.menu
+        """
+        menu = b""
+        while not menu.rstrip().endswith(b"choice:"):
+            menu += self.cipher.decrypt(await self.reader.readexactly(16))
+        self.menu = menu.decode()
+        return self.menu
+
+    async def send_command(self, command):
+        """
+        Encrypt and send a menu choice or command to the server.
+
+        Parameters:
+            command (str): Menu choice or command, eg. "LIST 0 20"
+        """
+        data = command.encode()
+        self.writer.write(
+            self.cipher.encrypt(data.ljust((len(data) // 16 + 1) * 16)))
+        await self.writer.drain()
+
+    async def send_ack(self):
+        """
+        Acknowledge a list the server sent.
+        """
+        await self.send_command("OK")
+
+    async def send_frame(self, data):
+        """
+        Send a message of any size to the server as one encrypted frame:
+        the message length (4 bytes) followed by the padded, encrypted
+        message.
+
+        Parameters:
+            data (bytes): Message to send
+        """
+        padded = data.ljust((len(data) // 16 + 1) * 16)
+        self.writer.write(
+            struct.pack(">I", len(data)) + self.cipher.encrypt(padded))
+        await self.writer.drain()
+
+    async def recv_frame(self):
+        """
+        Receive a message the server sent as one encrypted frame: the
+        message length (4 bytes) followed by the padded, encrypted message.
+
+        Returns:
+            bytes: Received message
+        """
+        length = struct.unpack(">I", await self.reader.readexactly(4))[0]
+        padded = await self.reader.readexactly((length // 16 + 1) * 16)
+        return self.cipher.decrypt(padded)[:length]
+
+    async def recv_email(self):
+        """
+        Receive an email, or part of one, the server sent under its own
+        content key: the content key, nonce and offset of the data in
+        the email (8 bytes), as one encrypted frame, followed by the
+        data's length (4 bytes) and the data encrypted with the content
+        key.
+
+        Returns:
+            bytes: Email text
+        """
+        key_frame = await self.recv_frame()
+        offset = struct.unpack(">Q", key_frame[40:48])[0]
+
+        # Start the CTR keystream at the block holding the offset, and
+        # skip to the offset within it
+        content_cipher = AES.new(bytes(key_frame[:32]), AES.MODE_CTR,
+                                 nonce=bytes(key_frame[32:40]),
+                                 initial_value=offset // 16)
+        content_cipher.decrypt(bytes(offset % 16))
+        length = struct.unpack(">I", await self.reader.readexactly(4))[0]
+        return content_cipher.decrypt(await self.reader.readexactly(length))
+
+    async def send_email(self, recipients, title, content, attachments=()):
+        """
+        Send an email.
+
+        Parameters:
+            recipients (str): Recipients, separated by ;
+            title (str): Email's title
+            content (str): Email's contents
+            attachments (list): Paths of the files to attach
+
+        Returns:
+            bool: True if the email was sent
+        """
+        results = await self.send_emails([{
+            "recipients": recipients, "title": title, "content": content,
+            "attachments": list(attachments)}])
+        return results[0]
+
+    async def send_emails(self, messages, uploaded=None):
+        """
+        Send several emails in batches of up to BATCH_LIMIT, see
+        send_batch. Their attachments are uploaded first, see
+        upload_attachment.
+
+        Parameters:
+            messages (list): Each email's recipients, title, contents and
+                             paths of the files to attach, as queued in
+                             the outbox
+            uploaded (dict): Attachment already uploaded for each path,
+                             reused and added to, so a file attached to
+                             emails sent over several calls is uploaded
+                             once
+
+        Returns:
+            list: Whether each email was sent
+        """
+        emails = []
+        if uploaded is None:
+            uploaded = {}
+        for message in messages:
+            attachments = []
+            for filepath in message.get("attachments", []):
+                if filepath not in uploaded:
+                    uploaded[filepath] = await self.upload_attachment(
+                        filepath)
+                if uploaded[filepath] is None:
+                    break
+                attachments.append(uploaded[filepath])
+            else:
+                emails.append(format_email(self.username, message,
+                                           attachments))
+                continue
+            emails.append(None)
+
+        results = []
+        for start in range(0, len(emails), BATCH_LIMIT):
+            batch = emails[start:start + BATCH_LIMIT]
+            sent = iter(await self.send_batch(
+                [email for email in batch if email is not None]))
+            results += [email is not None and next(sent)
+                        for email in batch]
+        return results
+
+    async def send_batch(self, emails):
+        """
+        Send several emails with one BATCH command. Every email is
+        written to the server without waiting for a reply, and the
+        server confirms the whole batch at once.
+
+        The server only delivers a batch once it has received all of
+        it, so if the connection is lost while the batch is written,
+        the client reconnects and sends the batch again.
+
+        Parameters:
+            emails (list): Text of each email, see format_email, at most
+                           BATCH_LIMIT
+
+        Returns:
+            list: Whether each email was sent
+
+        Raises:
+            ConnectionError: If the connection is lost and cannot be
+                             made again
+        """
+        for attempt in range(RECONNECT_ATTEMPTS + 1):
+            try:
+                await self.send_command(f"BATCH {len(emails)}")
+                await self.recv_frame()
+                for email in emails:
+                    await self.send_frame(email.encode())
+                break
+            except (OSError, EOFError):
+                if attempt == RECONNECT_ATTEMPTS:
+                    raise
+                await self.reconnect()
+
+        sent = json.loads(await self.recv_frame())
+        await self.recv_menu()
+        return sent
+
+    async def upload_attachment(self, filepath):
+        """
+        Upload a file to attach to emails.
+
+        The file is read in chunks, and the server is sent the hash of
+        each chunk first, so only the chunks it does not already hold
+        are uploaded. A file already sent, by any client, is not
+        uploaded again. The file is never held in memory whole.
+
+        If the connection is lost, the client reconnects and resumes
+        the upload by its transfer ID, and the server only asks for
+        the chunks it has not received.
+
+        Parameters:
+            filepath (str): Path of the file
+
+        Returns:
+            dict: Attachment's name, size and ID, as listed in an email,
+                  or None if the upload failed
+
+        Raises:
+            ConnectionError: If the connection is lost and cannot be
+                             made again
+        """
+        digests = []
+        size = 0
+        with open(filepath, "rb") as f:
+            while chunk := f.read(ATTACHMENT_CHUNK_SIZE):
+                digests.append(hashlib.sha256(chunk).hexdigest())
+                size += len(chunk)
+
+        upload = {"size": size, "chunks": digests}
+        for attempt in range(RECONNECT_ATTEMPTS + 1):
+            try:
+                attachment_id = await self.send_attachment(filepath, upload)
+                break
+            except (OSError, EOFError):
+                if attempt == RECONNECT_ATTEMPTS:
+                    raise
+                await self.reconnect()
+
+        if not attachment_id:
+            return None
+        return {"name": os.path.basename(filepath), "size": size,
+                "id": attachment_id}
+
+    async def send_attachment(self, filepath, upload):
+        """
+        Send the chunks of a file the server asks for, see
+        upload_attachment.
+
+        Parameters:
+            filepath (str): Path of the file
+            upload (dict): File's size and chunk hashes, and the ID of
+                           the transfer once the server gives it one
+
+        Returns:
+            str: Attachment ID, empty if the upload failed
+        """
+        await self.send_command("ATTACH")
+        await self.recv_frame()
+        await self.send_frame(json.dumps(upload).encode())
+
+        # The server refuses an upload it cannot make sense of
+        reply = await self.recv_frame()
+        if not reply:
+            await self.recv_menu()
+            return ""
+
+        # Send each chunk the server asks for, in the order they
+        # appear in the file
+        reply = json.loads(reply)
+        upload["transfer"] = reply["transfer"]
+        missing = set(reply["missing"])
+        with open(filepath, "rb") as f:
+            for digest in upload["chunks"]:
+                chunk = f.read(ATTACHMENT_CHUNK_SIZE)
+                if digest in missing:
+                    missing.discard(digest)
+                    await self.send_frame(chunk)
+
+        attachment_id = (await self.recv_frame()).decode()
+        await self.recv_menu()
+        return attachment_id
+
+    async def list_inbox(self, offset=0, limit=INBOX_PAGE_SIZE,
+                         oldest_first=False):
+        """
+        List a page of the inbox.
+
+        Parameters:
+            offset (int): Number of emails to skip
+            limit (int): Maximum number of emails to list
+            oldest_first (bool): List oldest emails first
+
+        Returns:
+            tuple: (number of emails in the inbox, email ID of each
+                    index listed, inbox list as displayed)
+        """
+        command = f"LIST {offset} {limit}"
+        if oldest_first:
+            command += " oldest"
+        await self.send_command(command)
+        return await self.recv_inbox_list()
+
+    async def query_inbox(self, offset=0, limit=INBOX_PAGE_SIZE, **filters):
+        """
+        List a page of the inbox filtered by sender, title prefix and/or
+        date range, see SearchIndex.query on the server.
+
+        Parameters:
+            offset (int): Number of emails to skip
+            limit (int): Maximum number of emails to list
+            filters: Filters and order, eg. sender="client1",
+                     after="2026-10-01", sort="title"
+
+        Returns:
+            tuple: (number of matching emails, email ID of each index
+                    listed, list as displayed)
+        """
+        await self.send_command("QUERY " + json.dumps(
+            {**filters, "offset": offset, "limit": limit}))
+        return await self.recv_inbox_list()
+
+    async def recv_inbox_list(self):
+        """
+        Receive and acknowledge a page of an inbox list.
+
+        Returns:
+            tuple: (number of emails in the list, email ID of each index
+                    listed, list as displayed)
+        """
+        page, inbox_list = (await self.recv_frame()).decode().split('\n', 1)
+        page = json.loads(page)
+        await self.send_ack()
+        await self.recv_menu()
+        return page["total"], page["ids"], inbox_list
+
+    async def get_emails(self, email_ids, indexes=()):
+        """
+        Fetch several emails in one request, marking them as seen.
+
+        Parameters:
+            email_ids (list): Email IDs
+            indexes (list): Inbox indexes, counting from the newest
+                            email, of further emails whose IDs are not
+                            known, at most 100 emails in all
+
+        Returns:
+            dict: Text of each email found, by email ID, in the order
+                  requested
+        """
+        request = "GET " + ",".join(map(str, email_ids))
+        if indexes:
+            # Indexes are only taken at the prompt for option 3
+            await self.send_command("3")
+            await self.reader.readexactly(32)
+            request += " INDEXES " + ",".join(map(str, indexes))
+        await self.send_command(request)
+        found = json.loads(await self.recv_frame())
+        emails = {}
+        for email_id in found:
+            emails[email_id] = (await self.recv_email()).decode()
+        await self.recv_menu()
+        return emails
+
+    async def get_email(self, email_id):
+        """
+        Fetch an email, marking it as seen.
+
+        Parameters:
+            email_id (int): Email ID
+
+        Returns:
+            str: Email text, or None if there is no such email
+        """
+        return (await self.get_emails([email_id])).get(email_id)
+
+    async def mark_seen(self, email_id):
+        """
+        Mark an email as seen without fetching it, eg. once it is shown
+        from a local copy.
+
+        Parameters:
+            email_id (int): Email ID
+        """
+        await self.send_command("3")
+        await self.reader.readexactly(32)
+        await self.send_command(f"CACHED {email_id}")
+        await self.recv_menu()
+
+    async def fetch_headers(self, email_id):
+        """
+        Fetch an email's header lines, without marking it as seen.
+
+        Parameters:
+            email_id (int): Email ID
+
+        Returns:
+            dict: Email's ID, header lines and body length in bytes, or
+                  None if there is no such email
+        """
+        await self.send_command(f"FETCH {email_id} HEADERS")
+        reply = await self.recv_frame()
+        await self.recv_menu()
+        return json.loads(reply) if reply else None
+
+    async def fetch_body(self, email_id, start, length):
+        """
+        Fetch a byte range of an email's body, without marking it as
+        seen.
+
+        Parameters:
+            email_id (int): Email ID
+            start (int): Offset in the body of the first byte
+            length (int): Number of bytes
+
+        Returns:
+            bytes: Body range, clipped to the body, or None if there is
+                   no such email
+        """
+        await self.send_command(f"FETCH {email_id} BODY {start} {length}")
+        reply = await self.recv_frame()
+        data = await self.recv_email() if reply else None
+        await self.recv_menu()
+        return data
+
+    async def fetch_attachment(self, email_id, number, f=None):
+        """
+        Download one of an email's attachments, a chunk at a time.
+
+        Every chunk is checked against its hash. Once a chunk is
+        damaged the rest are still received, so the client stays in
+        step with the server, but not kept. If the connection is lost,
+        the client reconnects and resumes the download by its transfer
+        ID from the first chunk it does not have. Once every chunk has
+        arrived, the download is acknowledged with RECEIVED, so the
+        server can forget it.
+
+        Parameters:
+            email_id (int): Email ID
+            number (int): Attachment's position in the email's list,
+                          counting from 1
+            f: Binary file the chunks are written to as they arrive,
+               so the attachment is never held in memory whole, None to
+               return the contents instead
+
+        Returns:
+            tuple: (attachment's name, contents, or None if written to
+                   f), or None if there is no such attachment
+
+        Raises:
+            ValueError: If a chunk was damaged in transfer
+            ConnectionError: If the connection is lost and cannot be
+                             made again, or the download cannot be
+                             resumed
+        """
+        await self.send_command(f"FETCH {email_id} ATTACHMENT {number}")
+        header = await self.recv_frame()
+        if not header:
+            await self.recv_menu()
+            return None
+        download = json.loads(header)
+
+        chunks = []
+        intact = True
+        received = 0
+        attempts = 0
+        while received < len(download["chunks"]):
+            try:
+                chunk = await self.recv_frame()
+            except (OSError, EOFError):
+                if attempts == RECONNECT_ATTEMPTS:
+                    raise
+                attempts += 1
+                await self.reconnect()
+                await self.send_command(
+                    f"RESUME {download['transfer']} {received}")
+                if not await self.recv_frame():
+                    await self.recv_menu()
+                    raise ConnectionError("Download could not be resumed")
+                continue
+
+            if hashlib.sha256(chunk).hexdigest() != \
+                    download["chunks"][received]:
+                intact = False
+            if intact and f is not None:
+                f.write(chunk)
+            elif intact:
+                chunks.append(chunk)
+            received += 1
+        await self.recv_menu()
+        await self.send_command(f"RECEIVED {download['transfer']}")
+        await self.recv_menu()
+
+        if not intact:
+            raise ValueError(f"{download['name']} was damaged in transfer")
+        return download["name"], None if f is not None else b"".join(chunks)
+
+    async def mailbox_epoch(self):
+        """
+        Fetch the epoch of the client's mailbox. Email IDs only mean the
+        same emails while the epoch stays the same, so anything kept by
+        email ID (eg. cached emails, or the last ID passed to sync) is
+        to be dropped when it changes.
+
+        Returns:
+            str: Mailbox epoch
+        """
+        await self.send_command("EPOCH")
+        epoch = (await self.recv_frame()).decode()
+        await self.recv_menu()
+        return epoch
+
+    async def sync(self, last_id, bodies=False):
+        """
+        Fetch the emails delivered after an email ID.
+
+        Parameters:
+            last_id (int): ID of the last email seen
+            bodies (bool): Fetch the full email text along with each
+                           email's headers
+
+        Returns:
+            tuple: (ID of the newest email, new emails' headers, oldest
+                    first)
+        """
+        command = f"SYNC {last_id}"
+        if bodies:
+            command += " bodies"
+        await self.send_command(command)
+        reply = await self.recv_frame()
+        await self.send_ack()
+        await self.recv_menu()
+        return self.parse_new_emails(reply)
+
+    async def idle(self, last_id, timeout=None, stop=None):
+        """
+        Wait for emails delivered after an email ID, as the server
+        pushes them.
+
+        Parameters:
+            last_id (int): ID of the last email seen
+            timeout (float): Seconds to wait for a new email, None to
+                             wait until one arrives
+            stop (asyncio.Future): Ends the wait early once done, eg.
+                                   when a user stops waiting
+
+        Returns:
+            tuple: (ID of the newest email, new emails' headers, oldest
+                    first), no emails if none arrived in time
+        """
+        await self.send_command(f"IDLE {last_id}")
+        newest_id = last_id
+        emails = []
+
+        # The push being read is never cancelled part way through, so
+        # the stream stays in step once the wait is ended
+        push = asyncio.ensure_future(self.recv_frame())
+        await asyncio.wait({push} if stop is None else {push, stop},
+                           timeout=timeout,
+                           return_when=asyncio.FIRST_COMPLETED)
+        await self.send_command("DONE")
+        reply = await push
+        while reply:
+            newest_id, new_emails = self.parse_new_emails(reply)
+            emails += new_emails
+            reply = await self.recv_frame()
+
+        await self.recv_menu()
+        return newest_id, emails
+
+    def parse_new_emails(self, reply):
+        """
+        Parse a list of new emails sent by the server.
+
+        Parameters:
+            reply (bytes): Newest email ID, followed by one JSON line
+                           per new email
+
+        Returns:
+            tuple: (ID of the newest email, new emails' headers)
+        """
+        newest_id, *lines = reply.decode().split('\n')
+        return int(newest_id), [json.loads(line) for line in lines if line]
+
+    async def search(self, query):
+        """
+        Find the emails matching a search, see search.py on the server.
+
+        Parameters:
+            query (str): Words to search for, eg. "from:client1 report"
+
+        Returns:
+            list: Matching emails' headers and inbox indexes, newest
+                  first
+        """
+        await self.send_command(f"SEARCH {query}")
+        reply = (await self.recv_frame()).decode()
+        await self.send_ack()
+        await self.recv_menu()
+        return [json.loads(line) for line in reply.split('\n') if line]
@@ -0,0 +1,227 @@
+"""
+Program:
+provision.py
+
+Purpose:
+Provision many client accounts at once. Generates client key pairs in
+parallel across a process pool, registers every new client's credentials
+and public key with the server in a single batch, and emits a ready-to-use
+client bundle (the same layout as `make client`) for each account.
+Key pairs are taken from the server's pre-generated key pool (see
+server/key_pool.py) when one is available. Bundles are created in bundles/
+unless another directory is given, and usernames the server already has
+are refused unless --force is given, so existing accounts are not
+overwritten by mistake.
+
+Usage:
+python3 provision.py [--workers N] [--output DIR] [--force]
+                     <username> [<username> ...]
+python3 provision.py [--workers N] [--output DIR] [--force]
+                     --prefix user --count 200
+
+Authors:
+Jack Derksen
+Nolan Schlacht
+De Xie
+
+Last Updated:
+19/10/2026
+
+TO-DO:
+    -
+"""
+
+import argparse
+import importlib.util
+import os
+import secrets
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.join(PROJECT_DIR, "server")
+CLIENT_FILES_DIR = os.path.join(PROJECT_DIR, "client_files")
+BUNDLES_DIR = os.path.join(PROJECT_DIR, "bundles")
+
+
+def load_module(name, path):
+    """
+    Load a script from another project directory as a module.
+
+    Both the server and client directories have their own key_generator.py,
+    so they are loaded under distinct module names.
+
+    Input: name - Name to register the module under
+           path - Path to the script
+
+    Output: module - The loaded module
+    """
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+client_keygen = load_module(
+    "client_key_generator", os.path.join(CLIENT_FILES_DIR, "key_generator.py"))
+credential_store = load_module(
+    "credential_store", os.path.join(SERVER_DIR, "credential_store.py"))
+key_registry = load_module(
+    "key_registry", os.path.join(SERVER_DIR, "key_registry.py"))
+server_keygen = load_module(
+    "server_key_generator", os.path.join(SERVER_DIR, "key_generator.py"))
+key_pool = load_module("key_pool", os.path.join(SERVER_DIR, "key_pool.py"))
+
+
+def create_bundle(username, output_dir, private_key=None):
+    """
+    Create a client bundle directory and write its key pair, generating
+    one if no pre-generated key is given. Runs inside a worker process.
+
+    Input: username - Username of the client to provision
+           output_dir - Directory the bundle is created in
+           private_key - Pre-generated private key (PEM bytes) or None
+
+    Output: (username, public_key) - public_key being PEM bytes
+    """
+    bundle_dir = os.path.join(output_dir, username)
+    os.makedirs(os.path.join(bundle_dir, "files"), exist_ok=True)
+
+    for filename in ("client.py", "async_client.py", "bulk_send.py",
+                     "key_generator.py"):
+        shutil.copy(os.path.join(CLIENT_FILES_DIR, filename), bundle_dir)
+    shutil.copy(os.path.join(SERVER_DIR, "server_public.pem"), bundle_dir)
+
+    if private_key is None:
+        public_key = client_keygen.generate_client_keys(username, bundle_dir)
+    else:
+        public_key = client_keygen.save_client_keys(
+            username, client_keygen.RSA.import_key(private_key), bundle_dir)
+    return username, public_key
+
+
+def existing_clients(usernames, output_dir):
+    """
+    Find which of the usernames to provision are already in use, either
+    registered with the server or with a bundle in the output directory.
+
+    Input: usernames - List of usernames to provision
+           output_dir - Directory bundles are created in
+
+    Output: existing - Usernames already in use, in the order given
+    """
+    cwd = os.getcwd()
+    os.chdir(SERVER_DIR)
+    try:
+        registered = server_keygen.load_credentials()
+    finally:
+        os.chdir(cwd)
+
+    return [username for username in usernames
+            if username in registered
+            or os.path.exists(os.path.join(output_dir, username))]
+
+
+def provision_clients(usernames, output_dir, workers=None):
+    """
+    Provision a batch of clients.
+
+    Input: usernames - List of usernames to provision
+           output_dir - Directory bundles are created in
+           workers - Number of worker processes, defaults to the CPU count
+
+    Output: passwords - Dictionary mapping each username to its password
+    """
+    passwords = {username: secrets.token_urlsafe(12) for username in usernames}
+
+    # Hand out pre-generated keys first, if the key pool service is in use
+    private_keys = [None] * len(usernames)
+    pool_dir = os.path.join(SERVER_DIR, "key_pool")
+    if os.path.isdir(pool_dir):
+        stock = key_pool.KeyPool(pool_dir)
+        for i in range(len(usernames)):
+            key = stock.take()
+            if key is None:
+                break
+            private_keys[i] = key.export_key()
+
+    # Key generation dominates, so spread what is left across processes
+    clients = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(create_bundle, usernames,
+                           [output_dir] * len(usernames), private_keys)
+        for username, public_key in results:
+            clients[username] = (passwords[username], public_key)
+
+    # Register everything with the server in one pass
+    cwd = os.getcwd()
+    os.chdir(SERVER_DIR)
+    try:
+        server_keygen.register_clients(clients)
+    finally:
+        os.chdir(cwd)
+
+    # Hand each client its password alongside its keys
+    for username, password in passwords.items():
+        password_file = os.path.join(output_dir, username, "password.txt")
+        with open(password_file, "w") as f:
+            f.write(password + "\n")
+
+    return passwords
+
+
+def main():
+    """
+    Parse command line arguments and provision the requested clients.
+    """
+    parser = argparse.ArgumentParser(
+        description="Provision client accounts in bulk")
+    parser.add_argument("usernames", nargs="*",
+                        help="usernames to provision")
+    parser.add_argument("--prefix",
+                        help="generate usernames <prefix>1..<prefix>N")
+    parser.add_argument("--count", type=int, default=0,
+                        help="number of usernames to generate with --prefix")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: CPU count)")
+    parser.add_argument("--output", default=BUNDLES_DIR,
+                        help="directory to create client bundles in "
+                             "(default: bundles/)")
+    parser.add_argument("--force", action="store_true",
+                        help="replace the keys and passwords of usernames "
+                             "already in use")
+    args = parser.parse_args()
+
+    usernames = list(args.usernames)
+    if args.prefix:
+        usernames += [f"{args.prefix}{i}" for i in range(1, args.count + 1)]
+    usernames = list(dict.fromkeys(usernames))
+
+    if not usernames:
+        parser.error("no usernames given")
+
+    if not os.path.exists(os.path.join(SERVER_DIR, "server_public.pem")):
+        print("Error: Server keys not found. Please run key_generator.py "
+              "in the server directory first.")
+        sys.exit(1)
+
+    output_dir = os.path.abspath(args.output)
+    existing = existing_clients(usernames, output_dir)
+    if existing and not args.force:
+        print(f"Error: {', '.join(existing)} already in use. Choose other "
+              f"usernames, or give --force to replace their keys and "
+              f"passwords.")
+        sys.exit(1)
+
+    print(f"Provisioning {len(usernames)} clients...")
+    provision_clients(usernames, output_dir, args.workers)
+
+    print(f"\nProvisioned {len(usernames)} clients.")
+    print(f"Bundles are in {output_dir}, each containing its keys, "
+          f"server_public.pem and password.txt")
+
+
+if __name__ == "__main__":
+    main()
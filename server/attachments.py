@@ -0,0 +1,470 @@
+"""
+Program:
+attachments.py
+
+Purpose:
+Content-addressed storage for email attachments. Attachments are split
+into chunks by the sending client, and each chunk is stored once under
+the SHA-256 hash of its contents, however many emails or users it is
+sent to. An attachment is stored as a manifest listing its chunks, and
+is identified by the hash of that list, so sending a file that is
+already stored costs nothing but its manifest ID.
+
+Chunks are stored encrypted (AES-CTR) under a key derived from the
+server's storage key and the chunk's hash, so identical chunks still
+encrypt identically and are only stored once.
+
+Reference counts track how many delivered emails hold each attachment,
+and how many attachments hold each chunk. Delivered emails are never
+removed, so an attachment sent with one is kept for good. Uploads and downloads are
+recorded as transfers, with the number of chunks transferred so far, so
+a client that loses its connection can resume them by transfer ID.
+Objects nothing refers to (eg. uploaded for an email that was never
+sent) and abandoned transfers are removed by:
+
+    python3 attachments.py gc      Remove unreferenced attachments
+
+Authors:
+Jack Derksen
+Nolan Schlacht
+De Xie
+
+Last Updated:
+19/10/2026
+
+TO-DO:
+    -
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import sqlite3
+import sys
+import time
+from Crypto.Cipher import AES
+from maildir import storage_key
+
+# Directory the attachment store is kept in
+ATTACHMENTS_ROOT = "attachments"
+
+# Largest chunk a client may upload
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Seconds an unreferenced object or an unfinished transfer is kept, so an
+# upload in progress can still refer to it or be resumed
+GC_GRACE_PERIOD = 3600
+
+
+def email_attachments(content):
+    """
+    Get the attachments listed in an email's header lines.
+
+    Parameters:
+        content (str): Email text, or at least its header lines
+
+    Returns:
+        list: Attachments, each a dict with its name, size and ID
+    """
+    lines = content.split('\n')
+    for line in lines[:lines.index("Content:")]:
+        if line.startswith("Attachments: "):
+            return json.loads(line.split(': ', 1)[1])
+    return []
+
+
+class AttachmentStore:
+    def __init__(self, root=ATTACHMENTS_ROOT):
+        """
+        Initialize AttachmentStore object, creating the store if needed.
+
+        Parameters:
+            root (str): Directory the store is kept in
+
+        Properties:
+            self.root: Directory the store is kept in
+            self.path: Path to the reference count database
+        """
+        self.root = root
+        self.path = os.path.join(root, "refs.db")
+
+        for kind in ("chunks", "manifests", "tmp"):
+            os.makedirs(os.path.join(root, kind), exist_ok=True)
+
+        db = self.connect()
+        try:
+            with db:
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS objects ("
+                    "id TEXT PRIMARY KEY, "
+                    "kind TEXT NOT NULL, "
+                    "refs INTEGER NOT NULL DEFAULT 0, "
+                    "touched REAL NOT NULL)")
+                db.execute("CREATE INDEX IF NOT EXISTS objects_refs "
+                           "ON objects (refs, touched)")
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS transfers ("
+                    "id TEXT PRIMARY KEY, "
+                    "username TEXT NOT NULL, "
+                    "kind TEXT NOT NULL, "
+                    "details TEXT NOT NULL, "
+                    "offset INTEGER NOT NULL DEFAULT 0, "
+                    "touched REAL NOT NULL)")
+        finally:
+            db.close()
+
+    def connect(self):
+        """
+        Open a connection to the reference count database.
+
+        Returns:
+            sqlite3.Connection: Connection to the database
+        """
+        db = sqlite3.connect(self.path, timeout=10)
+        db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def object_path(self, kind, object_id):
+        """
+        Get the path of a stored chunk or manifest, sharded by the first
+        two characters of its ID.
+
+        Parameters:
+            kind (str): "chunks" or "manifests"
+            object_id (str): Hex SHA-256 ID of the object
+
+        Returns:
+            str: Path of the object's file
+        """
+        return os.path.join(self.root, kind, object_id[:2], object_id)
+
+    def write_object(self, kind, object_id, data):
+        """
+        Atomically write a chunk or manifest, unless it is already stored.
+
+        Parameters:
+            kind (str): "chunks" or "manifests"
+            object_id (str): Hex SHA-256 ID of the object
+            data (bytes): Contents to write
+        """
+        path = self.object_path(kind, object_id)
+        if os.path.exists(path):
+            return
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = os.path.join(self.root, "tmp",
+                                f"{object_id}.{os.getpid()}")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def chunk_cipher(self, digest):
+        """
+        Create the cipher a chunk is stored encrypted with.
+
+        Parameters:
+            digest (str): Hex SHA-256 hash of the chunk
+
+        Returns:
+            AES cipher for the chunk
+        """
+        key = hmac.new(storage_key(), digest.encode(), "sha256").digest()
+        return AES.new(key, AES.MODE_CTR, nonce=b"")
+
+    def missing(self, digests):
+        """
+        Find the chunks of an upload that are not stored yet.
+
+        Chunks already stored are marked as in use, so they are not
+        collected before the upload's manifest refers to them.
+
+        Parameters:
+            digests (list): Hex SHA-256 hashes of the upload's chunks
+
+        Returns:
+            list: Hashes of the chunks to upload, in the order they first
+                  appear, without repeats
+        """
+        db = self.connect()
+        try:
+            with db:
+                missing = []
+                for digest in dict.fromkeys(digests):
+                    stored = db.execute(
+                        "UPDATE objects SET touched = ? WHERE id = ?",
+                        (time.time(), digest)).rowcount
+                    if not stored or not os.path.exists(
+                            self.object_path("chunks", digest)):
+                        missing.append(digest)
+                return missing
+        finally:
+            db.close()
+
+    def put_chunk(self, digest, data):
+        """
+        Store an uploaded chunk.
+
+        Parameters:
+            digest (str): Hex SHA-256 hash the client gave the chunk
+            data (bytes): Chunk contents
+
+        Raises:
+            ValueError: If the chunk is too large or does not match its
+                        hash
+        """
+        if len(data) > MAX_CHUNK_SIZE or \
+                hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"Chunk {digest} does not match its hash")
+
+        self.write_object("chunks", digest,
+                          self.chunk_cipher(digest).encrypt(data))
+        db = self.connect()
+        try:
+            with db:
+                db.execute(
+                    "INSERT INTO objects (id, kind, touched) "
+                    "VALUES (?, 'chunk', ?) "
+                    "ON CONFLICT (id) DO UPDATE SET touched = excluded.touched",
+                    (digest, time.time()))
+        finally:
+            db.close()
+
+    def put_manifest(self, size, digests):
+        """
+        Store an attachment's manifest once all of its chunks are stored.
+
+        The first time a manifest is stored, each of its chunks gains a
+        reference.
+
+        Parameters:
+            size (int): Attachment size in bytes
+            digests (list): Hex SHA-256 hashes of its chunks, in order
+
+        Returns:
+            str: Attachment ID
+
+        Raises:
+            ValueError: If a chunk is not stored
+        """
+        manifest = json.dumps({"size": size, "chunks": digests}).encode()
+        attachment_id = hashlib.sha256(manifest).hexdigest()
+
+        db = self.connect()
+        try:
+            with db:
+                for digest in digests:
+                    if not db.execute("SELECT 1 FROM objects WHERE id = ?",
+                                      (digest,)).fetchone():
+                        raise ValueError(f"Chunk {digest} is not stored")
+
+                self.write_object("manifests", attachment_id, manifest)
+                created = db.execute(
+                    "INSERT OR IGNORE INTO objects (id, kind, touched) "
+                    "VALUES (?, 'manifest', ?)",
+                    (attachment_id, time.time())).rowcount
+                if created:
+                    db.executemany(
+                        "UPDATE objects SET refs = refs + 1 WHERE id = ?",
+                        [(digest,) for digest in digests])
+                else:
+                    db.execute("UPDATE objects SET touched = ? WHERE id = ?",
+                               (time.time(), attachment_id))
+        finally:
+            db.close()
+        return attachment_id
+
+    def manifest(self, attachment_id):
+        """
+        Read an attachment's manifest.
+
+        Parameters:
+            attachment_id (str): Attachment ID
+
+        Returns:
+            dict: Attachment size and chunk hashes, or None if the
+                  attachment is not stored
+        """
+        if len(attachment_id) != 64 or \
+                not all(c in "0123456789abcdef" for c in attachment_id):
+            return None
+        try:
+            with open(self.object_path("manifests", attachment_id),
+                      "rb") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def read_chunk(self, digest):
+        """
+        Read and decrypt a stored chunk.
+
+        Parameters:
+            digest (str): Hex SHA-256 hash of the chunk
+
+        Returns:
+            bytes: Chunk contents
+        """
+        with open(self.object_path("chunks", digest), "rb") as f:
+            return self.chunk_cipher(digest).decrypt(f.read())
+
+    def add_refs(self, attachment_ids, count=1):
+        """
+        Add references to attachments, eg. one per recipient of an email
+        holding them.
+
+        Parameters:
+            attachment_ids (list): Attachment IDs
+            count (int): References to add to each
+        """
+        db = self.connect()
+        try:
+            with db:
+                db.executemany(
+                    "UPDATE objects SET refs = refs + ? WHERE id = ?",
+                    [(count, attachment_id)
+                     for attachment_id in attachment_ids])
+        finally:
+            db.close()
+
+    def start_transfer(self, username, kind, details):
+        """
+        Record a new upload or download.
+
+        Parameters:
+            username (str): Client making the transfer
+            kind (str): "upload" or "download"
+            details (dict): What is being transferred
+
+        Returns:
+            str: Transfer ID
+        """
+        transfer_id = secrets.token_hex(16)
+        db = self.connect()
+        try:
+            with db:
+                db.execute(
+                    "INSERT INTO transfers (id, username, kind, details, "
+                    "touched) VALUES (?, ?, ?, ?, ?)",
+                    (transfer_id, username, kind, json.dumps(details),
+                     time.time()))
+        finally:
+            db.close()
+        return transfer_id
+
+    def get_transfer(self, transfer_id, username, kind):
+        """
+        Look up an unfinished transfer.
+
+        Parameters:
+            transfer_id (str): Transfer ID
+            username (str): Client resuming the transfer, only the client
+                            that started it can
+            kind (str): "upload" or "download"
+
+        Returns:
+            dict: Transfer's details and the number of chunks transferred
+                  so far (offset), or None if there is no such transfer
+        """
+        db = self.connect()
+        try:
+            row = db.execute(
+                "SELECT details, offset FROM transfers "
+                "WHERE id = ? AND username = ? AND kind = ?",
+                (transfer_id, username, kind)).fetchone()
+        finally:
+            db.close()
+        if row is None:
+            return None
+        return {"details": json.loads(row[0]), "offset": row[1]}
+
+    def update_transfer(self, transfer_id, offset):
+        """
+        Record how many chunks of a transfer have been transferred.
+
+        Parameters:
+            transfer_id (str): Transfer ID
+            offset (int): Number of chunks transferred
+        """
+        db = self.connect()
+        try:
+            with db:
+                db.execute("UPDATE transfers SET offset = ?, touched = ? "
+                           "WHERE id = ?", (offset, time.time(), transfer_id))
+        finally:
+            db.close()
+
+    def finish_transfer(self, transfer_id):
+        """
+        Forget a transfer once it is complete.
+
+        Parameters:
+            transfer_id (str): Transfer ID
+        """
+        db = self.connect()
+        try:
+            with db:
+                db.execute("DELETE FROM transfers WHERE id = ?",
+                           (transfer_id,))
+        finally:
+            db.close()
+
+    def collect_garbage(self, grace_period=GC_GRACE_PERIOD):
+        """
+        Remove the attachments and chunks nothing refers to, and the
+        transfers abandoned.
+
+        Unreferenced attachments are removed first, releasing their
+        chunks, then the unreferenced chunks. Objects used and transfers
+        made within the grace period are kept.
+
+        Parameters:
+            grace_period (float): Seconds unreferenced objects are kept
+
+        Returns:
+            tuple: (attachments removed, chunks removed)
+        """
+        cutoff = time.time() - grace_period
+        removed = {}
+        db = self.connect()
+        try:
+            for kind, directory in (("manifest", "manifests"),
+                                    ("chunk", "chunks")):
+                with db:
+                    ids = [row[0] for row in db.execute(
+                        "SELECT id FROM objects WHERE refs = 0 "
+                        "AND touched < ? AND kind = ?", (cutoff, kind))]
+                    for object_id in ids:
+                        if kind == "manifest":
+                            manifest = self.manifest(object_id)
+                            if manifest is not None:
+                                db.executemany(
+                                    "UPDATE objects SET refs = refs - 1 "
+                                    "WHERE id = ?",
+                                    [(digest,)
+                                     for digest in manifest["chunks"]])
+                        db.execute("DELETE FROM objects WHERE id = ?",
+                                   (object_id,))
+                        try:
+                            os.remove(self.object_path(directory, object_id))
+                        except FileNotFoundError:
+                            pass
+                removed[kind] = len(ids)
+            with db:
+                db.execute("DELETE FROM transfers WHERE touched < ?",
+                           (cutoff,))
+        finally:
+            db.close()
+        return removed["manifest"], removed["chunk"]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 2 and sys.argv[1] == "gc":
+        attachments, chunks = AttachmentStore().collect_garbage()
+        print(f"Removed {attachments} attachments and {chunks} chunks")
+    else:
+        print("Usage: python3 attachments.py gc")
+        sys.exit(1)
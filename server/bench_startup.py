@@ -0,0 +1,111 @@
+"""
+Program:
+bench_startup.py
+
+Purpose:
+Benchmark how long the email server takes to start as the number of users
+grows. Builds throwaway server directories with the given numbers of users
+(credentials and registered public keys) and times EmailServer() in each.
+Startup should take roughly the same time no matter how many users there
+are, so the benchmark fails if it exceeds the time budget.
+
+Usage:
+python3 bench_startup.py [--users 1000 10000 100000] [--budget SECONDS]
+
+Authors:
+Jack Derksen
+Nolan Schlacht
+De Xie
+
+Last Updated:
+19/10/2026
+
+TO-DO:
+    -
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SERVER_DIR)
+
+from key_registry import KeyRegistry
+from server import EmailServer
+
+
+def build_server_dir(directory, user_count):
+    """
+    Populate a server directory with keys and the given number of users.
+
+    Parameters:
+        directory (str): Directory to populate
+        user_count (int): Number of users to create
+    """
+    shutil.copy(os.path.join(SERVER_DIR, "server_private.pem"), directory)
+    usernames = [f"user{i}" for i in range(user_count)]
+
+    with open(os.path.join(directory, "user_pass.json"), "w") as f:
+        json.dump({username: "password" for username in usernames}, f)
+
+    # Every user shares one public key, only the number of entries matters
+    with open(os.path.join(SERVER_DIR, "server_public.pem"), "rb") as f:
+        public_key_data = f.read()
+    registry = KeyRegistry(os.path.join(directory, "key_registry.db"))
+    registry.store_many({username: public_key_data for username in usernames})
+
+
+def time_startup(directory):
+    """
+    Time constructing an EmailServer in a server directory.
+
+    Parameters:
+        directory (str): Server directory to start in
+
+    Returns:
+        float: Seconds taken
+    """
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        start = time.perf_counter()
+        EmailServer()
+        return time.perf_counter() - start
+    finally:
+        os.chdir(cwd)
+
+
+def main():
+    """
+    Run the startup benchmark for each requested user count.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark server startup")
+    parser.add_argument("--users", type=int, nargs="+",
+                        default=[1000, 10000, 100000],
+                        help="user counts to benchmark")
+    parser.add_argument("--budget", type=float, default=0.5,
+                        help="maximum allowed startup time in seconds")
+    args = parser.parse_args()
+
+    print(f"{'Users':<10} {'Startup (s)':<12}")
+    slowest = 0
+    for user_count in args.users:
+        with tempfile.TemporaryDirectory() as directory:
+            build_server_dir(directory, user_count)
+            elapsed = time_startup(directory)
+        slowest = max(slowest, elapsed)
+        print(f"{user_count:<10} {elapsed:<12.4f}")
+
+    if slowest > args.budget:
+        print(f"\nStartup took {slowest:.4f}s, over the {args.budget}s budget")
+        sys.exit(1)
+    print(f"\nStartup stayed within the {args.budget}s budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""
+Program:
+credential_store.py
+
+Purpose:
+Store and verify client credentials. Passwords in user_pass.json are kept
+as salted PBKDF2 hashes with a tunable iteration count (plain passwords
+written by hand are still accepted), successful logins are handed a
+session ticket so later logins skip the slow hash, and changes to the
+file are picked up while the server is running. The file is only read
+when credentials are first needed.
+
+Authors:
+Jack Derksen
+Nolan Schlacht
+De Xie
+
+Last Updated:
+19/10/2026
+
+TO-DO:
+    -
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+
+# Prefix identifying a hashed entry in user_pass.json
+HASH_SCHEME = "pbkdf2_sha256"
+
+# Default PBKDF2 iteration count, raise it to make each hash more costly
+DEFAULT_ITERATIONS = 200000
+
+
+def hash_password(password, iterations=DEFAULT_ITERATIONS):
+    """
+    Hash a password for storage in user_pass.json.
+
+    Parameters:
+        password (str): Password to hash
+        iterations (int): PBKDF2 iteration count
+
+    Returns:
+        str: Entry of the form pbkdf2_sha256$<iterations>$<salt>$<hash>
+    """
+    salt = secrets.token_bytes(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+    return "$".join([HASH_SCHEME, str(iterations),
+                     base64.b64encode(salt).decode(),
+                     base64.b64encode(digest).decode()])
+
+
+def check_password(entry, password):
+    """
+    Check a password against a stored user_pass.json entry.
+
+    Parameters:
+        entry (str): Stored entry, either a hash or a plain password
+        password (str): Password to check
+
+    Returns:
+        bool: True if the password matches
+    """
+    if not entry.startswith(HASH_SCHEME + "$"):
+        return hmac.compare_digest(entry.encode(), password.encode())
+
+    _, iterations, salt, digest = entry.split("$")
+    candidate = hashlib.pbkdf2_hmac("sha256", password.encode(),
+                                    base64.b64decode(salt), int(iterations))
+    return hmac.compare_digest(candidate, base64.b64decode(digest))
+
+
+class CredentialStore:
+    def __init__(self, path="user_pass.json", ticket_lifetime=3600):
+        """
+        Initialize CredentialStore object. The credentials file is not
+        read until credentials are first needed.
+
+        Parameters:
+            path (str): Path to the credentials file
+            ticket_lifetime (int): Seconds a session ticket stays valid
+
+        Properties:
+            self.path: Path to the credentials file
+            self.ticket_lifetime: Seconds a session ticket stays valid
+            self.ticket_secret: Random key session tickets are signed with
+            self.entries: Dictionary of username to stored entry
+            self.file_state: Modification time and size of the loaded file,
+                             None until the file is loaded
+
+        Raises:
+            FileNotFoundError: If the credentials file does not exist
+        """
+        self.path = path
+        self.ticket_lifetime = ticket_lifetime
+        self.ticket_secret = secrets.token_bytes(32)
+        self.entries = {}
+        self.file_state = None
+
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(self.path)
+
+    def get_file_state(self):
+        """
+        Get the modification time and size of the credentials file.
+
+        Returns:
+            tuple: (mtime in nanoseconds, size in bytes)
+        """
+        stat = os.stat(self.path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def is_loaded(self):
+        """
+        Check whether the credentials file has been loaded yet.
+
+        Returns:
+            bool: True once the file has been loaded
+        """
+        return self.file_state is not None
+
+    def refresh(self):
+        """
+        Reload the credentials file if it changed since it was last loaded.
+
+        Only entries that were added, changed or removed are touched, so
+        tickets for unchanged users stay valid.
+
+        Returns:
+            set: Usernames whose entries changed
+        """
+        file_state = self.get_file_state()
+        if file_state == self.file_state:
+            return set()
+
+        with open(self.path, "r") as f:
+            entries = json.load(f)
+        self.file_state = file_state
+
+        changed = {username for username in self.entries.keys() | entries.keys()
+                   if self.entries.get(username) != entries.get(username)}
+        for username in changed:
+            if username in entries:
+                self.entries[username] = entries[username]
+            else:
+                del self.entries[username]
+
+        return changed
+
+    def __contains__(self, username):
+        if not self.is_loaded():
+            self.refresh()
+        return username in self.entries
+
+    def __iter__(self):
+        if not self.is_loaded():
+            self.refresh()
+        return iter(self.entries)
+
+    def issue_ticket(self, username):
+        """
+        Issue a session ticket for a client that has just logged in.
+
+        The ticket is signed with the server's ticket secret and bound to
+        the client's stored entry, so it stops working when the ticket
+        expires, the password changes or the server restarts.
+
+        Parameters:
+            username (str): Client's username
+
+        Returns:
+            str: Session ticket of the form <expiry>.<signature>
+        """
+        expiry = int(time.time()) + self.ticket_lifetime
+        return f"{expiry}.{self.sign_ticket(username, expiry)}"
+
+    def sign_ticket(self, username, expiry):
+        """
+        Compute the signature of a session ticket.
+
+        Parameters:
+            username (str): Client's username
+            expiry (int): Ticket expiry as a UNIX timestamp
+
+        Returns:
+            str: Hex HMAC-SHA256 signature
+        """
+        message = f"{username}|{expiry}|{self.entries[username]}".encode()
+        return hmac.new(self.ticket_secret, message, "sha256").hexdigest()
+
+    def check_ticket(self, username, ticket):
+        """
+        Check a session ticket presented in place of a password.
+
+        Parameters:
+            username (str): Client's username
+            ticket (str): Session ticket
+
+        Returns:
+            bool: True if the ticket is valid for this client
+        """
+        expiry, _, signature = ticket.partition(".")
+        if not expiry.isdigit() or int(expiry) < time.time():
+            return False
+        return hmac.compare_digest(signature,
+                                   self.sign_ticket(username, int(expiry)))
+
+    def verify(self, username, secret):
+        """
+        Verify a client's password or session ticket.
+
+        Tickets are checked first since they only cost one HMAC, so the
+        slow password hash only runs for a client's first login.
+
+        Parameters:
+            username (str): Client's username
+            secret (str): Client's password or session ticket
+
+        Returns:
+            bool: True if the credentials are valid
+        """
+        if username not in self:
+            return False
+        return (self.check_ticket(username, secret) or
+                check_password(self.entries[username], secret))
@@ -0,0 +1,644 @@
+"""
+Program:
+journal.py
+
+Purpose:
+Write-ahead journal for email delivery. The journal service runs in its
+own process next to the server. Server processes hand it each email over
+a Unix socket; the service appends the emails arriving within a short
+batch window to journal.log and makes the whole batch durable with one
+fsync (group commit) before acknowledging them. A background thread then
+applies committed emails to the recipients' mailboxes. After a crash,
+emails that were committed but not yet applied are replayed on startup.
+
+Server processes can also subscribe to a client's mailbox over the same
+socket, and are notified each time an email is filed into it.
+
+Authors:
+Jack Derksen
+Nolan Schlacht
+De Xie
+
+Last Updated:
+19/10/2026
+
+TO-DO:
+    -
+"""
+
+import json
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+import zlib
+from maildir import Mailbox
+
+# Journal record header: payload length, LSN, CRC32 of the payload
+RECORD_HEADER = struct.Struct(">IQI")
+
+# Length prefix of requests and replies on the journal socket
+MESSAGE_HEADER = struct.Struct(">I")
+
+# Seconds the journal service waits for an email to be committed before
+# handing it back to the server process to deliver itself
+COMMIT_TIMEOUT = 10
+
+
+def send_message(sock, message):
+    """
+    Send a length-prefixed JSON message over a journal socket.
+
+    Parameters:
+        sock: Connected Unix socket
+        message (dict): Message to send
+    """
+    payload = json.dumps(message).encode()
+    sock.sendall(MESSAGE_HEADER.pack(len(payload)) + payload)
+
+
+def recv_exact(sock, size):
+    """
+    Receive exactly the given number of bytes from a socket.
+
+    Parameters:
+        sock: Connected socket
+        size (int): Number of bytes to receive
+
+    Returns:
+        bytes: Received data, or None if the connection closed first
+    """
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def recv_message(sock):
+    """
+    Receive a length-prefixed JSON message from a journal socket.
+
+    Parameters:
+        sock: Connected Unix socket
+
+    Returns:
+        dict: Received message, or None if the connection closed
+    """
+    header = recv_exact(sock, MESSAGE_HEADER.size)
+    if header is None:
+        return None
+    payload = recv_exact(sock, MESSAGE_HEADER.unpack(header)[0])
+    if payload is None:
+        return None
+    return json.loads(payload)
+
+
+def append_delivery(recipients, content, socket_path="journal.sock"):
+    """
+    Journal an email for delivery and wait until it is durable.
+
+    Parameters:
+        recipients (list): Usernames to deliver the email to
+        content (str): Full email text, headers included
+        socket_path (str): Path of the journal service's socket
+
+    Returns:
+        int: LSN the email was committed under, or None if the journal
+             service is not running or could not commit it in time
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        return None
+
+    # The service answers within COMMIT_TIMEOUT, so only a service that
+    # has stopped responding altogether runs into this
+    sock.settimeout(2 * COMMIT_TIMEOUT)
+    try:
+        send_message(sock, {"recipients": recipients, "content": content})
+        reply = recv_message(sock)
+        return reply["lsn"] if reply else None
+    except OSError:
+        return None
+    finally:
+        sock.close()
+
+
+def append_deliveries(deliveries, socket_path="journal.sock"):
+    """
+    Journal several emails for delivery at once and wait until they are
+    all durable. They reach the journal service together, so they are
+    committed with as few fsyncs as the batch size allows.
+
+    Parameters:
+        deliveries (list): (recipients, full email text) tuples
+        socket_path (str): Path of the journal service's socket
+
+    Returns:
+        list: LSNs the emails were committed under, in order, with None
+              for each email the service could not commit in time, or
+              None if the journal service is not running
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        return None
+
+    sock.settimeout(2 * COMMIT_TIMEOUT)
+    try:
+        send_message(sock, {"deliveries": [
+            {"recipients": recipients, "content": content}
+            for recipients, content in deliveries]})
+        reply = recv_message(sock)
+        return reply["lsns"] if reply else None
+    except OSError:
+        return None
+    finally:
+        sock.close()
+
+
+def subscribe(username, socket_path="journal.sock"):
+    """
+    Subscribe to notifications of emails filed into a client's mailbox.
+
+    Parameters:
+        username (str): Username of the mailbox owner
+        socket_path (str): Path of the journal service's socket
+
+    Returns:
+        socket: Socket a message is received on for each email filed, or
+                None if the journal service is not running. Closing it
+                ends the subscription
+
+    Only returns once the service has registered the subscription, so
+    every email filed after subscribe returns is notified.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        send_message(sock, {"subscribe": username})
+        if recv_message(sock) is None:
+            sock.close()
+            return None
+    except (OSError, ValueError):
+        sock.close()
+        return None
+    return sock
+
+
+class PendingDelivery:
+    def __init__(self, recipients, content):
+        """
+        Initialize PendingDelivery object, an email waiting for commit.
+
+        Parameters:
+            recipients (list): Usernames to deliver the email to
+            content (str): Full email text, headers included
+
+        Properties:
+            self.recipients: Usernames to deliver the email to
+            self.content: Full email text
+            self.lsn: Log sequence number, set once committed
+            self.timestamp: Commit time in nanoseconds, set once committed
+            self.committed: Event set once the email is durable
+            self.withdrawn: Whether the email was handed back to the
+                            server process uncommitted, so it must not
+                            be committed
+        """
+        self.recipients = recipients
+        self.content = content
+        self.lsn = None
+        self.timestamp = None
+        self.committed = threading.Event()
+        self.withdrawn = False
+
+
+class DeliveryJournal:
+    def __init__(self, directory=".", batch_window=0.005, max_batch=256,
+                 checkpoint_size=1 << 20):
+        """
+        Initialize DeliveryJournal object.
+
+        Parameters:
+            directory (str): Directory holding the journal files
+            batch_window (float): Seconds to wait for more emails to join
+                                  a batch before committing it
+            max_batch (int): Maximum number of emails committed together
+            checkpoint_size (int): Journal size in bytes past which it is
+                                   truncated once fully applied
+
+        Properties:
+            self.log_path: Path of the journal
+            self.checkpoint_path: Path of the last applied LSN
+            self.dead_letter_path: Path of the records that could not
+                                   be applied
+            self.socket_path: Path of the service's Unix socket
+            self.batch_window: Seconds a batch stays open
+            self.max_batch: Maximum batch size
+            self.checkpoint_size: Size triggering a checkpoint
+            self.last_lsn: Last LSN committed
+            self.applied_lsn: Last LSN applied to mailboxes
+            self.pending: Queue of emails waiting for commit
+            self.unapplied: Queue of emails waiting to be applied
+            self.lock: Lock guarding the journal file
+            self.subscribers: Dictionary of username to the sockets
+                              subscribed to their mailbox
+            self.subscribers_lock: Lock guarding the subscribers
+        """
+        self.log_path = os.path.join(directory, "journal.log")
+        self.checkpoint_path = os.path.join(directory, "journal.checkpoint")
+        self.dead_letter_path = os.path.join(directory, "journal.deadletter")
+        self.socket_path = os.path.join(directory, "journal.sock")
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.checkpoint_size = checkpoint_size
+        self.last_lsn = 0
+        self.applied_lsn = 0
+        self.pending = queue.Queue()
+        self.unapplied = queue.Queue()
+        self.lock = threading.Lock()
+        self.subscribers = {}
+        self.subscribers_lock = threading.Lock()
+
+    def read_records(self):
+        """
+        Read every complete record in the journal.
+
+        A torn or corrupt record at the end (from a crash mid-write) ends
+        the journal.
+
+        Returns:
+            list: (lsn, record) tuples in commit order
+        """
+        records = []
+        try:
+            with open(self.log_path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return records
+
+        offset = 0
+        while offset + RECORD_HEADER.size <= len(data):
+            length, lsn, crc = RECORD_HEADER.unpack_from(data, offset)
+            start = offset + RECORD_HEADER.size
+            payload = data[start:start + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            records.append((lsn, json.loads(payload)))
+            offset = start + length
+
+        return records
+
+    def recover(self):
+        """
+        Replay emails committed to the journal but not yet checkpointed.
+        Records that cannot be applied are set aside (see set_aside), so
+        they do not stop the server from starting.
+
+        Returns:
+            int: Number of emails replayed
+        """
+        try:
+            with open(self.checkpoint_path, "r") as f:
+                self.applied_lsn = int(f.read())
+        except FileNotFoundError:
+            self.applied_lsn = 0
+        self.last_lsn = self.applied_lsn
+
+        replayed = 0
+        recipients = set()
+        for lsn, record in self.read_records():
+            self.last_lsn = max(self.last_lsn, lsn)
+            if lsn > self.applied_lsn:
+                try:
+                    self.apply(lsn, record)
+                except Exception as e:
+                    self.set_aside(lsn, record, e)
+                    continue
+                recipients.update(record["recipients"])
+                replayed += 1
+
+        # An email may have been filed before the crash without making it
+        # into its mailbox's index, so repair the indexes touched
+        for recipient in recipients:
+            mailbox = Mailbox(recipient)
+            try:
+                with mailbox.lock_index():
+                    mailbox.repair_index()
+            except Exception as e:
+                print(f"Could not repair the index of {recipient}: {e}")
+
+        self.applied_lsn = self.last_lsn
+        self.checkpoint()
+        return replayed
+
+    def apply(self, lsn, record):
+        """
+        Deliver a committed email to its recipients' mailboxes.
+
+        Emails are named after their LSN, so replaying one that was
+        already applied does nothing. They are not fsynced one by one,
+        since the journal already holds them durably.
+
+        Parameters:
+            lsn (int): Log sequence number of the email
+            record (dict): Journal record of the email
+        """
+        for recipient in record["recipients"]:
+            mailbox = Mailbox(recipient)
+            mailbox.create()
+            name = mailbox.journal_name(record["timestamp"], lsn)
+            mailbox.deliver(record["content"], name=name, fsync=False)
+
+    def set_aside(self, lsn, record, error):
+        """
+        Move a record that could not be applied out of the way, so the
+        emails after it are still delivered. It is appended to the dead
+        letter file as a JSON line, with the error, where it can be
+        inspected and replayed by hand. Applying is idempotent, so
+        replaying it does not duplicate any copies already filed.
+
+        Parameters:
+            lsn (int): Log sequence number of the record
+            record (dict): Journal record that could not be applied
+            error (Exception): Why it could not be applied
+        """
+        print(f"Journal record {lsn} could not be applied, setting it "
+              f"aside: {error!r}")
+        try:
+            with open(self.dead_letter_path, "a") as f:
+                f.write(json.dumps({"lsn": lsn, "error": repr(error),
+                                    "record": record}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Could not write journal record {lsn} to the dead "
+                  f"letter file: {e}")
+
+    def checkpoint(self):
+        """
+        Record that every committed email has been applied, and empty
+        the journal.
+
+        Returns:
+            bool: False if emails were committed that are not yet applied,
+                  in which case nothing is done
+        """
+        with self.lock:
+            if self.applied_lsn != self.last_lsn:
+                return False
+
+            # Make the applied mailbox files durable before the journal
+            # entries backing them are dropped
+            os.sync()
+
+            tmp_path = self.checkpoint_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                f.write(str(self.applied_lsn))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.checkpoint_path)
+
+            with open(self.log_path, "wb") as f:
+                f.flush()
+                os.fsync(f.fileno())
+
+        return True
+
+    def commit_loop(self):
+        """
+        Commit pending emails in groups.
+
+        Waits for an email, keeps the batch open for batch_window seconds
+        (or until max_batch emails arrive), then appends the whole batch
+        to the journal with a single fsync and releases its senders.
+        """
+        log = open(self.log_path, "ab")
+        while True:
+            batch = [self.pending.get()]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            # The journal is opened for appending, so writes land at its end
+            # even after a checkpoint has emptied it
+            with self.lock:
+                batch = [delivery for delivery in batch
+                         if not delivery.withdrawn]
+                for delivery in batch:
+                    self.last_lsn += 1
+                    delivery.lsn = self.last_lsn
+                    delivery.timestamp = time.time_ns()
+                    payload = json.dumps({
+                        "recipients": delivery.recipients,
+                        "content": delivery.content,
+                        "timestamp": delivery.timestamp,
+                    }).encode()
+                    log.write(RECORD_HEADER.pack(
+                        len(payload), delivery.lsn, zlib.crc32(payload)))
+                    log.write(payload)
+                log.flush()
+                os.fsync(log.fileno())
+
+            for delivery in batch:
+                delivery.committed.set()
+                self.unapplied.put(delivery)
+
+    def apply_loop(self):
+        """
+        Apply committed emails to mailboxes in commit order, checkpointing
+        once the journal has grown large and everything has been applied.
+        An email that cannot be applied is set aside (see set_aside) and
+        the loop moves on to the next.
+        """
+        while True:
+            delivery = self.unapplied.get()
+            record = {
+                "recipients": delivery.recipients,
+                "content": delivery.content,
+                "timestamp": delivery.timestamp,
+            }
+            # Anything raised here would end the thread, and with it all
+            # delivery, so every failure is caught
+            try:
+                self.apply(delivery.lsn, record)
+            except Exception as e:
+                self.set_aside(delivery.lsn, record, e)
+            else:
+                self.notify(delivery.recipients, delivery.lsn)
+            self.applied_lsn = delivery.lsn
+
+            if (self.unapplied.empty() and
+                    os.path.getsize(self.log_path) >= self.checkpoint_size):
+                self.checkpoint()
+
+    def notify(self, recipients, lsn):
+        """
+        Notify the subscribers of each recipient's mailbox that an email
+        was filed into it.
+
+        Parameters:
+            recipients (list): Usernames the email was delivered to
+            lsn (int): Log sequence number of the email
+        """
+        # Subscribers are sent to outside the lock, so one slow to read
+        # its notifications does not hold up subscribing or other
+        # commits' notifications waiting on the lock
+        with self.subscribers_lock:
+            subscribers = [(recipient, conn) for recipient in recipients
+                           for conn in self.subscribers.get(recipient, ())]
+
+        for recipient, conn in subscribers:
+            try:
+                send_message(conn, {"username": recipient, "lsn": lsn})
+            except OSError:
+                with self.subscribers_lock:
+                    self.subscribers.get(recipient, set()).discard(conn)
+
+    def handle_subscription(self, conn, username):
+        """
+        Keep a subscriber's socket registered until it is closed. The
+        subscriber is acknowledged once its socket is registered, see
+        subscribe.
+
+        Parameters:
+            conn: Connected Unix socket
+            username (str): Username of the mailbox subscribed to
+        """
+        try:
+            # Acknowledged before any notification can be sent to it,
+            # so the two are not interleaved
+            with self.subscribers_lock:
+                self.subscribers.setdefault(username, set()).add(conn)
+                send_message(conn, {"subscribed": username})
+            while conn.recv(1024):
+                pass
+        except OSError:
+            pass
+        finally:
+            with self.subscribers_lock:
+                self.subscribers[username].discard(conn)
+                if not self.subscribers[username]:
+                    del self.subscribers[username]
+
+    def withdraw(self, deliveries):
+        """
+        Take back the emails not yet committed, so the committer skips
+        them. Their LSNs are left as None.
+
+        Parameters:
+            deliveries (list): PendingDelivery objects
+
+        Returns:
+            bool: False if the journal stayed locked (eg. by a commit
+                  that is stuck), in which case nothing is withdrawn
+        """
+        if not self.lock.acquire(timeout=COMMIT_TIMEOUT):
+            return False
+        try:
+            for delivery in deliveries:
+                if delivery.lsn is None:
+                    delivery.withdrawn = True
+        finally:
+            self.lock.release()
+        return True
+
+    def handle_connection(self, conn):
+        """
+        Serve one server process's journal request, either emails to
+        commit or a subscription to a mailbox. Emails not committed
+        within COMMIT_TIMEOUT seconds are withdrawn and answered with a
+        None LSN, so the server process delivers them itself.
+
+        Parameters:
+            conn: Connected Unix socket
+        """
+        try:
+            request = recv_message(conn)
+            if request is None:
+                return
+            if "subscribe" in request:
+                self.handle_subscription(conn, request["subscribe"])
+                return
+            if "deliveries" in request:
+                deliveries = [PendingDelivery(item["recipients"],
+                                              item["content"])
+                              for item in request["deliveries"]]
+            else:
+                deliveries = [PendingDelivery(request["recipients"],
+                                              request["content"])]
+
+            # Queued together, so they join the same commit batches
+            for delivery in deliveries:
+                self.pending.put(delivery)
+            deadline = time.monotonic() + COMMIT_TIMEOUT
+            for delivery in deliveries:
+                delivery.committed.wait(max(deadline - time.monotonic(), 0))
+
+            if not all(delivery.committed.is_set()
+                       for delivery in deliveries):
+                print("Emails were not committed in time, handing them "
+                      "back to the server")
+                # If they cannot be withdrawn, no answer is sent and the
+                # server process gives up waiting on its own
+                if not self.withdraw(deliveries):
+                    return
+
+            if "deliveries" in request:
+                send_message(conn, {"lsns": [delivery.lsn
+                                             for delivery in deliveries]})
+            else:
+                send_message(conn, {"lsn": deliveries[0].lsn})
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+    def watch_parent(self, parent_pid):
+        """
+        Exit the journal process once the server process that started it
+        is gone, so it is never left running on its own.
+
+        Parameters:
+            parent_pid (int): Process ID of the server
+        """
+        while os.getppid() == parent_pid:
+            time.sleep(1)
+        os._exit(0)
+
+    def run(self):
+        """
+        Serve delivery requests until killed or the server exits.
+        recover() must be called first.
+        """
+        threading.Thread(target=self.watch_parent, args=(os.getppid(),),
+                         daemon=True).start()
+
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socket_path)
+        listener.listen(128)
+
+        threading.Thread(target=self.commit_loop, daemon=True).start()
+        threading.Thread(target=self.apply_loop, daemon=True).start()
+
+        while True:
+            conn, _ = listener.accept()
+            threading.Thread(target=self.handle_connection, args=(conn,),
+                             daemon=True).start()
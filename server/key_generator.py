@@ -4,7 +4,15 @@ key_generator.py
 
 Purpose:
 Generate public and private keys for server, as well as a possible JSON
-file for client credentials if one is not already present.
+file for client credentials if one is not already present. Also rotates
+the server's keys while the server is running:
+
+    python3 key_generator.py --rotate           Add a new current key pair
+    python3 key_generator.py --retire <key ID>  Remove an old key pair
+
+and hashes plain passwords in user_pass.json:
+
+    python3 key_generator.py --hash-passwords
 
 Authors:
 Jack Derksen
@@ -12,15 +20,19 @@ Nolan Schlacht
 De Xie
 
 Last Updated:
-23/11/2024
+19/10/2026
 
 TO-DO:
     - 
 """
 
 from Crypto.PublicKey import RSA
+from credential_store import hash_password, HASH_SCHEME
+from key_registry import KeyRegistry, server_key_id
+import glob
 import json
 import os
+import sys
 
 def generate_server_keys():
     """
@@ -39,6 +51,124 @@ def generate_server_keys():
     with open("server_public.pem", "wb") as f:
         f.write(public_key)
 
+def rotate_server_keys():
+    """
+    Add a new server key pair without disturbing the existing ones.
+    The new private key is added to server_keys/, where a running server
+    picks it up, and server_public.pem is replaced so clients are handed
+    the new public key from now on. Clients holding an older public key
+    keep working until that key is retired. Both files are written to a
+    temporary file and swapped in, so a running server never reads a
+    half-written key.
+
+    Output: key_id - ID of the new key pair
+    """
+    key = RSA.generate(2048)
+    public_key = key.publickey().export_key()
+    key_id = server_key_id(public_key)
+
+    os.makedirs("server_keys", exist_ok=True)
+    write_key_file(os.path.join("server_keys", f"{key_id}_private.pem"),
+                   key.export_key())
+    write_key_file("server_public.pem", public_key)
+
+    return key_id
+
+def write_key_file(path, key_data):
+    """
+    Write a PEM file to a temporary file, flush it to disk, and swap it
+    in place of path.
+
+    Input: path - Path of the PEM file
+           key_data - Exported key
+    """
+    with open(path + ".tmp", "wb") as f:
+        f.write(key_data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+def retire_server_key(key_id):
+    """
+    Remove an old server key pair. Clients still holding its public key
+    will be refused until they are given the current server_public.pem.
+
+    Input: key_id - ID of the key pair to remove
+
+    Output: removed - True if a key pair with that ID was found
+    """
+    key_paths = glob.glob(os.path.join("server_keys", "*_private.pem"))
+    key_paths.append("server_private.pem")
+
+    for key_path in key_paths:
+        if not os.path.exists(key_path):
+            continue
+        with open(key_path, "rb") as f:
+            public_key = RSA.import_key(f.read()).publickey().export_key()
+        if server_key_id(public_key) == key_id:
+            os.remove(key_path)
+            return True
+
+    return False
+
+def load_credentials():
+    """
+    Load the contents of user_pass.json
+
+    Output: credentials - Dictionary mapping username to stored entry, empty
+                          if the file does not exist
+    """
+    if not os.path.exists("user_pass.json"):
+        return {}
+    with open("user_pass.json", "r") as f:
+        return json.load(f)
+
+def save_credentials(credentials):
+    """
+    Replace the contents of user_pass.json. Writes to a temporary file and
+    swaps it in, so a running server never reads a half-written file.
+
+    Input: credentials - Dictionary mapping username to stored entry
+    """
+    with open("user_pass.json.tmp", "w") as f:
+        json.dump(credentials, f, indent=2)
+    os.replace("user_pass.json.tmp", "user_pass.json")
+
+def hash_passwords():
+    """
+    Replace any plain passwords in user_pass.json with salted hashes
+
+    Output: count - Number of passwords hashed
+    """
+    credentials = load_credentials()
+    plain = [username for username, entry in credentials.items()
+             if not entry.startswith(HASH_SCHEME + "$")]
+    for username in plain:
+        credentials[username] = hash_password(credentials[username])
+    save_credentials(credentials)
+    return len(plain)
+
+def register_clients(clients):
+    """
+    Register a batch of clients with the server in a single pass.
+    Merges the new credentials (as password hashes) into user_pass.json
+    with one rewrite and registers every client's public key in one
+    registry transaction.
+
+    Input: clients - Dictionary mapping username to a (password,
+                     public_key) tuple, public_key being PEM bytes
+    """
+    # Load the existing credentials once
+    credentials = load_credentials()
+
+    public_keys = {}
+    for username, (password, public_key) in clients.items():
+        credentials[username] = hash_password(password)
+        public_keys[username] = public_key
+    KeyRegistry().store_many(public_keys)
+
+    save_credentials(credentials)
+
 def initialize_server():
     """
     Initialize server directory with necessary files and structure.
@@ -65,4 +195,15 @@ def initialize_server():
     print("- user_pass.json")
 
 if __name__ == "__main__":
-    initialize_server()
+    if len(sys.argv) == 2 and sys.argv[1] == "--rotate":
+        print(f"Added server key {rotate_server_keys()}")
+        print("Copy the new server_public.pem to the clients.")
+    elif len(sys.argv) == 2 and sys.argv[1] == "--hash-passwords":
+        print(f"Hashed {hash_passwords()} passwords in user_pass.json")
+    elif len(sys.argv) == 3 and sys.argv[1] == "--retire":
+        if not retire_server_key(sys.argv[2]):
+            print(f"Error: No server key with ID {sys.argv[2]}")
+            sys.exit(1)
+        print(f"Retired server key {sys.argv[2]}")
+    else:
+        initialize_server()
@@ -0,0 +1,155 @@
+"""
+Program:
+key_pool.py
+
+Purpose:
+Keep a stock of pre-generated RSA key pairs on disk so that new accounts
+can be handed a key pair instantly instead of waiting on RSA.generate().
+Run as a service from the server directory to keep the pool topped up in
+the background:
+
+    python3 key_pool.py [--stock N] [--interval SECONDS] [--workers N]
+
+Authors:
+Jack Derksen
+Nolan Schlacht
+De Xie
+
+Last Updated:
+19/10/2026
+
+TO-DO:
+    -
+"""
+
+import argparse
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from Crypto.PublicKey import RSA
+
+
+def generate_key_pem(_=None):
+    """
+    Generate a 2048-bit RSA key pair in a worker process.
+
+    Returns:
+        bytes: Private key in PEM format
+    """
+    return RSA.generate(2048).export_key()
+
+
+class KeyPool:
+    def __init__(self, directory="key_pool", stock=50, workers=None):
+        """
+        Initialize KeyPool object.
+
+        Parameters:
+            directory (str): Directory the pre-generated keys are kept in
+            stock (int): Number of key pairs to keep in the pool
+            workers (int): Worker processes used for replenishing, defaults
+                           to the CPU count
+
+        Properties:
+            self.directory: Pool directory
+            self.stock: Target number of keys in the pool
+            self.workers: Worker process count for replenishing
+        """
+        self.directory = directory
+        self.stock = stock
+        self.workers = workers
+        os.makedirs(self.directory, exist_ok=True)
+
+    def available(self):
+        """
+        List the key files currently in the pool.
+
+        Returns:
+            list: Filenames of unclaimed keys
+        """
+        return [name for name in os.listdir(self.directory)
+                if name.endswith(".pem")]
+
+    def take(self):
+        """
+        Take one key pair out of the pool.
+
+        Keys are claimed by renaming them, which is atomic, so several
+        processes can take from the same pool without handing out the
+        same key twice.
+
+        Returns:
+            RSA key object, or None if the pool is empty
+        """
+        for name in self.available():
+            key_path = os.path.join(self.directory, name)
+            claimed_path = f"{key_path}.{os.getpid()}.claimed"
+            try:
+                os.rename(key_path, claimed_path)
+            except FileNotFoundError:
+                # Another process claimed this key first
+                continue
+
+            with open(claimed_path, "rb") as f:
+                key = RSA.import_key(f.read())
+            os.remove(claimed_path)
+            return key
+
+        return None
+
+    def replenish(self):
+        """
+        Generate key pairs until the pool is back at its target stock.
+
+        Returns:
+            int: Number of key pairs added
+        """
+        missing = self.stock - len(self.available())
+        if missing <= 0:
+            return 0
+
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            for private_key in pool.map(generate_key_pem, range(missing)):
+                # Write under a temporary name so take() never sees a
+                # partially written key
+                name = uuid.uuid4().hex
+                tmp_path = os.path.join(self.directory, f"{name}.tmp")
+                with open(tmp_path, "wb") as f:
+                    f.write(private_key)
+                os.replace(tmp_path,
+                           os.path.join(self.directory, f"{name}.pem"))
+
+        return missing
+
+    def run(self, interval=5):
+        """
+        Keep the pool topped up until interrupted.
+
+        Parameters:
+            interval (int): Seconds to wait between stock checks
+        """
+        print(f"Key pool service keeping {self.stock} keys in "
+              f"{self.directory}/")
+        while True:
+            added = self.replenish()
+            if added:
+                print(f"Added {added} keys to the pool")
+            time.sleep(interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Keep a pool of pre-generated RSA key pairs")
+    parser.add_argument("--stock", type=int, default=50,
+                        help="number of key pairs to keep in the pool")
+    parser.add_argument("--interval", type=int, default=5,
+                        help="seconds between stock checks")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: CPU count)")
+    args = parser.parse_args()
+
+    try:
+        KeyPool(stock=args.stock, workers=args.workers).run(args.interval)
+    except KeyboardInterrupt:
+        print("\nKey pool service shutting down...")
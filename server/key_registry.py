@@ -0,0 +1,227 @@
+"""
+Program:
+key_registry.py
+
+Purpose:
+Central registry of client public keys. Keys are kept in a single SQLite
+table keyed by username and indexed by key fingerprint. Each key is looked
+up once, when its client first connects, and cached in memory so the
+server can pick a client's cipher straight from the fingerprint the client
+sends during the handshake.
+
+Authors:
+Jack Derksen
+Nolan Schlacht
+De Xie
+
+Last Updated:
+19/10/2026
+
+TO-DO:
+    -
+"""
+
+import glob
+import hashlib
+import os
+import sqlite3
+from Crypto.PublicKey import RSA
+from Crypto.Cipher import PKCS1_OAEP
+
+# Length of the server key ID prefixed to a client's encrypted credentials
+KEY_ID_LENGTH = 16
+
+
+def key_fingerprint(public_key_data):
+    """
+    Compute the fingerprint of a public key.
+
+    Parameters:
+        public_key_data (bytes): Public key in PEM format
+
+    Returns:
+        str: Hex SHA-256 digest of the key's DER encoding
+    """
+    der = RSA.import_key(public_key_data).export_key("DER")
+    return hashlib.sha256(der).hexdigest()
+
+
+def server_key_id(public_key_data):
+    """
+    Compute the ID of a server key pair.
+
+    Parameters:
+        public_key_data (bytes): Server public key in PEM format
+
+    Returns:
+        str: Leading hex digits of the public key's fingerprint
+    """
+    return key_fingerprint(public_key_data)[:KEY_ID_LENGTH]
+
+
+class KeyRegistry:
+    def __init__(self, path="key_registry.db"):
+        """
+        Initialize KeyRegistry object. Keys are loaded as clients connect.
+
+        Parameters:
+            path (str): Path to the registry database
+
+        Properties:
+            self.path: Path to the registry database
+            self.fingerprints: Dictionary of username to key fingerprint,
+                               for keys loaded so far
+            self.keys: Dictionary of fingerprint to public key data
+            self.ciphers: Dictionary of fingerprint to PKCS1_OAEP cipher,
+                          filled in as clients connect
+        """
+        self.path = path
+        self.fingerprints = {}
+        self.keys = {}
+        self.ciphers = {}
+
+        is_new = not os.path.exists(self.path)
+        with self.connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS client_keys ("
+                "username TEXT PRIMARY KEY, "
+                "fingerprint TEXT NOT NULL, "
+                "public_key BLOB NOT NULL)")
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS client_keys_fingerprint "
+                "ON client_keys (fingerprint)")
+        if is_new:
+            self.import_pem_files()
+
+    def connect(self):
+        """
+        Open a connection to the registry database.
+
+        Connections are opened per operation rather than held open, since
+        the server forks a child per client and SQLite connections must not
+        be shared across a fork.
+
+        Returns:
+            sqlite3.Connection: Connection to the registry
+        """
+        return sqlite3.connect(self.path, timeout=10)
+
+    def import_pem_files(self, directory="."):
+        """
+        Import keys stored in the old flat <username>_public.pem layout.
+        Clients that already have a registered key are skipped.
+
+        Parameters:
+            directory (str): Directory holding the PEM files
+
+        Returns:
+            int: Number of keys imported
+        """
+        keys = {}
+        for key_path in glob.glob(os.path.join(directory, "*_public.pem")):
+            username = os.path.basename(key_path)[:-len("_public.pem")]
+            if username == "server" or os.path.getsize(key_path) == 0:
+                continue
+            if self.lookup(username) is not None:
+                continue
+            with open(key_path, "rb") as f:
+                keys[username] = f.read()
+
+        self.store_many(keys)
+        return len(keys)
+
+    def store(self, username, public_key_data):
+        """
+        Register or replace a client's public key.
+
+        Parameters:
+            username (str): Client's username
+            public_key_data (bytes): Client's public key in PEM format
+
+        Returns:
+            str: Fingerprint of the stored key
+        """
+        return self.store_many({username: public_key_data})[username]
+
+    def store_many(self, keys):
+        """
+        Register or replace several client public keys in one transaction.
+
+        Parameters:
+            keys (dict): Dictionary of username to public key data
+
+        Returns:
+            dict: Dictionary of username to stored key fingerprint
+        """
+        fingerprints = {username: key_fingerprint(public_key_data)
+                        for username, public_key_data in keys.items()}
+
+        db = self.connect()
+        try:
+            with db:
+                db.executemany(
+                    "INSERT OR REPLACE INTO client_keys "
+                    "(username, fingerprint, public_key) VALUES (?, ?, ?)",
+                    [(username, fingerprints[username], public_key_data)
+                     for username, public_key_data in keys.items()])
+        finally:
+            db.close()
+
+        for username, public_key_data in keys.items():
+            self.fingerprints[username] = fingerprints[username]
+            self.keys[fingerprints[username]] = public_key_data
+
+        return fingerprints
+
+    def lookup(self, username):
+        """
+        Fetch a client's key from the database, the first time the client
+        connects or after its key was replaced (eg. by another server
+        process).
+
+        Parameters:
+            username (str): Client's username
+
+        Returns:
+            str: Key fingerprint, or None if no key is registered
+        """
+        db = self.connect()
+        try:
+            row = db.execute(
+                "SELECT fingerprint, public_key FROM client_keys "
+                "WHERE username = ?", (username,)).fetchone()
+        finally:
+            db.close()
+
+        if row is None:
+            return None
+
+        fingerprint, public_key_data = row
+        self.fingerprints[username] = fingerprint
+        self.keys[fingerprint] = public_key_data
+        return fingerprint
+
+    def get_cipher(self, username, fingerprint=None):
+        """
+        Get the cipher for a client's registered key.
+
+        Parameters:
+            username (str): Client's username
+            fingerprint (str): Fingerprint of the key the client holds, or
+                               None to accept whichever key is registered
+
+        Returns:
+            PKCS1_OAEP cipher, or None if the client has no registered key
+            or the registered key does not match the given fingerprint
+        """
+        registered = self.fingerprints.get(username)
+        if registered is None or (fingerprint and registered != fingerprint):
+            registered = self.lookup(username)
+
+        if registered is None or (fingerprint and registered != fingerprint):
+            return None
+
+        if registered not in self.ciphers:
+            key = RSA.import_key(self.keys[registered])
+            self.ciphers[registered] = PKCS1_OAEP.new(key)
+        return self.ciphers[registered]
@@ -0,0 +1,150 @@
+"""
+Program:
+layout.py
+
+Purpose:
+On-disk layout of the server's client mail directories. Directories are
+sharded under mail/ by a two-level prefix of the hash of the username
+(eg. mail/3f/a2/client1/), so no single directory grows with the number
+of users. Also migrates servers from the old flat layout, where every
+client directory and <username>_public.pem sat in the server directory
+and emails were stored as <sender>_<title>.txt:
+
+    python3 layout.py migrate      Move a flat layout into shards
+    python3 layout.py path <user>  Print the directory for a client
+
+Authors:
+Jack Derksen
+Nolan Schlacht
+De Xie
+
+Last Updated:
+19/10/2026
+
+TO-DO:
+    -
+"""
+
+import glob
+import hashlib
+import json
+import os
+import sys
+
+# Directory all client mail directories are sharded under
+MAIL_ROOT = "mail"
+
+
+def client_path(username):
+    """
+    Get the path of a client's mail directory.
+
+    Parameters:
+        username (str): Client's username
+
+    Returns:
+        str: Path of the form mail/<xx>/<yy>/<username>
+    """
+    digest = hashlib.sha256(username.encode()).hexdigest()
+    return os.path.join(MAIL_ROOT, digest[:2], digest[2:4], username)
+
+
+def merge_directory(source, target):
+    """
+    Move the contents of a directory into another, merging directories
+    both hold entry by entry. Files the target already holds are left
+    where they are, as is source if anything is left in it.
+
+    Parameters:
+        source (str): Directory to move from
+        target (str): Directory to move into, created if needed
+
+    Returns:
+        list: Paths of the files left in source, since the target
+              already holds a file by that name
+    """
+    os.makedirs(target, exist_ok=True)
+    conflicts = []
+    for name in os.listdir(source):
+        source_path = os.path.join(source, name)
+        target_path = os.path.join(target, name)
+        if not os.path.lexists(target_path):
+            os.rename(source_path, target_path)
+        elif os.path.isdir(source_path) and os.path.isdir(target_path):
+            conflicts += merge_directory(source_path, target_path)
+        else:
+            conflicts.append(source_path)
+
+    if not conflicts:
+        os.rmdir(source)
+    return conflicts
+
+
+def migrate_flat_layout():
+    """
+    Move client directories and public keys out of the flat layout.
+
+    Each <username>/ directory of a user in user_pass.json is moved to its
+    sharded path (merged into it if it already exists, see
+    merge_directory), emails stored as <sender>_<title>.txt are moved
+    into the client's mailbox, and each <username>_public.pem not yet in
+    the key registry is imported into it. A PEM file is only removed
+    once the registry holds its key, so the keys of clients registered
+    with a different key (or unreadable ones) are left in place.
+
+    Returns:
+        tuple: (directories moved, emails moved, keys imported, paths
+                of files not moved as their sharded path was taken)
+    """
+    # Imported here since both modules build on the layout helpers (and
+    # the registry pulls in the crypto dependencies)
+    from key_registry import KeyRegistry, key_fingerprint
+    from maildir import Mailbox
+
+    with open("user_pass.json", "r") as f:
+        usernames = list(json.load(f))
+
+    moved = 0
+    conflicts = []
+    for username in usernames:
+        if not os.path.isdir(username):
+            continue
+
+        left = merge_directory(username, client_path(username))
+        conflicts += left
+        if not left:
+            moved += 1
+
+    emails = sum(Mailbox(username).import_flat_emails()
+                 for username in usernames)
+
+    registry = KeyRegistry()
+    imported = registry.import_pem_files()
+    for key_path in glob.glob("*_public.pem"):
+        username = key_path[:-len("_public.pem")]
+        if username == "server":
+            continue
+        try:
+            with open(key_path, "rb") as f:
+                fingerprint = key_fingerprint(f.read())
+        except ValueError:
+            continue
+        if registry.lookup(username) == fingerprint:
+            os.remove(key_path)
+
+    return moved, emails, imported, conflicts
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 2 and sys.argv[1] == "migrate":
+        moved, emails, imported, conflicts = migrate_flat_layout()
+        print(f"Moved {moved} client directories into {MAIL_ROOT}/")
+        print(f"Moved {emails} emails into client mailboxes")
+        print(f"Imported {imported} public keys into the key registry")
+        for path in conflicts:
+            print(f"Not moved, already in {MAIL_ROOT}/: {path}")
+    elif len(sys.argv) == 3 and sys.argv[1] == "path":
+        print(client_path(sys.argv[2]))
+    else:
+        print("Usage: python3 layout.py migrate | path <username>")
+        sys.exit(1)
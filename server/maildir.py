@@ -0,0 +1,911 @@
+"""
+Program:
+maildir.py
+
+Purpose:
+Maildir-style storage for a client's emails. Each email is written to
+tmp/, flushed to disk and then renamed into new/ under a unique name, so
+readers in other server processes never see a partially written email
+and two emails never overwrite each other. Emails move to cur/ once they
+have been viewed.
+
+Emails are stored encrypted. Each one is encrypted (AES-CTR) with its own
+random content key when it is delivered, and the content key is kept at
+the start of the file, wrapped with the server's storage key. Serving an
+email then only needs its content key unwrapped, the stored ciphertext
+can be sent to clients as it is. Emails stored before encryption was
+added are still read as plain text.
+
+Each mailbox also keeps an index of its emails' headers in delivery
+order, so a page of the inbox can be read without opening every email.
+The index (headers) is an array of fixed-size binary records holding the
+delivery time in microseconds, a sender ID (the sender's position in
+senders) and the offsets of the email's name and title in strings, along
+with where the body starts in the email text. An email's ID is its
+position in delivery order, which never changes, so clients can ask for
+the emails delivered after the last ID they saw, and any email's record
+is found without searching. Emails are added to the mailbox's search
+index as they are delivered.
+
+Authors:
+Jack Derksen
+Nolan Schlacht
+De Xie
+
+Last Updated:
+19/10/2026
+
+TO-DO:
+    -
+"""
+
+import contextlib
+import datetime
+import fcntl
+import itertools
+import json
+import os
+import socket
+import struct
+import time
+from Crypto.Cipher import AES
+from Crypto.Random import get_random_bytes
+from layout import client_path
+from search import SearchIndex
+
+# Per-process counter making names unique within one nanosecond
+delivery_counter = itertools.count()
+
+# Start of an encrypted email: a marker, the email's content key wrapped
+# with the storage key, and the nonce it is encrypted with
+SEALED_HEADER = struct.Struct("4s32s8s")
+SEALED_MARKER = b"SMC1"
+
+# File holding the key content keys are wrapped with
+STORAGE_KEY_PATH = "storage.key"
+
+# Storage key, once loaded
+storage_key_cache = None
+
+# Header index record: delivery time in microseconds, sender ID, offset and
+# length of the email's name and of its title in the strings file, and
+# offset and length of its body in the email text
+INDEX_RECORD = struct.Struct("<qIIHIHII")
+
+# Largest name or title a header record can hold the length of, in bytes
+STRING_LIMIT = 0xFFFF
+
+
+def storage_key():
+    """
+    Get the key content keys are wrapped with, creating it the first
+    time it is needed.
+
+    The key is written to a temporary file and linked into place, so
+    server processes racing to create it all end up with the same key.
+
+    Returns:
+        bytes: 32 byte AES key
+    """
+    global storage_key_cache
+    if storage_key_cache is not None:
+        return storage_key_cache
+
+    if not os.path.exists(STORAGE_KEY_PATH):
+        tmp_path = f"{STORAGE_KEY_PATH}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(get_random_bytes(32))
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.link(tmp_path, STORAGE_KEY_PATH)
+        except FileExistsError:
+            # Another process created it first
+            pass
+        os.remove(tmp_path)
+
+    with open(STORAGE_KEY_PATH, "rb") as f:
+        storage_key_cache = f.read()
+    return storage_key_cache
+
+
+def seal(data):
+    """
+    Encrypt an email for storage under a new content key.
+
+    Parameters:
+        data (bytes): Email text
+
+    Returns:
+        bytes: Sealed header followed by the encrypted email
+    """
+    content_key = get_random_bytes(32)
+    nonce = get_random_bytes(8)
+    wrapped_key = AES.new(storage_key(), AES.MODE_ECB).encrypt(content_key)
+    ciphertext = AES.new(content_key, AES.MODE_CTR, nonce=nonce).encrypt(data)
+    return SEALED_HEADER.pack(SEALED_MARKER, wrapped_key, nonce) + ciphertext
+
+
+def unseal_key(f):
+    """
+    Read the content key of a stored email.
+
+    Parameters:
+        f: Email file opened in binary mode, read from its start
+
+    Returns:
+        tuple: (content key, nonce), or None if the email is stored as
+               plain text. The file is left at the start of the email's
+               encrypted text, or of its plain text
+    """
+    header = f.read(SEALED_HEADER.size)
+    if len(header) < SEALED_HEADER.size or \
+            not header.startswith(SEALED_MARKER):
+        f.seek(0)
+        return None
+
+    _, wrapped_key, nonce = SEALED_HEADER.unpack(header)
+    content_key = AES.new(storage_key(), AES.MODE_ECB).decrypt(wrapped_key)
+    return content_key, nonce
+
+
+class Mailbox:
+    def __init__(self, username):
+        """
+        Initialize Mailbox object.
+
+        Parameters:
+            username (str): Username of the client owning the mailbox
+
+        Properties:
+            self.username: Username of the mailbox owner
+            self.path: Path of the client's mail directory
+            self.index_path: Path of the mailbox's header index
+            self.strings_path: Path of the names and titles the header
+                               records point to
+            self.senders_path: Path of the list of senders, by sender ID
+            self.old_index_path: Path of the header index in the old JSON
+                                 lines format, converted when found
+            self.epoch_path: Path of the mailbox's epoch, changed each
+                             time its emails are numbered afresh
+        """
+        self.username = username
+        self.path = client_path(username)
+        self.index_path = os.path.join(self.path, "headers")
+        self.strings_path = os.path.join(self.path, "strings")
+        self.senders_path = os.path.join(self.path, "senders")
+        self.old_index_path = os.path.join(self.path, "index")
+        self.epoch_path = os.path.join(self.path, "epoch")
+
+    def create(self):
+        """
+        Create the mailbox's tmp/, new/ and cur/ directories.
+        """
+        for state in ("tmp", "new", "cur"):
+            os.makedirs(os.path.join(self.path, state), exist_ok=True)
+
+    def unique_name(self, timestamp=None):
+        """
+        Generate a unique name for a new email.
+
+        Names start with the delivery time in nanoseconds, so sorting names
+        sorts emails by delivery time.
+
+        Parameters:
+            timestamp (int): Delivery time in nanoseconds, defaults to now
+
+        Returns:
+            str: Name of the form <time>.<pid>_<counter>.<hostname>
+        """
+        if timestamp is None:
+            timestamp = time.time_ns()
+        hostname = socket.gethostname().replace("/", "_").replace(".", "_")
+        return (f"{timestamp}.{os.getpid()}_{next(delivery_counter)}."
+                f"{hostname}")
+
+    def journal_name(self, timestamp, lsn):
+        """
+        Generate the name of an email delivered through the journal.
+
+        The name only depends on the email's journal record, so replaying
+        the record after a crash yields the same name.
+
+        Parameters:
+            timestamp (int): Commit time in nanoseconds
+            lsn (int): Log sequence number of the email
+
+        Returns:
+            str: Name of the form <time>.L<lsn>.<hostname>
+        """
+        hostname = socket.gethostname().replace("/", "_").replace(".", "_")
+        return f"{timestamp}.L{lsn}.{hostname}"
+
+    def deliver(self, content, name=None, fsync=True):
+        """
+        Atomically deliver an email to the mailbox.
+
+        Parameters:
+            content (str): Full email text, headers included
+            name (str): Name to store the email under, defaults to a new
+                        unique name. Nothing is done if an email with this
+                        name was already delivered
+            fsync (bool): Flush the email to disk before it appears in
+                          new/, can be skipped when the email is already
+                          durable elsewhere (eg. in the journal)
+
+        Returns:
+            str: Name the email was stored under
+
+        Raises:
+            ValueError: If the email's header lines are malformed, in
+                        which case it is not delivered
+        """
+        if name is None:
+            name = self.unique_name()
+        elif (os.path.exists(os.path.join(self.path, "new", name)) or
+                os.path.exists(os.path.join(self.path, "cur", name))):
+            return name
+
+        # Built first, so an email that cannot be indexed never appears
+        # in new/
+        entry = index_entry(name, content)
+
+        tmp_path = os.path.join(self.path, "tmp", name)
+        with open(tmp_path, "wb") as f:
+            f.write(seal(content.encode()))
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+
+        os.rename(tmp_path, os.path.join(self.path, "new", name))
+        self.append_index(entry, content)
+        return name
+
+    def messages(self):
+        """
+        List the emails in the mailbox, skipping any still being delivered.
+
+        new/ is listed before cur/, so an email being marked as seen while
+        the listing runs is still found (in cur/) rather than missed.
+
+        Returns:
+            list: Email names, newest first
+        """
+        names = set()
+        for state in ("new", "cur"):
+            try:
+                names.update(os.listdir(os.path.join(self.path, state)))
+            except FileNotFoundError:
+                # Nothing has been delivered to this mailbox yet
+                pass
+        return sorted(names, reverse=True)
+
+    def read(self, name, header_only=False):
+        """
+        Read an email, decrypting it if it is stored encrypted.
+
+        Parameters:
+            name (str): Email name
+            header_only (bool): Only read the header lines, up to and
+                                including "Content:"
+
+        Returns:
+            str: Email text, or None if the email does not exist
+        """
+        f = self.open(name)
+        if f is None:
+            return None
+
+        with f:
+            sealed = unseal_key(f)
+            if sealed is None:
+                decrypt = bytes
+            else:
+                decrypt = AES.new(sealed[0], AES.MODE_CTR,
+                                  nonce=sealed[1]).decrypt
+
+            if not header_only:
+                return decrypt(f.read()).decode()
+
+            # Decrypt a block at a time until the end of the header lines
+            data = b""
+            while True:
+                chunk = f.read(4096)
+                data += decrypt(chunk)
+                end = data.find(b"\nContent:")
+                if end >= 0 and data.find(b"\n", end + 1) >= 0:
+                    return data[:data.find(b"\n", end + 1) + 1].decode()
+                if not chunk:
+                    return data.decode()
+
+    def open(self, name):
+        """
+        Open an email for reading its raw, stored bytes.
+
+        Parameters:
+            name (str): Email name
+
+        Returns:
+            file: Email opened in binary mode, or None if the email does
+                  not exist
+        """
+        for state in ("new", "cur"):
+            try:
+                return open(os.path.join(self.path, state, name), "rb")
+            except FileNotFoundError:
+                # Marked as seen since it was listed, look in cur/
+                continue
+        return None
+
+    def mark_seen(self, name):
+        """
+        Move an email from new/ to cur/ once it has been viewed.
+
+        Parameters:
+            name (str): Email name
+        """
+        try:
+            os.rename(os.path.join(self.path, "new", name),
+                      os.path.join(self.path, "cur", name))
+        except FileNotFoundError:
+            # Already seen
+            pass
+
+    def append_index(self, entry, content):
+        """
+        Add an email to the end of the header index, and to the search
+        index.
+
+        The email is given the ID following the last one in the index. If
+        the mailbox has no index yet (eg. it predates the index), one is
+        built from the emails on disk instead, which includes this email.
+
+        Parameters:
+            entry (dict): Index entry of the email
+            content (str): Full email text, headers included
+        """
+        with self.lock_index():
+            if not os.path.exists(self.index_path):
+                self.build_index()
+                return
+            entry["id"] = self.last_id() + 1
+            self.write_records([entry])
+            SearchIndex(self.path).add(entry, content)
+
+    @contextlib.contextmanager
+    def lock_index(self):
+        """
+        Hold an exclusive lock on the header index, shared with every
+        server process.
+        """
+        with open(os.path.join(self.path, "index.lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def ensure_index(self):
+        """
+        Build the header index if the mailbox has emails but no index
+        (eg. it predates the index).
+        """
+        if os.path.exists(self.index_path):
+            return
+        if not (self.messages() or os.path.exists(self.old_index_path)):
+            return
+        with self.lock_index():
+            if not os.path.exists(self.index_path):
+                self.build_index()
+
+    def build_index(self):
+        """
+        Build the header index of a mailbox that has none. An index in
+        the old JSON lines format is converted, keeping its email IDs,
+        otherwise the index is rebuilt from the emails on disk. The index
+        lock must be held.
+        """
+        if not os.path.exists(self.old_index_path):
+            self.rebuild_index()
+            return
+
+        entries = []
+        with open(self.old_index_path, "r") as f:
+            for line in f:
+                old_entry = json.loads(line)
+                content = self.read(old_entry["name"])
+                if content is None:
+                    continue
+                try:
+                    entries.append(index_entry(old_entry["name"], content))
+                except ValueError as e:
+                    print(f"Skipping email that cannot be indexed: {e}")
+        self.write_records(entries, replace=True)
+        os.remove(self.old_index_path)
+        SearchIndex(self.path).clear()
+
+    def rebuild_index(self):
+        """
+        Rebuild the header index from the emails on disk, ordered by
+        delivery time. Emails are numbered afresh from 1, so the search
+        index is emptied, to be refilled on the next search, and the
+        mailbox is given a new epoch, so clients drop what they keep by
+        email ID (see epoch).
+        """
+        names = self.messages()
+        names.reverse()
+
+        entries = []
+        for name in names:
+            entry = self.read_entry(name)
+            if entry is not None:
+                entries.append(entry)
+        self.write_records(entries, replace=True)
+        SearchIndex(self.path).clear()
+
+        tmp_path = self.epoch_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(time.time_ns()))
+        os.replace(tmp_path, self.epoch_path)
+
+    def epoch(self):
+        """
+        Get the mailbox's epoch. Email IDs only mean the same emails
+        while the epoch stays the same, so a client keeping emails or
+        the last email seen by ID drops them when it changes.
+
+        Returns:
+            str: Epoch, "0" if the emails were never numbered afresh
+        """
+        self.ensure_index()
+        try:
+            with open(self.epoch_path, "r") as f:
+                return f.read()
+        except FileNotFoundError:
+            return "0"
+
+    def repair_index(self):
+        """
+        Add emails on disk that are missing from the header index (eg.
+        filed just before a crash) to its end, keeping the IDs of the
+        emails already indexed. The index lock must be held.
+        """
+        if not os.path.exists(self.index_path):
+            if self.messages() or os.path.exists(self.old_index_path):
+                self.build_index()
+            return
+
+        indexed = {entry["name"]
+                   for entry in self.read_records(1, self.last_id())}
+        missing = [name for name in self.messages() if name not in indexed]
+        missing.reverse()
+
+        entries = []
+        for name in missing:
+            entry = self.read_entry(name)
+            if entry is not None:
+                entries.append(entry)
+        self.write_records(entries)
+
+    def read_entry(self, name):
+        """
+        Build the header index entry of an email on disk.
+
+        Parameters:
+            name (str): Email name
+
+        Returns:
+            dict: Index entry, or None if the email does not exist or its
+                  header lines are malformed
+        """
+        f = self.open(name)
+        if f is None:
+            return None
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            if f.read(len(SEALED_MARKER)) == SEALED_MARKER:
+                size -= SEALED_HEADER.size
+
+        header = self.read(name, header_only=True)
+        if header is None:
+            return None
+        try:
+            return index_entry(name, header, size)
+        except ValueError as e:
+            print(f"Skipping email that cannot be indexed: {e}")
+            return None
+
+    def load_senders(self):
+        """
+        Read the mailbox's list of senders, whose positions are the sender
+        IDs used by header records.
+
+        Returns:
+            list: Sender usernames, by sender ID
+        """
+        try:
+            with open(self.senders_path, "r") as f:
+                return f.read().split("\n")[:-1]
+        except FileNotFoundError:
+            return []
+
+    def write_records(self, entries, replace=False):
+        """
+        Write header records for emails, appending them to the header
+        index or replacing it.
+
+        Names and titles are appended to the strings file and new senders
+        to the senders file before the records pointing to them are
+        written, and neither file is ever rewritten, so a crash part way
+        leaves at worst unused strings behind. A partly written record at
+        the end of the index (from a crash mid-write) is overwritten.
+        The index lock must be held.
+
+        Parameters:
+            entries (list): Index entries, in delivery order. Each is
+                            given its ID
+            replace (bool): Replace the index rather than append to it
+        """
+        senders = self.load_senders()
+        sender_ids = {sender: sender_id
+                      for sender_id, sender in enumerate(senders)}
+        new_senders = []
+
+        with open(self.strings_path, "ab") as strings:
+            offset = strings.tell()
+            records = bytearray()
+            first_id = 1 if replace else self.last_id() + 1
+            for email_id, entry in enumerate(entries, start=first_id):
+                entry["id"] = email_id
+                if entry["from"] not in sender_ids:
+                    sender_ids[entry["from"]] = len(senders) + \
+                        len(new_senders)
+                    new_senders.append(entry["from"])
+
+                name = entry["name"].encode()
+                title = entry["title"].encode()
+                strings.write(name + title)
+                records += INDEX_RECORD.pack(
+                    entry["timestamp"], sender_ids[entry["from"]],
+                    offset, len(name), offset + len(name), len(title),
+                    entry["body_offset"], entry["body_length"])
+                offset += len(name) + len(title)
+
+        if new_senders:
+            with open(self.senders_path, "a") as f:
+                f.write("".join(sender + "\n" for sender in new_senders))
+
+        if replace:
+            tmp_path = self.index_path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(records)
+            os.replace(tmp_path, self.index_path)
+            return
+
+        with open(self.index_path, "r+b") as f:
+            f.seek(self.last_id() * INDEX_RECORD.size)
+            f.write(records)
+            f.truncate()
+
+    def read_records(self, first_id, count):
+        """
+        Read consecutive header records.
+
+        The records are read from the index in one read and unpacked in
+        one pass, and the strings they point to are read from the
+        strings file in one read.
+
+        Parameters:
+            first_id (int): ID of the first email to read
+            count (int): Number of emails to read
+
+        Returns:
+            list: Index entries, in ID order, each a dict with the email's
+                  ID, name, sender, timestamp, date, title and the offset
+                  and length of its body
+        """
+        first_id = max(first_id, 1)
+        count = min(count, self.last_id() - first_id + 1)
+        if count <= 0:
+            return []
+
+        with open(self.index_path, "rb") as f:
+            f.seek((first_id - 1) * INDEX_RECORD.size)
+            records = list(INDEX_RECORD.iter_unpack(
+                f.read(count * INDEX_RECORD.size)))
+
+        start = min(record[2] for record in records)
+        end = max(record[4] + record[5] for record in records)
+        with open(self.strings_path, "rb") as f:
+            f.seek(start)
+            strings = f.read(end - start)
+
+        senders = self.load_senders()
+        entries = []
+        for email_id, record in enumerate(records, start=first_id):
+            (timestamp, sender_id, name_offset, name_length, title_offset,
+             title_length, body_offset, body_length) = record
+            name_offset -= start
+            title_offset -= start
+            entries.append({
+                "id": email_id,
+                "name": strings[name_offset:
+                                name_offset + name_length].decode(),
+                "from": senders[sender_id],
+                "timestamp": timestamp,
+                "date": format_timestamp(timestamp),
+                "title": strings[title_offset:
+                                 title_offset + title_length].decode(),
+                "body_offset": body_offset,
+                "body_length": body_length,
+            })
+        return entries
+
+    def last_id(self):
+        """
+        Get the ID of the newest email in the header index.
+
+        Records have a fixed size, so this is the number of complete
+        records in the index.
+
+        Returns:
+            int: Email ID, 0 if the mailbox is empty
+        """
+        try:
+            return os.path.getsize(self.index_path) // INDEX_RECORD.size
+        except FileNotFoundError:
+            return 0
+
+    def count(self):
+        """
+        Count the emails in the header index.
+
+        Returns:
+            int: Number of emails
+        """
+        self.ensure_index()
+        return self.last_id()
+
+    def page(self, offset=0, limit=None, newest_first=True):
+        """
+        Read one page of the header index.
+
+        The index is in delivery order and its records have a fixed size,
+        so only the records of the page are read.
+
+        Parameters:
+            offset (int): Number of emails to skip
+            limit (int): Maximum number of emails to return, None for all
+            newest_first (bool): Page through newest emails first
+
+        Returns:
+            list: Index entries of the page, see read_records
+        """
+        self.ensure_index()
+        total = self.last_id()
+        if limit is None:
+            limit = total
+
+        if not newest_first:
+            return self.read_records(offset + 1, limit)
+
+        last = total - offset
+        first = max(last - limit + 1, 1)
+        entries = self.read_records(first, last - first + 1)
+        entries.reverse()
+        return entries
+
+    def get(self, email_id):
+        """
+        Read the header index entry of an email by its ID.
+
+        Parameters:
+            email_id (int): Email ID
+
+        Returns:
+            dict: Index entry, or None if there is no such email
+        """
+        self.ensure_index()
+        if email_id < 1:
+            return None
+        entries = self.read_records(email_id, 1)
+        return entries[0] if entries else None
+
+    def get_many(self, email_ids):
+        """
+        Read the header index entries of several emails by their IDs.
+
+        IDs are read in order, each run of consecutive IDs with a single
+        read of the index, so fetching a block of emails costs one read
+        rather than one per email.
+
+        Parameters:
+            email_ids (list): Email IDs
+
+        Returns:
+            dict: Dictionary of email ID to index entry, leaving out IDs
+                  with no email
+        """
+        self.ensure_index()
+        ids = sorted({email_id for email_id in email_ids
+                      if 1 <= email_id <= self.last_id()})
+
+        entries = {}
+        run_start = 0
+        for position in range(1, len(ids) + 1):
+            if position < len(ids) and \
+                    ids[position] == ids[position - 1] + 1:
+                continue
+            for entry in self.read_records(ids[run_start],
+                                           position - run_start):
+                entries[entry["id"]] = entry
+            run_start = position
+        return entries
+
+    def since(self, last_id):
+        """
+        Read the header index entries of the emails delivered after a
+        given email.
+
+        Parameters:
+            last_id (int): ID of the last email already known, 0 for none
+
+        Returns:
+            list: Index entries with a greater ID, oldest first
+        """
+        self.ensure_index()
+        return self.read_records(last_id + 1, self.last_id() - last_id)
+
+    def search(self, query, limit=None):
+        """
+        Search the mailbox's emails.
+
+        Emails the search index missed are added to it first.
+
+        Parameters:
+            query (str): Search query, see search.py
+            limit (int): Maximum number of emails to return, None for all
+
+        Returns:
+            list: Index entries of the matching emails, newest first
+        """
+        self.ensure_index()
+        if not os.path.exists(self.index_path):
+            return []
+
+        search_index = SearchIndex(self.path)
+        search_index.catch_up(self)
+        return [self.get(email_id)
+                for email_id in search_index.search(query, limit)]
+
+    def query(self, **filters):
+        """
+        Filter and sort the mailbox's emails by their headers.
+
+        Emails the search index missed are added to it first.
+
+        Parameters:
+            filters: Filters, order and page, see SearchIndex.query.
+                     Dates are timestamps in microseconds
+
+        Returns:
+            tuple: (headers of the page's emails, total number of
+                    matching emails)
+        """
+        self.ensure_index()
+        if not os.path.exists(self.index_path):
+            return [], 0
+
+        search_index = SearchIndex(self.path)
+        search_index.catch_up(self)
+        emails, total = search_index.query(**filters)
+        for email in emails:
+            email["date"] = format_timestamp(email["timestamp"])
+        return emails, total
+
+    def import_flat_emails(self):
+        """
+        Move emails from the old <sender>_<title>.txt layout into new/.
+        Each email keeps its modification time as its delivery time.
+
+        Returns:
+            int: Number of emails moved
+        """
+        try:
+            filenames = [name for name in os.listdir(self.path)
+                         if name.endswith(".txt")]
+        except FileNotFoundError:
+            return 0
+
+        self.create()
+        for filename in filenames:
+            path = os.path.join(self.path, filename)
+            name = self.unique_name(os.stat(path).st_mtime_ns)
+            os.rename(path, os.path.join(self.path, "new", name))
+
+        return len(filenames)
+
+
+def index_entry(name, content, size=None):
+    """
+    Build the header index entry of an email.
+
+    Parameters:
+        name (str): Email name
+        content (str): Email text, or at least its header lines
+        size (int): Size of the email text in bytes, when only the
+                    header lines are given
+
+    Returns:
+        dict: Email name, sender, delivery time in microseconds, title,
+              and offset and length in bytes of its body. A title longer
+              than STRING_LIMIT bytes is cut short, the email itself is
+              left whole
+
+    Raises:
+        ValueError: If the email's From, Time and Date, Title or Content
+                    lines are missing or malformed, or its name is longer
+                    than STRING_LIMIT bytes
+    """
+    lines = content.split('\n')
+    if len(lines) < 4 or "Content:" not in lines:
+        raise ValueError(f"Email {name} is missing header lines")
+    for number, field in ((0, "From"), (2, "Time and Date"), (3, "Title")):
+        if not lines[number].startswith(f"{field}: "):
+            raise ValueError(f"Email {name} has no {field} line")
+    if len(name.encode()) > STRING_LIMIT:
+        raise ValueError(f"Email name {name[:20]}... is too long")
+    body_line = lines.index("Content:") + 1
+    body_offset = len('\n'.join(lines[:body_line]).encode()) + 1
+    if size is None:
+        size = len(content.encode())
+
+    # Emails carry their delivery time as text, fall back on the time
+    # their name starts with if it cannot be read
+    timestamp = parse_timestamp(lines[2].split(': ', 1)[1])
+    if timestamp is None:
+        timestamp = int(name.split(".")[0]) // 1000
+
+    # Header records hold the title's length in 16 bits, a title cut in
+    # the middle of a character loses that character
+    title = lines[3].split(': ', 1)[1].encode()[:STRING_LIMIT]
+
+    return {
+        "name": name,
+        "from": lines[0].split(': ', 1)[1],
+        "timestamp": timestamp,
+        "title": title.decode(errors="ignore"),
+        "body_offset": body_offset,
+        "body_length": max(size - body_offset, 0),
+    }
+
+
+def parse_timestamp(text):
+    """
+    Convert a date and time, as written in emails, to a timestamp.
+
+    Parameters:
+        text (str): Date and time, eg. 2026-10-19 12:30:00.123456
+
+    Returns:
+        int: Microseconds since the epoch, or None if the text is not a
+             date
+    """
+    try:
+        moment = datetime.datetime.fromisoformat(text.strip())
+    except ValueError:
+        return None
+    return int(moment.timestamp()) * 1000000 + moment.microsecond
+
+
+def format_timestamp(timestamp):
+    """
+    Convert a timestamp to a date and time, as written in emails.
+
+    Parameters:
+        timestamp (int): Microseconds since the epoch
+
+    Returns:
+        str: Date and time, eg. 2026-10-19 12:30:00.123456
+    """
+    seconds, microseconds = divmod(timestamp, 1000000)
+    moment = datetime.datetime.fromtimestamp(seconds)
+    return str(moment.replace(microsecond=microseconds))
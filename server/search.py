@@ -0,0 +1,363 @@
+"""
+Program:
+search.py
+
+Purpose:
+Full-text search over a client's mailbox. Each mailbox keeps an inverted
+index in search.db, mapping every word of an email's sender, title and
+body to the IDs of the emails containing it. Emails are added to it as
+they are delivered, and any the index missed (eg. filed just before a
+crash, or emails delivered before the index existed) are added the next
+time the mailbox is searched.
+
+search.db also holds each email's sender, title and delivery time,
+indexed so the inbox can be filtered by sender, title prefix or date
+range and sorted by any of them without reading every email.
+
+Queries are words separated by spaces, all of which must match. A word
+can be limited to one field (from:alice, title:report) and can end with
+* to match any word starting with it (repo*).
+
+Authors:
+Jack Derksen
+Nolan Schlacht
+De Xie
+
+Last Updated:
+19/10/2026
+
+TO-DO:
+    -
+"""
+
+import os
+import re
+import sqlite3
+
+# Fields of an email that are indexed
+FIELDS = ("from", "title", "body")
+
+# Orders the inbox can be sorted in, and the header column for each
+SORT_COLUMNS = {"date": "timestamp", "from": "sender", "title": "title_key"}
+
+# Version of the index's tables, indexes with an older version are refilled
+SCHEMA_VERSION = 2
+
+
+def tokenize(text):
+    """
+    Split text into the lowercase words that are indexed.
+
+    Parameters:
+        text (str): Text to split
+
+    Returns:
+        set: Distinct words in the text
+    """
+    return set(re.findall(r"\w+", text.lower()))
+
+
+def email_fields(content):
+    """
+    Split an email into its indexed fields.
+
+    Parameters:
+        content (str): Full email text, headers included
+
+    Returns:
+        dict: Dictionary of field name to text
+    """
+    lines = content.split('\n')
+    return {
+        "from": lines[0].split(': ', 1)[1],
+        "title": lines[3].split(': ', 1)[1],
+        "body": '\n'.join(lines[lines.index("Content:") + 1:]),
+    }
+
+
+class SearchIndex:
+    def __init__(self, directory):
+        """
+        Initialize SearchIndex object for a mailbox.
+
+        Parameters:
+            directory (str): Mailbox directory holding search.db
+
+        Properties:
+            self.path: Path to the index database
+        """
+        self.path = os.path.join(directory, "search.db")
+
+        db = self.connect()
+        try:
+            with db:
+                # Indexes from before the current tables are dropped, to
+                # be refilled on the next search
+                if db.execute("PRAGMA user_version").fetchone()[0] != \
+                        SCHEMA_VERSION:
+                    for table in ("postings", "indexed", "watermark",
+                                  "headers"):
+                        db.execute(f"DROP TABLE IF EXISTS {table}")
+                    db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS postings ("
+                    "token TEXT NOT NULL, "
+                    "field TEXT NOT NULL, "
+                    "email_id INTEGER NOT NULL, "
+                    "PRIMARY KEY (token, field, email_id)) WITHOUT ROWID")
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS indexed ("
+                    "email_id INTEGER PRIMARY KEY)")
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS watermark ("
+                    "email_id INTEGER NOT NULL)")
+                if db.execute("SELECT COUNT(*) FROM watermark"
+                              ).fetchone()[0] == 0:
+                    db.execute("INSERT INTO watermark VALUES (0)")
+
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS headers ("
+                    "email_id INTEGER PRIMARY KEY, "
+                    "sender TEXT NOT NULL, "
+                    "title TEXT NOT NULL, "
+                    "title_key TEXT NOT NULL, "
+                    "timestamp INTEGER NOT NULL)")
+                db.execute("CREATE INDEX IF NOT EXISTS headers_sender "
+                           "ON headers (sender, timestamp)")
+                db.execute("CREATE INDEX IF NOT EXISTS headers_title "
+                           "ON headers (title_key, timestamp)")
+                db.execute("CREATE INDEX IF NOT EXISTS headers_timestamp "
+                           "ON headers (timestamp)")
+        finally:
+            db.close()
+
+    def connect(self):
+        """
+        Open a connection to the index database.
+
+        Connections are opened per operation rather than held open, since
+        the server forks a child per client and SQLite connections must not
+        be shared across a fork. The index can always be rebuilt from the
+        mailbox, so commits are not flushed to disk one by one.
+
+        Returns:
+            sqlite3.Connection: Connection to the index
+        """
+        db = sqlite3.connect(self.path, timeout=10)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def add(self, entry, content):
+        """
+        Add an email to the index.
+
+        Parameters:
+            entry (dict): Header index entry of the email
+            content (str): Full email text, headers included
+        """
+        self.add_many([(entry, content)])
+
+    def add_many(self, emails):
+        """
+        Add several emails, and their headers, to the index in one
+        transaction.
+
+        Emails already indexed are skipped. The watermark, below which
+        every email is indexed, moves up past the emails added.
+
+        Parameters:
+            emails (list): (header index entry, full email text) tuples
+        """
+        db = self.connect()
+        try:
+            with db:
+                for entry, content in emails:
+                    email_id = entry["id"]
+                    if db.execute("INSERT OR IGNORE INTO indexed VALUES (?)",
+                                  (email_id,)).rowcount == 0:
+                        continue
+                    db.executemany(
+                        "INSERT OR IGNORE INTO postings VALUES (?, ?, ?)",
+                        [(token, field, email_id)
+                         for field, text in email_fields(content).items()
+                         for token in tokenize(text)])
+
+                    db.execute(
+                        "INSERT OR REPLACE INTO headers "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (email_id, entry["from"], entry["title"],
+                         entry["title"].lower(), entry["timestamp"]))
+
+                watermark = db.execute("SELECT email_id FROM watermark"
+                                       ).fetchone()[0]
+                while db.execute("SELECT 1 FROM indexed WHERE email_id = ?",
+                                 (watermark + 1,)).fetchone():
+                    watermark += 1
+                db.execute("UPDATE watermark SET email_id = ?", (watermark,))
+        finally:
+            db.close()
+
+    def watermark(self):
+        """
+        Get the ID below which every email is indexed.
+
+        Returns:
+            int: Email ID
+        """
+        db = self.connect()
+        try:
+            return db.execute("SELECT email_id FROM watermark").fetchone()[0]
+        finally:
+            db.close()
+
+    def catch_up(self, mailbox):
+        """
+        Add the mailbox's emails that the index missed.
+
+        Parameters:
+            mailbox (Mailbox): Mailbox the index belongs to
+
+        Returns:
+            int: Number of emails looked at
+        """
+        entries = mailbox.since(self.watermark())
+        emails = []
+        for entry in entries:
+            content = mailbox.read(entry["name"])
+            if content is not None:
+                emails.append((entry, content))
+        if emails:
+            self.add_many(emails)
+        return len(entries)
+
+    def clear(self):
+        """
+        Empty the index, eg. once the mailbox's emails have been numbered
+        afresh.
+        """
+        db = self.connect()
+        try:
+            with db:
+                db.execute("DELETE FROM postings")
+                db.execute("DELETE FROM headers")
+                db.execute("DELETE FROM indexed")
+                db.execute("UPDATE watermark SET email_id = 0")
+        finally:
+            db.close()
+
+    def search(self, query, limit=None):
+        """
+        Find the emails matching every word of a query.
+
+        Parameters:
+            query (str): Words separated by spaces, each optionally
+                         prefixed by a field (from:, title:, body:) and
+                         ending with * to match as a prefix
+            limit (int): Maximum number of IDs to return, None for all
+
+        Returns:
+            list: Matching email IDs, newest first
+        """
+        selects = []
+        params = []
+        for term in query.lower().split():
+            field, _, word = term.rpartition(":")
+            prefix = word.endswith("*")
+            words = re.findall(r"\w+", word)
+
+            for position, token in enumerate(words, start=1):
+                select = "SELECT email_id FROM postings WHERE "
+                if prefix and position == len(words):
+                    # Tokens only hold word characters, so none of them
+                    # are GLOB wildcards
+                    select += "token GLOB ?"
+                    params.append(token + "*")
+                else:
+                    select += "token = ?"
+                    params.append(token)
+                if field in FIELDS:
+                    select += " AND field = ?"
+                    params.append(field)
+                selects.append(select)
+
+        if not selects:
+            return []
+
+        sql = " INTERSECT ".join(selects) + " ORDER BY email_id DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        db = self.connect()
+        try:
+            return [row[0] for row in db.execute(sql, params)]
+        finally:
+            db.close()
+
+    def query(self, sender=None, title_prefix=None, after=None, before=None,
+              sort="date", descending=True, offset=0, limit=None):
+        """
+        Filter and sort the mailbox's emails using the header indexes.
+
+        Parameters:
+            sender (str): Only emails from this sender
+            title_prefix (str): Only emails whose title starts with this,
+                                ignoring case
+            after (int): Only emails delivered at or after this time,
+                         in microseconds since the epoch
+            before (int): Only emails delivered before this time
+            sort (str): Order to sort by, "date", "from" or "title"
+            descending (bool): Sort in descending order
+            offset (int): Number of emails to skip
+            limit (int): Maximum number of emails to return, None for all
+
+        Returns:
+            tuple: (headers of the page's emails, each a dict with the
+                    email's ID, sender, timestamp and title, total number
+                    of matching emails)
+
+        Raises:
+            ValueError: If the sort order is unknown
+        """
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"Unknown sort order {sort}")
+
+        conditions = []
+        params = []
+        if sender:
+            conditions.append("sender = ?")
+            params.append(sender)
+        if title_prefix:
+            # Every title starting with the prefix sorts between it and
+            # the prefix followed by the highest character
+            conditions.append("title_key >= ? AND title_key < ?")
+            title_key = title_prefix.lower()
+            params += [title_key, title_key + "\U0010ffff"]
+        if after is not None:
+            conditions.append("timestamp >= ?")
+            params.append(after)
+        if before is not None:
+            conditions.append("timestamp < ?")
+            params.append(before)
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+
+        direction = "DESC" if descending else "ASC"
+        sql = (f"SELECT email_id, sender, timestamp, title "
+               f"FROM headers{where} "
+               f"ORDER BY {SORT_COLUMNS[sort]} {direction}, "
+               f"email_id {direction} LIMIT ? OFFSET ?")
+
+        db = self.connect()
+        try:
+            total = db.execute(f"SELECT COUNT(*) FROM headers{where}",
+                               params).fetchone()[0]
+            emails = [
+                {"id": email_id, "from": sender, "timestamp": timestamp,
+                 "title": title}
+                for email_id, sender, timestamp, title in db.execute(
+                    sql, params + [-1 if limit is None else limit, offset])]
+        finally:
+            db.close()
+        return emails, total
@@ -11,70 +11,482 @@ Nolan Schlacht
 De Xie
 
 Last Updated:
-1/12/2024
+19/10/2026
 
 TO-DO:
     -
 """
 
-import json
 import socket
 import os
 import glob
+import json
+import mmap
+import select
 import datetime
+import signal
+import struct
 import sys
 from Crypto.PublicKey import RSA
 from Crypto.Cipher import PKCS1_OAEP, AES
 from Crypto.Random import get_random_bytes
+from attachments import AttachmentStore, email_attachments, \
+    MAX_CHUNK_SIZE
+from credential_store import CredentialStore
+from journal import DeliveryJournal, append_delivery, append_deliveries, \
+    recv_message, subscribe
+from key_registry import KeyRegistry, key_fingerprint, server_key_id, \
+    KEY_ID_LENGTH
+from maildir import Mailbox, parse_timestamp, unseal_key
+from search import SORT_COLUMNS
+
+# Maximum number of emails returned by a search
+SEARCH_LIMIT = 100
+
+# Bytes of an email stored as plain text encrypted and sent at a time
+SEND_CHUNK_SIZE = 64 * 1024
+
+# Maximum number of emails sent in reply to one GET
+GET_LIMIT = 100
+
+# Maximum number of emails received in one BATCH
+BATCH_LIMIT = 100
+
+# Maximum length in characters of an email's title and contents, as the
+# client enforces them
+TITLE_LIMIT = 100
+CONTENT_LIMIT = 1000000
+
+# Filters a QUERY can hold, and the type of each one's value
+QUERY_FILTERS = {"sender": str, "title_prefix": str, "after": str,
+                 "before": str, "sort": str, "descending": bool,
+                 "offset": int, "limit": int}
+
+
+def send_frame(client_socket, cipher, data):
+    """
+    Send a message of any size as one encrypted frame.
+
+    A frame is the message length (4 bytes) followed by the padded,
+    encrypted message, so the receiver knows exactly how much to read.
+
+    Parameters:
+        client_socket: Socket connection to client
+        cipher: AES cipher for this session
+        data (bytes): Message to send
+    """
+    padded = data.ljust((len(data) // 16 + 1) * 16)
+    client_socket.sendall(
+        struct.pack(">I", len(data)) + cipher.encrypt(padded))
+
+
+def parse_id_list(text, limit=GET_LIMIT):
+    """
+    Parse a list of numbers and ranges of numbers, eg. "1-5,8 10".
+
+    Parameters:
+        text (str): Numbers and inclusive ranges, separated by commas
+                    or spaces
+        limit (int): Maximum number of numbers to return
+
+    Returns:
+        list: Numbers in the order given, without repeats
+
+    Raises:
+        ValueError: If the list holds anything else
+    """
+    numbers = {}
+    for item in text.replace(",", " ").split():
+        first, _, last = item.partition("-")
+        for number in range(int(first), int(last or first) + 1):
+            if len(numbers) >= limit:
+                return list(numbers)
+            numbers[number] = None
+    return list(numbers)
+
+
+def parse_count(args, position, default):
+    """
+    Parse a command's argument that counts emails or is an email ID.
+
+    Parameters:
+        args (list): Command split into words, the command first
+        position (int): Position of the argument in args
+        default: Value to use if the argument is missing or is not a
+                 whole number of at least 0
+
+    Returns:
+        int: Argument's value, or the default
+    """
+    try:
+        value = int(args[position])
+    except (IndexError, ValueError):
+        return default
+    return value if value >= 0 else default
+
+
+def parse_query_filters(text):
+    """
+    Parse and check the filters of a QUERY, see SearchIndex.query.
+
+    Parameters:
+        text (str): JSON object of filters, order and page, with dates
+                    as written in emails
+
+    Returns:
+        dict: Filters, with dates as timestamps, or None if the text is
+              not JSON, holds an unknown filter or a value of the wrong
+              type, or a date or order that is not valid
+    """
+    try:
+        filters = json.loads(text)
+    except ValueError:
+        return None
+    if not isinstance(filters, dict):
+        return None
+
+    for name, value in filters.items():
+        # bool is a subclass of int, so it is ruled out for numbers
+        expected = QUERY_FILTERS.get(name)
+        if expected is None or not isinstance(value, expected) or \
+                (expected is int and isinstance(value, bool)):
+            return None
+        if expected is int and value < 0:
+            return None
+
+    if filters.get("sort", "date") not in SORT_COLUMNS:
+        return None
+
+    # Date bounds are sent as dates, and compared as timestamps
+    for bound in ("after", "before"):
+        if bound in filters:
+            try:
+                filters[bound] = parse_timestamp(filters[bound])
+            except (OverflowError, OSError, ValueError):
+                return None
+            if filters[bound] is None:
+                return None
+    return filters
+
+
+def parse_upload(text):
+    """
+    Parse and check the description of an attachment upload, see
+    handle_upload_attachment.
+
+    Parameters:
+        text (bytes): JSON object with the attachment's size, the hashes
+                      of its chunks and the transfer to resume, if any
+
+    Returns:
+        dict: Upload, or None if the text is not JSON, the size is not a
+              whole number of at least 0, a hash is not a hex SHA-256
+              hash, or there are more chunks than bytes or too few to
+              hold the size in chunks of at most MAX_CHUNK_SIZE
+    """
+    try:
+        upload = json.loads(text)
+    except ValueError:
+        return None
+    if not isinstance(upload, dict):
+        return None
+
+    # bool is a subclass of int, so it is ruled out for the size
+    size = upload.get("size")
+    chunks = upload.get("chunks")
+    if not isinstance(size, int) or isinstance(size, bool) or size < 0:
+        return None
+    if not isinstance(chunks, list) or not all(
+            isinstance(digest, str) and len(digest) == 64 and
+            all(c in "0123456789abcdef" for c in digest)
+            for digest in chunks):
+        return None
+    if not (size + MAX_CHUNK_SIZE - 1) // MAX_CHUNK_SIZE <= \
+            len(chunks) <= size:
+        return None
+    if not isinstance(upload.get("transfer", ""), (str, type(None))):
+        return None
+    return upload
+
+
+def check_email_format(email_content, sender):
+    """
+    Check that an email received from a client is in the email format,
+    so nothing that cannot be filed and indexed reaches the journal.
+
+    Parameters:
+        email_content (str): Email as sent by the client
+        sender (str): Username of sending client
+
+    Returns:
+        list: The email's lines
+
+    Raises:
+        ValueError: If the email is not from the sender, is missing its
+                    To, Title, Content Length or Content lines, names a
+                    recipient that is not a username, or its title or
+                    content length is out of range
+    """
+    lines = email_content.split('\n')
+    if len(lines) < 5:
+        raise ValueError("Email is missing header lines")
+    if lines[0] != f"From: {sender}":
+        raise ValueError("Email is not from its sender")
+    if not lines[1].startswith("To: "):
+        raise ValueError("Email has no To line")
+    for recipient in lines[1][len("To: "):].split(';'):
+        recipient = recipient.strip()
+        if not recipient or "/" in recipient or "\\" in recipient or \
+                recipient in (".", ".."):
+            raise ValueError(f"Recipient {recipient!r} is not a username")
+    if not lines[2].startswith("Title: ") or \
+            len(lines[2]) - len("Title: ") > TITLE_LIMIT:
+        raise ValueError("Email's title is missing or too long")
+    if not lines[3].startswith("Content Length: "):
+        raise ValueError("Email has no Content Length line")
+    content_length = int(lines[3][len("Content Length: "):])
+    if not 0 <= content_length <= CONTENT_LIMIT:
+        raise ValueError("Email's content length is out of range")
+    if "Content:" not in lines[4:]:
+        raise ValueError("Email has no Content line")
+    return lines
+
+
+def recv_exact(client_socket, size):
+    """
+    Receive exactly the given number of bytes from client.
+
+    Parameters:
+        client_socket: Socket connection to client
+        size (int): Number of bytes to receive
+
+    Returns:
+        bytearray: Received data
+
+    Raises:
+        ConnectionError: If the connection closes first
+    """
+    data = bytearray(size)
+    view = memoryview(data)
+    received = 0
+    while received < size:
+        count = client_socket.recv_into(view[received:])
+        if not count:
+            raise ConnectionError("Connection closed by client")
+        received += count
+    return data
+
+
+def recv_frame(client_socket, cipher):
+    """
+    Receive a message the client sent as one encrypted frame, in the
+    format of send_frame.
+
+    Parameters:
+        client_socket: Socket connection to client
+        cipher: AES cipher for this session
+
+    Returns:
+        bytes: Received message
+
+    Raises:
+        ConnectionError: If the frame is larger than any message a
+                         client sends
+    """
+    length = struct.unpack(">I", recv_exact(client_socket, 4))[0]
+    if length > MAX_CHUNK_SIZE + 16:
+        raise ConnectionError(f"Frame of {length} bytes is too large")
+    padded = recv_exact(client_socket, (length // 16 + 1) * 16)
+    return cipher.decrypt(padded)[:length]
+
+
+def send_stored_email(client_socket, cipher, f, start=0, length=None):
+    """
+    Send a stored email, or a byte range of it, to client under its own
+    content key.
+
+    The email's content key, nonce and the offset the data sent starts
+    at (8 bytes) are sent first, as one frame encrypted with the session
+    cipher, followed by the data's length (4 bytes) and the data
+    encrypted (AES-CTR) with the content key. CTR encryption has no
+    blocks to align, so any range of an email stored encrypted is sent
+    straight from its file with os.sendfile, and costs no work per
+    byte. Emails stored as plain text are encrypted under a new key as
+    they are sent, from a memory map a chunk at a time into one reusable
+    buffer, with the offset sent as 0.
+
+    Parameters:
+        client_socket: Socket connection to client
+        cipher: AES cipher for this session
+        f: Email file opened in binary mode
+        start (int): Offset in the email text of the first byte to send
+        length (int): Number of bytes to send, None for the rest of the
+                      email
+    """
+    sealed = unseal_key(f)
+    data_start = f.tell()
+    size = os.fstat(f.fileno()).st_size - data_start
+    start = min(start, size)
+    if length is None or start + length > size:
+        length = size - start
+
+    if sealed is not None:
+        content_key, nonce = sealed
+        send_frame(client_socket, cipher,
+                   content_key + nonce + struct.pack(">Q", start))
+        client_socket.sendall(struct.pack(">I", length))
+        offset = data_start + start
+        end = offset + length
+        while offset < end:
+            sent = os.sendfile(client_socket.fileno(), f.fileno(), offset,
+                               end - offset)
+            if sent == 0:
+                raise ConnectionError("Connection closed by client")
+            offset += sent
+        return
+
+    content_key = get_random_bytes(32)
+    nonce = get_random_bytes(8)
+    content_cipher = AES.new(content_key, AES.MODE_CTR, nonce=nonce)
+    send_frame(client_socket, cipher,
+               content_key + nonce + struct.pack(">Q", 0))
+    client_socket.sendall(struct.pack(">I", length))
+    if not length:
+        return
+
+    output = memoryview(bytearray(min(SEND_CHUNK_SIZE, length)))
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+        data = memoryview(mapping)
+        try:
+            for chunk_start in range(start, start + length,
+                                     SEND_CHUNK_SIZE):
+                chunk_end = min(chunk_start + SEND_CHUNK_SIZE,
+                                start + length)
+                chunk_length = chunk_end - chunk_start
+                content_cipher.encrypt(data[chunk_start:chunk_end],
+                                       output=output[:chunk_length])
+                client_socket.sendall(output[:chunk_length])
+        finally:
+            # The mapping cannot be closed while views of it exist
+            data.release()
 
 
 class EmailServer:
-    def __init__(self, port=13000):
+    def __init__(self, port=13000, batch_window=0.005):
         """
         Initialize EmailServer object.
 
         Parameters:
             port (int): Port number for server to listen on, defaults to 13000
+            batch_window (float): Seconds the delivery journal waits for
+                                  more emails to commit together
 
         Properties:
             self.port: Server port number
-            self.private_key: Server's RSA private key
-            self.private_cipher: PKCS1_OAEP cipher using server's private key
-            self.user_credentials: Dictionary of valid username/password pairs
-            self.client_public_keys: Dictionary of client public key ciphers
+            self.private_ciphers: Dictionary of server key ID to PKCS1_OAEP
+                                  cipher using that private key
+            self.server_keys_state: Modification times of the key files, used
+                                    to pick up rotated keys while running
+            self.credentials: Store of valid usernames and password hashes
+            self.key_registry: Registry of client public keys and ciphers
+            self.batch_window: Delivery journal group commit window
+            self.journal_pid: Process ID of the delivery journal service
+
+        Raises:
+            SystemExit: If the server's keys cannot be loaded
         """
         self.port = port
-        self.load_server_keys()
+        self.batch_window = batch_window
+        self.journal_pid = None
+        try:
+            self.load_server_keys()
+        except ValueError as e:
+            print(f"Error: {e}. Please run key_generator.py first.")
+            sys.exit(1)
         self.load_user_credentials()
-        self.client_public_keys = {}
+        self.key_registry = KeyRegistry()
 
     def load_server_keys(self):
         """
-        Load the server's private key from PEM file.
+        Load the server's private keys from PEM files.
 
-        Loads server_private.pem and initializes the PKCS1_OAEP cipher
-        for decryption of client messages.
+        Loads server_private.pem along with every key in the server_keys/
+        directory (added by key rotation) and initializes a PKCS1_OAEP
+        cipher for each, indexed by key ID, for decryption of client
+        messages. The keys already loaded are only replaced once every
+        key file has been read.
 
         Raises:
-            SystemExit: If key files not found or invalid
+            ValueError: If a key file cannot be read, or none exist
         """
+        # Read before the keys, so a key changed while they are loaded
+        # is picked up by the next refresh
+        state = self.get_server_keys_state()
 
-        # Server private key file exist
-        try:
-            with open("server_private.pem", "rb") as f:
-                self.private_key = RSA.import_key(f.read())
-                self.private_cipher = PKCS1_OAEP.new(self.private_key)
+        key_paths = glob.glob(os.path.join("server_keys", "*_private.pem"))
+        if os.path.exists("server_private.pem"):
+            key_paths.append("server_private.pem")
 
-        # Server private key file does not exist or cannot be found
-        except FileNotFoundError:
-            print("Error: Server keys not found. Please run key_generator.py first.")
-            sys.exit(1)
+        private_ciphers = {}
+        for key_path in key_paths:
+            try:
+                with open(key_path, "rb") as f:
+                    private_key = RSA.import_key(f.read())
+            except (OSError, ValueError) as e:
+                raise ValueError(f"Server key {key_path} cannot be read "
+                                 f"({e})")
+            key_id = server_key_id(private_key.publickey().export_key())
+            private_ciphers[key_id] = PKCS1_OAEP.new(private_key)
+
+        # No server private key files exist or can be found
+        if not private_ciphers:
+            raise ValueError("Server keys not found")
+
+        self.private_ciphers = private_ciphers
+        self.server_keys_state = state
+
+    def get_server_keys_state(self):
+        """
+        Get the modification times of the server's key files.
+
+        Returns:
+            tuple: Modification times of server_keys/ and server_private.pem,
+                   None for either that does not exist
+        """
+        state = []
+        for path in ("server_keys", "server_private.pem"):
+            try:
+                state.append(os.stat(path).st_mtime_ns)
+            except FileNotFoundError:
+                state.append(None)
+        return tuple(state)
+
+    def refresh_server_keys(self):
+        """
+        Reload the server's private keys if any were added or retired.
+
+        Called before each connection is handed off, so keys rotated with
+        key_generator.py are picked up without restarting the server. If
+        the keys cannot be loaded, the current ones are kept, and loading
+        is tried again before the next connection.
+        """
+        if self.get_server_keys_state() != self.server_keys_state:
+            try:
+                self.load_server_keys()
+            except ValueError as e:
+                print(f"Server keys not reloaded, keeping the current "
+                      f"ones: {e}")
+                return
+            print(f"Server keys reloaded: {', '.join(self.private_ciphers)}")
 
     def load_user_credentials(self):
         """
         Load user credentials from JSON file.
 
-        Reads user_pass.json containing valid username/password pairs.
+        Opens user_pass.json containing valid usernames and their password
+        hashes (or plain passwords). The file is only read once the first
+        client connects, and client directories are created on first
+        delivery, so startup time does not grow with the number of users.
 
         Raises:
             SystemExit: If credentials file not found
@@ -82,16 +494,33 @@ class EmailServer:
 
         # JSON file for user credentials exists
         try:
-            with open("user_pass.json", "r") as f:
-                self.user_credentials = json.load(f)
-            for username in self.user_credentials:
-                self.setup_client_directory(username)
+            self.credentials = CredentialStore("user_pass.json")
 
         # JSON file for user credentials does not exist or cannot be found
         except FileNotFoundError:
             print("Error: user_pass.json not found.")
             sys.exit(1)
 
+    def refresh_user_credentials(self):
+        """
+        Reload user credentials if user_pass.json has changed.
+
+        Called before each connection is handed off, so users can be added,
+        removed or given new passwords without restarting the server. The
+        first call loads the file, before any child is forked, so every
+        child shares one copy of the credentials.
+        """
+        reload = self.credentials.is_loaded()
+        try:
+            changed = self.credentials.refresh()
+        except (OSError, ValueError) as e:
+            # Keep the current credentials if the file is mid-edit
+            print(f"Error reloading user_pass.json: {e}")
+            return
+
+        if reload and changed:
+            print(f"User credentials reloaded: {len(changed)} changed")
+
     def setup_client_directory(self, username):
         """
         Create directory structure for a client.
@@ -103,65 +532,48 @@ class EmailServer:
             str: Path to client's directory
 
         Creates:
-            - Client directory named after username
-            - inbox/ subdirectory for storing emails
-        """
+            - Client directory named after username, for storing emails,
+              sharded under mail/ by the hash of the username
+            - tmp/, new/ and cur/ subdirectories for emails being
+              delivered, unseen emails and seen emails
 
-        client_dir = os.path.join(username)
-        os.makedirs(client_dir, exist_ok=True)
-        return client_dir
+        Called when an email is delivered, so directories only exist for
+        clients that have received mail.
+        """
+        mailbox = Mailbox(username)
+        mailbox.create()
+        return mailbox.path
 
     def store_client_public_key(self, username, public_key_data):
         """
-        Store client's public key and load it into memory.
+        Store client's public key in the key registry.
 
         Parameters:
             username (str): Client's username
             public_key_data (bytes): Client's public key data
 
-        Stores key in client's directory and initializes PKCS1_OAEP cipher
-        for encryption of messages to this client.
-        """
-        # Store in server root directory
-        key_path = f"{username}_public.pem"
-        with open(key_path, "wb") as f:
-            f.write(public_key_data)
-
-        # Setup inbox directory
-        client_dir = os.path.join(username)
-        os.makedirs(client_dir, exist_ok=True)
+        Returns:
+            str: Fingerprint of the stored key
 
-        # Load into memory
-        key = RSA.import_key(public_key_data)
-        self.client_public_keys[username] = PKCS1_OAEP.new(key)
+        Replaces any key previously registered for the client.
+        """
+        return self.key_registry.store(username, public_key_data)
 
-    def load_client_public_key(self, username):
+    def load_client_public_key(self, username, fingerprint=None):
         """
-        Load a client's public key from their directory.
+        Load the cipher for a client's registered public key.
 
         Parameters:
             username (str): Client's username
+            fingerprint (str): Fingerprint of the key the client holds
 
         Returns:
-            PKCS1_OAEP cipher or None if key not found
-
-        Loads existing client public key and initializes cipher for encryption.
+            PKCS1_OAEP cipher or None if no matching key is registered
         """
-        if username not in self.client_public_keys:
-            key_path = f"{username}_public.pem"
-
-            if not os.path.exists(key_path) or os.path.getsize(key_path) == 0:
-                return None
-
-            try:
-                with open(key_path, "rb") as f:
-                    key_data = f.read()
-                    key = RSA.import_key(key_data)
-                    self.client_public_keys[username] = PKCS1_OAEP.new(key)
-            except Exception:
-                return None
-
-        return self.client_public_keys.get(username)
+        try:
+            return self.key_registry.get_cipher(username, fingerprint)
+        except Exception:
+            return None
 
     def handle_client(self, client_socket, client_address):
         """
@@ -178,11 +590,22 @@ class EmailServer:
             - Main service loop for email operations
         """
         try:
-            # Get and decrypt credentials
-            encrypted_creds = client_socket.recv(1024)
+            # Get credentials, tagged with the ID of the server key the
+            # client encrypted them with
+            tagged_creds = client_socket.recv(1024)
+            key_id = tagged_creds[:KEY_ID_LENGTH].decode()
+            encrypted_creds = tagged_creds[KEY_ID_LENGTH:]
+
+            private_cipher = self.private_ciphers.get(key_id)
+            if not private_cipher:
+                client_socket.send(b"Unknown server key")
+                print(f"Client {client_address} used unknown server key "
+                      f"{key_id} (Connection Terminated).")
+                return
 
-            decrypted_creds = self.private_cipher.decrypt(encrypted_creds)
-            username, password = decrypted_creds.decode().split(':')
+            decrypted_creds = private_cipher.decrypt(encrypted_creds)
+            username, rest = decrypted_creds.decode().split(':', 1)
+            password, fingerprint = rest.rsplit(':', 1)
 
             # Verify credentials
             if not self.verify_credentials(username, password):
@@ -197,19 +620,24 @@ class EmailServer:
             # Create directory to store client emails
             # self.setup_client_directory(username)
 
-            # Check if we have the client's public key
-            client_cipher = self.load_client_public_key(username)
+            # Check if we have the key the client holds
+            client_cipher = self.load_client_public_key(username, fingerprint)
             if not client_cipher:
-                # First time connection - receive client's public key
+                # First time connection or new client keys - receive
+                # client's public key
                 client_socket.send(b"NEW_CLIENT")
                 public_key_data = client_socket.recv(2048)
+                if key_fingerprint(public_key_data) != fingerprint:
+                    print(f"Public key from {username} does not match its "
+                          f"fingerprint (Connection Terminated).")
+                    return
                 self.store_client_public_key(username, public_key_data)
-                client_cipher = self.client_public_keys[username]
+                client_cipher = self.load_client_public_key(
+                    username, fingerprint)
 
             # Generate and send symmetric key
             sym_key = get_random_bytes(32)  # 256-bit key
-            encrypted_sym_key = self.client_public_keys[username].encrypt(
-                sym_key)
+            encrypted_sym_key = client_cipher.encrypt(sym_key)
             client_socket.send(encrypted_sym_key)
 
             # Create cipher for this session
@@ -222,6 +650,11 @@ class EmailServer:
             if decrypted_ack != b"OK":
                 return
 
+            # Issue a session ticket the client can log in with next time
+            # instead of its password, skipping the password hash
+            ticket = self.credentials.issue_ticket(username)
+            client_socket.send(cipher.encrypt(ticket.encode().ljust(80)))
+
             # Main service loop
             while True:
                 menu = (
@@ -231,6 +664,12 @@ class EmailServer:
                     "\t2) Display the inbox list\n"
                     "\t3) Display the email contents\n"
                     "\t4) Terminate the connection\n"
+                    "\t5) Check for new emails\n"
+                    "\t6) Wait for new emails\n"
+                    "\t7) Search emails\n"
+                    "\t8) Filter and sort the inbox list\n"
+                    "\t9) Preview an email\n"
+                    "\t10) Send the emails in the outbox\n"
                     "\n\tchoice: "
                 )
                 padded_menu = menu.encode().ljust((len(menu) // 16 + 1) * 16)
@@ -245,6 +684,76 @@ class EmailServer:
                     self.handle_send_email(client_socket, cipher, username)
                 elif choice == "2":
                     self.handle_view_inbox(client_socket, cipher, username)
+                elif choice.startswith("LIST"):
+                    # LIST <offset> <limit> [oldest], a malformed offset
+                    # or limit falls back to listing from the start or
+                    # listing every email
+                    args = choice.split()
+                    self.handle_view_inbox(
+                        client_socket, cipher, username,
+                        offset=parse_count(args, 1, 0),
+                        limit=parse_count(args, 2, None),
+                        newest_first=args[3:] != ["oldest"])
+                elif choice.startswith("SYNC"):
+                    # SYNC <last id> [bodies], a malformed ID syncs every
+                    # email
+                    args = choice.split()
+                    self.handle_sync_inbox(
+                        client_socket, cipher, username,
+                        last_id=parse_count(args, 1, 0),
+                        bodies=args[2:] == ["bodies"])
+                elif choice.startswith("IDLE"):
+                    # IDLE <last id>
+                    self.handle_idle(
+                        client_socket, cipher, username,
+                        last_id=parse_count(choice.split(), 1, 0))
+                elif choice.startswith("SEARCH"):
+                    # SEARCH <query>
+                    self.handle_search(client_socket, cipher, username,
+                                       query=choice[len("SEARCH"):])
+                elif choice.startswith("QUERY"):
+                    # QUERY <JSON filters>
+                    filters = parse_query_filters(choice[len("QUERY"):])
+                    self.handle_query_inbox(client_socket, cipher,
+                                            username, filters=filters)
+                elif choice == "EPOCH":
+                    self.handle_mailbox_epoch(client_socket, cipher,
+                                              username)
+                elif choice == "ATTACH":
+                    # Attachment for emails sent with BATCH
+                    self.handle_upload_attachment(client_socket, cipher,
+                                                  username)
+                elif choice.startswith("BATCH"):
+                    # BATCH <number of emails>
+                    self.handle_send_batch(
+                        client_socket, cipher, username,
+                        count=parse_count(choice.split(), 1, 0))
+                elif choice.startswith("GET"):
+                    # GET <email IDs and ranges of IDs>
+                    self.handle_get_emails(
+                        client_socket, cipher, username,
+                        email_ids=parse_id_list(choice[len("GET"):]))
+                elif choice.startswith("RESUME"):
+                    # RESUME <transfer ID> <chunks received>
+                    args = choice.split()
+                    self.handle_resume_download(
+                        client_socket, cipher, username,
+                        transfer_id=args[1] if len(args) > 1 else "",
+                        received=parse_count(args, 2, None))
+                elif choice.startswith("RECEIVED"):
+                    # RECEIVED <transfer ID>
+                    self.handle_finish_download(
+                        username, transfer_id=choice[len("RECEIVED"):].strip())
+                elif choice.startswith("FETCH"):
+                    # FETCH <email id> HEADERS | BODY <start> <length> |
+                    # ATTACHMENT <number>
+                    args = choice.split()
+                    self.handle_fetch(
+                        client_socket, cipher, username,
+                        email_id=parse_count(args, 1, 0),
+                        part=args[2].upper() if len(args) > 2 else "",
+                        args=[parse_count(args, position, None)
+                              for position in range(3, len(args))])
                 elif choice == "3":
                     self.handle_view_email(client_socket, cipher, username)
                 else:
@@ -262,19 +771,22 @@ class EmailServer:
 
         Parameters:
             username (str): Client's username
-            password (str): Client's password
+            password (str): Client's password or a session ticket issued
+                            by an earlier login
 
         Returns:
             bool: True if credentials are valid, False otherwise
         """
-        return (username in self.user_credentials and
-                self.user_credentials[username] == password)
+        return self.credentials.verify(username, password)
 
     def handle_send_email(self, client_socket, cipher, sender):
         """
         Handle email sending protocol with client.
-        Receives encrypted email from client, adds timestamp,
-        and saves to each recipient's inbox directory.
+        Receives the email's attachments, if any, then the
+        encrypted email, adds timestamp, and commits it to the
+        delivery journal, which delivers it to each recipient's
+        mailbox. Falls back to delivering it directly if the
+        journal service is not running.
         Function will do nothing if receiving Not OK from client.
 
         Parameters:
@@ -282,106 +794,712 @@ class EmailServer:
             cipher: AES cipher for this session
             sender (str): Username of sending client
 
+        Every message from the client is a frame (see recv_frame),
+        so an email of any size arrives whole. Attachments are
+        uploaded before the email, each one announced by an
+        "ATTACH" frame (see handle_upload_attachment). The email
+        lists the attachments it holds, by ID, on an Attachments
+        line before "Content:".
         """
         encrypted_msg = cipher.encrypt(b"Send the email".ljust(16))
         client_socket.send(encrypted_msg)
 
-        # Receive and process email
-        encrypted_email = client_socket.recv(4096)
-        email_content = cipher.decrypt(encrypted_email).strip().decode()
+        # Receive attachments, then the email
+        while True:
+            email_content = recv_frame(client_socket, cipher).decode()
+            if email_content != "ATTACH":
+                break
+            self.handle_upload_attachment(client_socket, cipher, sender)
 
         # Client made an invalid entry (ex. title too long)
         if email_content == "NOK":
             return
 
+        # Parse email content, an email not in the email format is not
+        # sent
+        try:
+            recipients, email_with_time = self.prepare_email(email_content,
+                                                             sender)
+        except ValueError:
+            print(f"An email from {sender} is not in the email format")
+            return
+        content_length = int(email_content.split('\n')[3].split(': ')[1])
+
+        # Save for each recipient, client mailbox is created on first
+        # delivery
+        if append_delivery(recipients, email_with_time) is None:
+            self.deliver_directly([(recipients, email_with_time)])
+
+        print(f"An email from {sender} is sent to \
+                {';'.join(recipients)} has a content length of {content_length}")
+
+    def prepare_email(self, email_content, sender):
+        """
+        Prepare an email received from a client for delivery.
+        Checks it is in the email format (see
+        check_email_format), adds the timestamp, keeps only the
+        attachments the attachment store holds, and adds a
+        reference to each of them for every recipient.
+
+        Parameters:
+            email_content (str): Email as sent by the client
+            sender (str): Username of sending client
+
+        Returns:
+            tuple: (recipients, email text to deliver)
+
+        Raises:
+            ValueError: If the email is not in the email format, or
+                        its Attachments line is not a JSON list
+        """
         # Parse email content
-        lines = email_content.split('\n')
+        lines = check_email_format(email_content, sender)
         recipients = lines[1].split(': ')[1].split(';')
-        content_length = int(lines[3].split(': ')[1])
+        body_line = lines.index("Content:") + 1
+
+        listed = email_attachments(email_content)
+        if not isinstance(listed, list):
+            raise ValueError("Attachments are not a list")
+
+        # Only attachments listed by name, size and ID, that the store
+        # holds, are kept
+        store = AttachmentStore()
+        attachments = [
+            {"name": attachment["name"], "size": attachment["size"],
+             "id": attachment["id"]}
+            for attachment in listed
+            if isinstance(attachment, dict) and
+            isinstance(attachment.get("name"), str) and
+            isinstance(attachment.get("size"), int) and
+            isinstance(attachment.get("id"), str) and
+            store.manifest(attachment["id"]) is not None]
+        header_lines = [line for line in lines[2:body_line - 1]
+                        if not line.startswith("Attachments: ")]
+        if attachments:
+            header_lines.append(f"Attachments: {json.dumps(attachments)}")
 
         # Add timestamp
         timestamp = datetime.datetime.now()
-        email_with_time = (
-            f"{lines[0]}\n"  # From
-            f"{lines[1]}\n"  # To
-            f"Time and Date: {timestamp}\n"
-            f"{lines[2]}\n"  # Title
-            f"{lines[3]}\n"  # Content Length
-            f"{lines[4]}\n"  # Content marker
-            f"{lines[5]}"    # Content
+        email_with_time = "\n".join(
+            lines[:2] +  # From, To
+            [f"Time and Date: {timestamp}"] +
+            header_lines +  # Title, Content Length, Attachments
+            lines[body_line - 1:]  # Content marker, Content
         )
 
-        # Save for each recipient
-        title = lines[2].split(': ')[1]
-        for recipient in recipients:
-            recipient = recipient.strip()
+        # Each recipient's copy of the email holds a reference to its
+        # attachments
+        recipients = [recipient.strip() for recipient in recipients]
+        store.add_refs([attachment["id"] for attachment in attachments],
+                       len(recipients))
+        return recipients, email_with_time
 
-            # Check that client exists
-            recipient_path = os.path.join(recipient)
-            if os.path.exists(recipient_path):
-                email_path = os.path.join(recipient, f"{sender}_{title}.txt")
+    def deliver_directly(self, deliveries):
+        """
+        Deliver emails straight to the recipients' mailboxes, when
+        the delivery journal service is not running or could not
+        commit them in time.
 
-            email_path = os.path.join(recipient, f"{sender}_{title}.txt")
+        Parameters:
+            deliveries (list): (recipients, email text) tuples
+        """
+        for recipients, email_with_time in deliveries:
+            for recipient in recipients:
+                self.setup_client_directory(recipient)
+                Mailbox(recipient).deliver(email_with_time)
 
-            # if client inbox directory doesnt exist, it must be created
-            os.makedirs(os.path.dirname(email_path), exist_ok=True)
-            with open(email_path, "w") as f:
-                f.write(email_with_time)
+    def handle_send_batch(self, client_socket, cipher, sender, count):
+        """
+        Handle batched email sending protocol with client.
+        Receives several emails the client sends one after
+        another without waiting, and commits them to the
+        delivery journal together, so a client sending many
+        emails pays for one round trip and one group commit
+        rather than one of each per email.
 
-        print(f"An email from {sender} is sent to \
-                {';'.join(recipients)} has a content length of {content_length}")
+        Parameters:
+            client_socket: Socket connection to client
+            cipher: AES cipher for this session
+            sender (str): Username of sending client
+            count (int): Number of emails, at most BATCH_LIMIT
+
+        The client is sent a frame once the server is ready,
+        then sends each email, in the format of option 1, as a
+        frame. Each is checked like an email sent with option 1,
+        and one that is not in the email format is not sent.
+        Attachments are uploaded beforehand with ATTACH.
+        Once all are committed the client is sent a JSON list
+        with whether each email was sent.
+        """
+        count = min(count, BATCH_LIMIT)
+        send_frame(client_socket, cipher, b"Send the emails")
+        emails = [recv_frame(client_socket, cipher).decode()
+                  for _ in range(count)]
+
+        deliveries = []
+        results = []
+        for email_content in emails:
+            try:
+                deliveries.append(self.prepare_email(email_content,
+                                                     sender))
+                results.append(True)
+            except ValueError:
+                results.append(False)
+
+        # Emails the journal could not commit are delivered directly
+        lsns = append_deliveries(deliveries) if deliveries else []
+        if lsns is None:
+            lsns = [None] * len(deliveries)
+        self.deliver_directly([delivery for delivery, lsn
+                               in zip(deliveries, lsns) if lsn is None])
+
+        send_frame(client_socket, cipher, json.dumps(results).encode())
+        print(f"A batch of {len(deliveries)} emails from {sender} is sent")
+
+    def handle_upload_attachment(self, client_socket, cipher, username):
+        """
+        Handle attachment upload protocol with client.
+        Receives the list of the attachment's chunks, asks the
+        client for only the chunks the attachment store does not
+        hold yet, and stores them, so a file already sent (by
+        any client) is not uploaded or stored again.
 
-    def handle_view_inbox(self, client_socket, cipher, username):
+        Parameters:
+            client_socket: Socket connection to client
+            cipher: AES cipher for this session
+            username (str): Username of sending client
+
+        The client sends the attachment's size and the SHA-256
+        hash of each chunk as a JSON frame, along with the ID of
+        the transfer to resume, if any. It is sent the transfer's
+        ID, the number of chunks already received and the hashes
+        of the chunks to upload. It then sends each of those
+        chunks as a frame, in that order, and is sent the
+        attachment's ID, or an empty frame if the upload failed.
+        An upload that is not valid (see parse_upload) is
+        answered with an empty frame in place of the chunks to
+        upload.
+
+        Each chunk is stored as soon as it arrives, and counted
+        against the transfer, so an upload cut off by a lost
+        connection is resumed by sending the transfer's ID,
+        only the chunks not yet stored are asked for again.
+        """
+        send_frame(client_socket, cipher, b"Send the attachment")
+        upload = parse_upload(recv_frame(client_socket, cipher))
+        if upload is None:
+            print("Attachment upload failed: upload is not valid")
+            send_frame(client_socket, cipher, b"")
+            return
+
+        store = AttachmentStore()
+        details = {"size": upload["size"], "chunks": upload["chunks"]}
+        transfer_id = upload.get("transfer")
+        transfer = store.get_transfer(transfer_id, username, "upload")
+        if transfer is None or transfer["details"] != details:
+            transfer_id = store.start_transfer(username, "upload", details)
+            received = 0
+        else:
+            received = transfer["offset"]
+
+        missing = store.missing(upload["chunks"])
+        send_frame(client_socket, cipher, json.dumps({
+            "transfer": transfer_id, "received": received,
+            "missing": missing}).encode())
+
+        try:
+            # Every chunk is received even if one fails, so the client
+            # stays in step
+            failed = False
+            for digest in missing:
+                data = recv_frame(client_socket, cipher)
+                if not failed:
+                    try:
+                        store.put_chunk(digest, data)
+                        received += 1
+                        store.update_transfer(transfer_id, received)
+                    except ValueError:
+                        failed = True
+            if failed:
+                raise ValueError("Attachment chunk does not match its hash")
+
+            attachment_id = store.put_manifest(upload["size"],
+                                               upload["chunks"])
+        except ValueError as e:
+            print(f"Attachment upload failed: {e}")
+            send_frame(client_socket, cipher, b"")
+            return
+
+        store.finish_transfer(transfer_id)
+        send_frame(client_socket, cipher, attachment_id.encode())
+
+    def handle_get_emails(self, client_socket, cipher, username,
+                          email_ids):
+        """
+        Handle batched email viewing protocol with client.
+        Sends several emails in one reply, so reading many
+        emails costs one request rather than a round trip each.
+        Their header records are read from the index in one
+        pass, and each email is streamed from its file in turn,
+        then marked as seen.
+
+        Parameters:
+            client_socket: Socket connection to client
+            cipher: AES cipher for this session
+            username (str): Client's username
+            email_ids (list): IDs of the emails to send
+
+        The IDs of the emails found are sent first as a JSON
+        frame, in the order requested, followed by each of those
+        emails under its own content key (see
+        send_stored_email).
+        """
+        mailbox = Mailbox(username)
+        entries = mailbox.get_many(email_ids)
+
+        # Emails are opened before the list is sent, so an email that
+        # cannot be found is left out of it
+        files = []
+        for email_id in email_ids:
+            if email_id in entries:
+                f = mailbox.open(entries[email_id]["name"])
+                if f is not None:
+                    files.append((email_id, f))
+
+        try:
+            send_frame(client_socket, cipher, json.dumps(
+                [email_id for email_id, _ in files]).encode())
+            for email_id, f in files:
+                send_stored_email(client_socket, cipher, f)
+                mailbox.mark_seen(entries[email_id]["name"])
+        finally:
+            for _, f in files:
+                f.close()
+
+    def handle_fetch(self, client_socket, cipher, username, email_id,
+                     part, args):
+        """
+        Handle partial fetch protocol with client.
+        Sends only part of an email: its header lines, a byte
+        range of its body, or one of its attachments, so a
+        client previewing emails does not download them whole.
+        The email is not marked as seen.
+
+        Parameters:
+            client_socket: Socket connection to client
+            cipher: AES cipher for this session
+            username (str): Client's username
+            email_id (int): Email ID
+            part (str): "HEADERS", "BODY" or "ATTACHMENT"
+            args (list): Start and length of the body range, or
+                         the attachment's number, None for any
+                         that is not a whole number
+
+        Every reply starts with a JSON frame describing the part
+        sent, or an empty frame if the email or part does not
+        exist:
+            HEADERS: {"id", "headers", "body_length"}, nothing
+                follows
+            BODY: {"id", "start", "length", "body_length"},
+                followed by the range under the email's content
+                key (see send_stored_email)
+            ATTACHMENT: {"name", "size", "chunks", "transfer",
+                "first_chunk"}, followed by each chunk as a frame
+        """
+        mailbox = Mailbox(username)
+        email = mailbox.get(email_id)
+        header = mailbox.read(email["name"], header_only=True) \
+            if email is not None else None
+        if header is None or None in args:
+            send_frame(client_socket, cipher, b"")
+            return
+
+        if part == "HEADERS":
+            send_frame(client_socket, cipher, json.dumps({
+                "id": email_id, "headers": header,
+                "body_length": email["body_length"]}).encode())
+
+        elif part == "BODY" and len(args) == 2:
+            f = mailbox.open(email["name"])
+            if f is None:
+                send_frame(client_socket, cipher, b"")
+                return
+
+            # Offsets are clipped to the body, and read from the header
+            # index, so nothing before the range is read
+            start = min(max(args[0], 0), email["body_length"])
+            length = min(max(args[1], 0), email["body_length"] - start)
+            with f:
+                send_frame(client_socket, cipher, json.dumps({
+                    "id": email_id, "start": start, "length": length,
+                    "body_length": email["body_length"]}).encode())
+                send_stored_email(client_socket, cipher, f,
+                                  email["body_offset"] + start, length)
+
+        elif part == "ATTACHMENT" and len(args) == 1:
+            self.send_attachment(client_socket, cipher, username, email_id,
+                                 email_attachments(header), args[0])
+
+        else:
+            send_frame(client_socket, cipher, b"")
+
+    def send_attachment(self, client_socket, cipher, username, email_id,
+                        attachments, number, transfer_id=None,
+                        first_chunk=0):
+        """
+        Send one of an email's attachments to client, a chunk at
+        a time.
+
+        Parameters:
+            client_socket: Socket connection to client
+            cipher: AES cipher for this session
+            username (str): Client's username
+            email_id (int): ID of the email holding the attachment
+            attachments (list): Attachments listed in the email
+            number (int): Attachment's position in the list,
+                          counting from 1
+            transfer_id (str): ID of the download being resumed,
+                               None to start a new one
+            first_chunk (int): Number of chunks the client already
+                               has
+
+        The attachment's name, size, chunk hashes and transfer ID
+        are sent as a JSON frame (empty if there is no such
+        attachment), followed by each chunk from first_chunk on
+        as a frame. A download cut off by a lost connection is
+        resumed with RESUME (see handle_resume_download). Chunks
+        sent may still be lost with the connection, so the
+        transfer is kept until the client acknowledges it with
+        RECEIVED (see handle_finish_download), or resumes it with
+        every chunk already received.
+        """
+        store = AttachmentStore()
+        manifest = None
+        if 1 <= number <= len(attachments):
+            attachment = attachments[number - 1]
+            manifest = store.manifest(attachment["id"])
+        if manifest is None:
+            send_frame(client_socket, cipher, b"")
+            return
+
+        if transfer_id is None:
+            transfer_id = store.start_transfer(
+                username, "download", {"email_id": email_id,
+                                       "number": number})
+
+        send_frame(client_socket, cipher, json.dumps(
+            {"name": attachment["name"], **manifest,
+             "transfer": transfer_id, "first_chunk": first_chunk}).encode())
+        for digest in manifest["chunks"][first_chunk:]:
+            send_frame(client_socket, cipher, store.read_chunk(digest))
+        if first_chunk >= len(manifest["chunks"]):
+            store.finish_transfer(transfer_id)
+
+    def handle_resume_download(self, client_socket, cipher, username,
+                               transfer_id, received):
+        """
+        Handle download resuming protocol with client.
+        Sends the rest of an attachment whose download was cut
+        off, from the first chunk the client does not have.
+
+        Parameters:
+            client_socket: Socket connection to client
+            cipher: AES cipher for this session
+            username (str): Client's username
+            transfer_id (str): ID of the download
+            received (int): Number of chunks the client received,
+                            None if it was not a whole number
+
+        The client acknowledges the chunks it received when it
+        resumes, since the server cannot tell how many of the
+        chunks it sent arrived. The reply is in the format of
+        send_attachment, or an empty frame if the transfer is
+        unknown.
+        """
+        store = AttachmentStore()
+        transfer = store.get_transfer(transfer_id, username, "download") \
+            if received is not None else None
+        mailbox = Mailbox(username)
+        email = mailbox.get(transfer["details"]["email_id"]) \
+            if transfer is not None else None
+        header = mailbox.read(email["name"], header_only=True) \
+            if email is not None else None
+        if header is None:
+            send_frame(client_socket, cipher, b"")
+            return
+
+        store.update_transfer(transfer_id, received)
+        self.send_attachment(client_socket, cipher, username, email["id"],
+                             email_attachments(header),
+                             transfer["details"]["number"],
+                             transfer_id, received)
+
+    def handle_finish_download(self, username, transfer_id):
+        """
+        Handle download acknowledgement from client.
+        Forgets a download once the client has received every
+        chunk of it. Nothing is sent back but the menu, and
+        unknown transfers are ignored. Downloads never
+        acknowledged are removed by attachments.py gc.
+
+        Parameters:
+            username (str): Client's username
+            transfer_id (str): ID of the download
+        """
+        store = AttachmentStore()
+        if store.get_transfer(transfer_id, username, "download") is not None:
+            store.finish_transfer(transfer_id)
+
+    def handle_view_inbox(self, client_socket, cipher, username, offset=0,
+                          limit=None, newest_first=True):
         """
         Handle inbox viewing protocol with client.
-        Retrieves list of emails in client's inbox,
-        sorts by timestamp, and sends encrypted list to client.
+        Retrieves one page of the list of emails in client's
+        mailbox from its header index, newest first by default,
+        and sends encrypted list to client. Only the requested
+        page is read, so the cost follows the page size rather
+        than the size of the inbox.
 
         Parameters:
             client_socket: Socket connection to client
             cipher: AES cipher for this session
             username (str): Client's username
+            offset (int): Number of emails to skip
+            limit (int): Maximum number of emails to list, None for all
+            newest_first (bool): List newest emails first
 
+        Email indexes always count from the newest email, whatever
+        the order of the list.
         """
-        h = ["Index", "From", "DateTime", "Title"]                              
-        emails = []                                                             
-        index_count = 1                                                         
-                                                                                    
-        # Cycle through all files in client inbox                               
-        for filepath in glob.glob(os.path.join(username, "*.txt")):             
-            info = []                                                           
-            with open(filepath, "r") as f:                                      
-                # Obtain sender, timestamp, and title info from each email      
-                # Append information to list 'info'                             
-                content = f.read()                                              
-                lines = content.split('\n')                                     
-                sender = lines[0].split(': ')[1]                                
-                info.append(sender)                                             
-                timestamp = lines[2].split(': ')[1]                             
-                info.append(timestamp)                                          
-                title = lines[3].split(': ')[1]                                 
-                info.append(title)                                              
-                # Append 'info' to 'emails', making a list of lists             
-                emails.append(info)                                             
-                                                                                 
-        # Sort by timestamp                                                     
-        emails.sort(key=lambda x: x[1], reverse=True)                           
-                                                                                    
-        # Format headers                                                        
-        inbox_list = f"{h[0]:<8} {h[1]:<9} {h[2]:<30} {h[3]:<20}"               
-        inbox_list += f"\n"                                                     
-                                                                                    
-        # Concatenate formatted email information                               
-        for i in emails:                                                        
-            idx_str = str(index_count)                                          
-            inbox_list += f"{idx_str:<8} {i[0]:<9} {i[1]:<30} {i[2]:<20}"       
-            index_count += 1                                                    
-            inbox_list += f"\n"  
+        mailbox = Mailbox(username)
+        total = mailbox.count()
+        emails = mailbox.page(offset, limit, newest_first)
+        self.send_inbox_list(client_socket, cipher, emails, total,
+                             mailbox.last_id())
+
+    def handle_query_inbox(self, client_socket, cipher, username, filters):
+        """
+        Handle filtered inbox viewing protocol with client.
+        Retrieves one page of the emails in client's mailbox
+        matching a sender, title prefix and/or date range, in
+        the requested order, and sends encrypted list to client.
+        The mailbox's header indexes answer the query, so only
+        matching emails are looked at.
+
+        Parameters:
+            client_socket: Socket connection to client
+            cipher: AES cipher for this session
+            username (str): Client's username
+            filters (dict): Filters, order and page, see
+                            parse_query_filters, None if they were not
+                            valid
+
+        The list is sent in the same format as the inbox list. An
+        empty list is sent if the filters were not valid.
+        """
+        mailbox = Mailbox(username)
+        if filters is None:
+            emails, total = [], 0
+        else:
+            emails, total = mailbox.query(**filters)
+        self.send_inbox_list(client_socket, cipher, emails, total,
+                             mailbox.last_id())
+
+    def send_inbox_list(self, client_socket, cipher, emails, total,
+                        newest_id):
+        """
+        Send a page of an inbox list to client, and wait for the
+        client's acknowledgment.
+
+        Parameters:
+            client_socket: Socket connection to client
+            cipher: AES cipher for this session
+            emails (list): Headers of the emails listed
+            total (int): Number of emails in the whole list
+            newest_id (int): ID of the newest email in the mailbox
+
+        The list is preceded by a JSON line holding the total
+        number of emails in the list, so the client can page
+        through it, and the ID of the email at each index listed,
+        so it can tell which emails it already has a copy of.
+        """
+        h = ["Index", "From", "DateTime", "Title"]
+
+        # Format headers
+        inbox_list = f"{h[0]:<8} {h[1]:<9} {h[2]:<30} {h[3]:<20}"
+        inbox_list += f"\n"
+
+        # Concatenate formatted email information. Email IDs have no
+        # gaps, so an email's index counting from the newest email
+        # follows from its ID
+        ids = {}
+        for i in emails:
+            idx_str = str(newest_id - i["id"] + 1)
+            ids[idx_str] = i["id"]
+            inbox_list += (f"{idx_str:<8} {i['from']:<9} {i['date']:<30} "
+                           f"{i['title']:<20}")
+            inbox_list += f"\n"
+
+        inbox_list = json.dumps({"total": total, "ids": ids}) + "\n" + \
+            inbox_list
 
         # Send to client
-        encrypted_list = cipher.encrypt(
-            inbox_list.encode().ljust((len(inbox_list) // 16 + 1) * 16))
-        client_socket.send(encrypted_list)
+        send_frame(client_socket, cipher, inbox_list.encode())
+
+        # Wait for acknowledgment
+        client_socket.recv(1024)
+
+    def handle_mailbox_epoch(self, client_socket, cipher, username):
+        """
+        Handle mailbox epoch protocol with client.
+        Sends the epoch of the client's mailbox as a frame. A
+        client keeping emails or its sync mark by email ID
+        drops them when the epoch changes, since the IDs were
+        given out afresh (see Mailbox.epoch).
+
+        Parameters:
+            client_socket: Socket connection to client
+            cipher: AES cipher for this session
+            username (str): Client's username
+        """
+        send_frame(client_socket, cipher, Mailbox(username).epoch().encode())
+
+    def handle_sync_inbox(self, client_socket, cipher, username, last_id,
+                          bodies=False):
+        """
+        Handle inbox sync protocol with client.
+        Sends the client only the emails delivered after the
+        last email ID it has seen, read from the end of the
+        mailbox's header index, so polling clients receive
+        nothing but new emails.
+
+        Parameters:
+            client_socket: Socket connection to client
+            cipher: AES cipher for this session
+            username (str): Client's username
+            last_id (int): ID of the last email the client has seen
+            bodies (bool): Send the full email text along with
+                           each email's headers
+
+        The reply's first line holds the ID of the newest email
+        in the mailbox, the client's next high-water mark,
+        followed by one JSON line per new email, oldest first.
+        """
+        reply, _ = self.build_sync_reply(username, last_id, bodies)
+
+        # Send to client
+        send_frame(client_socket, cipher, reply)
+
+        # Wait for acknowledgment
+        client_socket.recv(1024)
+
+    def build_sync_reply(self, username, last_id, bodies=False):
+        """
+        Build the list of emails delivered after an email ID, as
+        sent by the sync and idle protocols.
+
+        Parameters:
+            username (str): Client's username
+            last_id (int): ID of the last email the client has seen
+            bodies (bool): Include the full email text
+
+        Returns:
+            tuple: (reply bytes, ID of the newest email)
+        """
+        mailbox = Mailbox(username)
+        emails = mailbox.since(last_id)
+        if bodies:
+            for email in emails:
+                email["content"] = mailbox.read(email["name"])
+
+        newest_id = emails[-1]["id"] if emails else max(last_id, 0)
+        reply = f"{newest_id}\n"
+        reply += "".join(json.dumps(email) + "\n" for email in emails)
+        return reply.encode(), newest_id
+
+    def handle_idle(self, client_socket, cipher, username, last_id):
+        """
+        Handle idle protocol with client.
+        Subscribes to the journal's notifications for the
+        client's mailbox and pushes each new email's headers
+        to the client as soon as it is filed, until the client
+        sends DONE. Nothing is read from the mailbox between
+        notifications, so idle clients cost no polling.
+
+        Parameters:
+            client_socket: Socket connection to client
+            cipher: AES cipher for this session
+            username (str): Client's username
+            last_id (int): ID of the last email the client has seen
+
+        Each push is a frame in the sync format. An empty frame
+        ends the idle session once the client sends DONE.
+        """
+        # Subscribe before checking the mailbox, so an email filed in
+        # between is not missed (subscribe returns once the journal has
+        # registered the subscription)
+        notifications = subscribe(username)
+        watched = [client_socket]
+        if notifications is not None:
+            watched.append(notifications)
+
+        try:
+            while True:
+                reply, newest_id = self.build_sync_reply(username, last_id)
+                if newest_id != last_id:
+                    send_frame(client_socket, cipher, reply)
+                    last_id = newest_id
+
+                # Without the journal service there are no notifications,
+                # so the mailbox is checked every few seconds instead
+                readable, _, _ = select.select(
+                    watched, [], [], None if notifications else 5)
+
+                if notifications in readable:
+                    if recv_message(notifications) is None:
+                        watched.remove(notifications)
+                        notifications.close()
+                        notifications = None
+
+                if client_socket in readable:
+                    # Client is done waiting
+                    client_socket.recv(1024)
+                    send_frame(client_socket, cipher, b"")
+                    return
+        finally:
+            if notifications is not None:
+                notifications.close()
+
+    def handle_search(self, client_socket, cipher, username, query):
+        """
+        Handle search protocol with client.
+        Looks the query up in the mailbox's search index and
+        sends the headers of the newest matching emails to the
+        client, so it does not have to download the inbox to
+        find an email.
+
+        Parameters:
+            client_socket: Socket connection to client
+            cipher: AES cipher for this session
+            username (str): Client's username
+            query (str): Search query, see search.py
+
+        The reply holds one JSON line per matching email, with
+        its ID and its index in the inbox list.
+        """
+        mailbox = Mailbox(username)
+        emails = mailbox.search(query, SEARCH_LIMIT)
+
+        # An email's index counting from the newest email follows from
+        # its ID, like in the inbox list
+        newest_id = mailbox.last_id()
+        reply = ""
+        for email in emails:
+            email["index"] = newest_id - email["id"] + 1
+            reply += json.dumps(email) + "\n"
+
+        # Send to client
+        send_frame(client_socket, cipher, reply.encode())
 
         # Wait for acknowledgment
         client_socket.recv(1024)
@@ -390,13 +1508,27 @@ class EmailServer:
         """
         Handle email viewing protocol with client.
         Receives email index from client, retrieves corresponding
-        email from inbox, and sends encrypted content to client.
+        email from mailbox, sends encrypted content to client and
+        marks the email as seen.
+
+        A client with its own copy of the email sends
+        "CACHED <id>" instead of the index, in which case the
+        email is only marked as seen and nothing is sent back.
+        A client viewing several emails at once sends
+        "GET <email IDs>" for the emails it has listed, followed
+        by "INDEXES <indexes and ranges of indexes>" for any it
+        has not, and is sent them all in one reply (see
+        handle_get_emails).
 
         Parameters:
             client_socket: Socket connection to client
             cipher: AES cipher for this session
             username (str): Client's username
 
+        The email's ID is sent as one frame, 0 if the index is
+        invalid, followed by the email under its own content
+        key (see send_stored_email). The email is streamed from
+        its file rather than read into memory.
         """
         # Request email index
         request = cipher.encrypt(b"the server request email index".ljust(32))
@@ -404,42 +1536,92 @@ class EmailServer:
 
         # Get email index
         encrypted_index = client_socket.recv(1024)
-        index = int(cipher.decrypt(encrypted_index).strip())
+        index = cipher.decrypt(encrypted_index).strip().decode()
 
-        # Get email content
-        emails = sorted(
-            glob.glob(os.path.join(username, "*.txt")),
-            key=lambda x: os.path.getmtime(x),
-            reverse=True
-        )
+        mailbox = Mailbox(username)
+        if index.startswith("CACHED"):
+            email = mailbox.get(parse_count(index.split(), 1, 0))
+            if email is not None:
+                mailbox.mark_seen(email["name"])
+            return
 
-        if 0 < index <= len(emails):
-            with open(emails[index-1], "r") as f:
-                content = f.read()
-                encrypted_content = cipher.encrypt(
-                    content.encode().ljust((len(content) // 16 + 1) * 16))
-                client_socket.send(encrypted_content)
-        else:
-            encrypted_msg = cipher.encrypt(b"Invalid email index".ljust(32))
-            client_socket.send(encrypted_msg)
+        if index.startswith(("GET", "INDEXES")):
+            ids, _, indexes = index.partition("INDEXES")
+            try:
+                email_ids = parse_id_list(ids[len("GET"):]) if ids else []
+                # Indexes count from the newest email, like the inbox
+                # list, so they are only used for emails not yet listed
+                newest_id = mailbox.last_id()
+                email_ids += [newest_id - index + 1 for index in
+                              parse_id_list(indexes)]
+            except ValueError:
+                email_ids = []
+            self.handle_get_emails(client_socket, cipher, username,
+                                   email_ids=list(dict.fromkeys(
+                                       email_ids))[:GET_LIMIT])
+            return
+
+        # Get email content, counting from the newest email like the
+        # inbox list
+        index = int(index) if index.isdigit() else 0
+        emails = mailbox.page(index - 1, 1) if index > 0 else []
+
+        f = mailbox.open(emails[0]["name"]) if emails else None
+        if f is None:
+            send_frame(client_socket, cipher, b"0")
+            return
+
+        with f:
+            send_frame(client_socket, cipher, str(emails[0]["id"]).encode())
+            send_stored_email(client_socket, cipher, f)
+        mailbox.mark_seen(emails[0]["name"])
+
+    def start_journal(self, server_socket):
+        """
+        Start the delivery journal service in its own process.
+
+        Replays any emails left in the journal by a crash before the
+        server starts accepting connections.
+
+        Parameters:
+            server_socket: Listening socket, closed in the journal process
+        """
+        journal = DeliveryJournal(batch_window=self.batch_window)
+        replayed = journal.recover()
+        if replayed:
+            print(f"Delivery journal replayed {replayed} emails")
+
+        pid = os.fork()
+        if pid == 0:  # Journal process
+            server_socket.close()
+            try:
+                journal.run()
+            except KeyboardInterrupt:
+                pass
+            os._exit(0)
+
+        self.journal_pid = pid
 
     def start(self):
         """
         Start the email server.
 
-        Creates socket, binds to port, and enters main server loop.
+        Creates socket, binds to port, starts the delivery journal
+        service, and enters main server loop.
         Uses fork() to handle multiple clients concurrently.
         Handles graceful shutdown on keyboard interrupt.
         """
-
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         server_socket.bind(('', self.port))
         server_socket.listen(5)
+        self.start_journal(server_socket)
         print("The server is ready to accept connections")
 
         while True:
             try:
                 client_socket, client_address = server_socket.accept()
+                self.refresh_server_keys()
+                self.refresh_user_credentials()
 
                 # Fork for each client connection
                 pid = os.fork()
@@ -453,6 +1635,7 @@ class EmailServer:
                     client_socket.close()
             except KeyboardInterrupt:
                 print("\nServer shutting down...")
+                os.kill(self.journal_pid, signal.SIGTERM)
                 break
             except Exception as e:
                 print(f"Error accepting connection: {e}")